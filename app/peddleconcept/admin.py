@@ -5,12 +5,15 @@ from django.db import models, transaction
 from django.template.loader import render_to_string
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
+from django.utils.timezone import localdate
 import json
 from .models import *
 from .actions import download_as_csv
 
 from admin_action_buttons.admin import ActionButtonsMixin
 from peddleconcept.deputy_api import DeputyAPI
+from peddleconcept.settings import bump_settings_version
+from peddleconcept.tours.schedules import on_schedule_changed, sync_tour_rosters_range
 
 class MyJSONFormField(forms.JSONField):
     def prepare_value(self, value):
@@ -26,6 +29,51 @@ class MyModelAdmin(ActionButtonsMixin, admin.ModelAdmin):
         }
         return super().get_form(request, obj, field_classes=field_classes, **kwargs)
 
+class TourSummaryAdminMixin:
+    """
+    Keep the Tour Dashboard summaries and cached schedule data up to date when tours, or their riders, venues or
+    sessions are changed in the admin
+    """
+    summary_date_field = 'time_start'
+
+    def get_summary_dates(self, queryset):
+        # venues and sessions might not have any tours
+        return set(localdate(t) for t in queryset.values_list(self.summary_date_field, flat=True) if t is not None)
+
+    def save_model(self, request, obj, form, change):
+        # remember the original date in case it changes
+        obj._summary_dates = self.get_summary_dates(self.model.objects.filter(pk=obj.pk))
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        obj = form.instance
+        on_schedule_changed(obj._summary_dates | self.get_summary_dates(self.model.objects.filter(pk=obj.pk)))
+
+    def delete_model(self, request, obj):
+        dates = self.get_summary_dates(self.model.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+        on_schedule_changed(dates)
+
+    def delete_queryset(self, request, queryset):
+        dates = self.get_summary_dates(queryset)
+        super().delete_queryset(request, queryset)
+        on_schedule_changed(dates)
+
+class SettingsVersionAdminMixin:
+    """ Clear the cached settings (and venues) in every process when these objects are changed in the admin """
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        bump_settings_version()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_settings_version()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        bump_settings_version()
+
 #@admin.register(Rider)
 #class RiderAdmin(MyModelAdmin):
 #    list_display = ('name', 'display_name', 'phone', 'email', 'user')
@@ -47,31 +95,34 @@ class TourVenueInline(admin.TabularInline):
     }
 
 @admin.register(TourRider)
-class TourRiderAdmin(MyModelAdmin):
+class TourRiderAdmin(TourSummaryAdminMixin, MyModelAdmin):
+    summary_date_field = 'tour__time_start'
     list_display = ('__str__', 'tour', 'person')
     list_filter = ('tour__time_start', 'tour__tour_type')
     ordering = ['-tour__time_start']
 
 @admin.register(TourVenue)
-class TourVenueAdmin(MyModelAdmin):
+class TourVenueAdmin(TourSummaryAdminMixin, MyModelAdmin):
+    summary_date_field = 'tour__time_start'
     list_display = ('__str__', 'tour', 'venue')
     list_filter = ('tour__time_start', 'tour__tour_type', 'venue')
     ordering = ['-tour__time_start']
 
 @admin.register(Session)
-class SessionAdmin(MyModelAdmin):
+class SessionAdmin(TourSummaryAdminMixin, MyModelAdmin):
+    summary_date_field = 'tours__time_start'
     list_display = ('source_row_id', 'session_type', 'source', 'time_start', 'time_end', 'updated')
     list_filter = ('source', 'source_row_state', 'time_start', 'session_type')
     ordering = ['-time_start', 'session_type']
     search_fields = ('source_row_id', 'session_type', )
 
 @admin.register(Venue)
-class VenueAdmin(MyModelAdmin):
+class VenueAdmin(SettingsVersionAdminMixin, MyModelAdmin):
     list_display = ('name', 'drink_special')
 
 
 @admin.register(Tour)
-class TourAdmin(MyModelAdmin):
+class TourAdmin(TourSummaryAdminMixin, MyModelAdmin):
     list_display = ('source_row_id', 'customer_name', 'tour_area', 'tour_type', 'time_start', 'time_end', 'updated')
     list_filter = ('source', 'source_row_state', 'time_start', 'tour_area', 'tour_type')
     ordering = ['-time_start', 'tour_type']
@@ -85,9 +136,15 @@ class TourAdmin(MyModelAdmin):
 class RiderPaySlotAdmin(MyModelAdmin):
     list_display = ('__str__', 'person', 'time_start', 'time_end', 'pay_minutes')
     list_filter = ('person', 'time_start')
+    actions = [download_as_csv]
+    download_as_csv_fields = [
+        'id', ('person__first_name', 'First name'), ('person__last_name', 'Last name'),
+        'slot_type', 'time_start', 'time_end', 'pay_minutes', 'pay_rate', 'pay_reason', 'description',
+        ('tour_rider__tour__tour_type', 'Tour type'), 'source_row_state',
+    ]
 
 @admin.register(Settings)
-class SettingsAdmin(MyModelAdmin):
+class SettingsAdmin(SettingsVersionAdminMixin, MyModelAdmin):
     list_display = ('name', 'data')
 
 @admin.register(ChangeLog)
@@ -96,6 +153,7 @@ class ChangeLogAdmin(MyModelAdmin):
     list_filter = ('model_type', 'change_remote', 'change_type', 'timestamp')
     ordering = ['-timestamp']
     search_fields = ('model_description', 'change_description')
+    actions = [download_as_csv]
 
     def has_add_permission(self, request):
         return False
@@ -218,7 +276,7 @@ class AreaAdmin(MyModelAdmin):
     ordering = ['sort_order']
     list_filter = ['active', 'deputy_sync_enabled']
     search_fields = ['tour_locations']
-    actions = ['disable_sync', 'enable_sync']
+    actions = ['disable_sync', 'enable_sync', 'sync_rosters_week', 'publish_rosters_week']
 
     @admin.display(description='Tour Pickup Locations')
     def tour_locations_html(self, obj):
@@ -235,4 +293,28 @@ class AreaAdmin(MyModelAdmin):
                 obj.save()
                 num_update += 1
 
-        messages.success(request, "Sync disabled for %d items" % num_update)
\ No newline at end of file
+        messages.success(request, "Sync disabled for %d items" % num_update)
+
+    def sync_rosters(self, request, queryset, publish):
+        start_date = localdate()
+        areas = [area for area in queryset if area.deputy_sync_enabled]
+        if not areas:
+            messages.error(request, 'None of the selected areas have Deputy sync enabled')
+            return
+        rosters, roster_errors = sync_tour_rosters_range(start_date, 7, areas=areas, publish=publish)
+        messages.success(request, '%s %d rosters in Deputy from %s for %s' % (
+            'Published' if publish else 'Synced', len(rosters), start_date.isoformat(),
+            ', '.join(area.name for area in areas),
+        ))
+        if roster_errors:
+            messages.error(request, '%d rosters could not be updated in Deputy, check them in the Tour Schedule Editor' % (
+                len(roster_errors)
+            ))
+
+    @admin.action(description='Sync rosters for the next 7 days to Deputy')
+    def sync_rosters_week(self, request, queryset):
+        self.sync_rosters(request, queryset, publish=False)
+
+    @admin.action(description='Sync and publish rosters for the next 7 days in Deputy')
+    def publish_rosters_week(self, request, queryset):
+        self.sync_rosters(request, queryset, publish=True)
\ No newline at end of file
@@ -1,7 +1,12 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
 
 
 class PeddleconceptConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'peddleconcept'
     verbose_name = 'Rosters & Schedules'
+
+    def ready(self):
+        from peddleconcept.settings import check_settings_version
+        request_started.connect(check_settings_version, dispatch_uid='peddleconcept_settings_version')
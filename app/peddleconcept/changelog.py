@@ -0,0 +1,145 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.timezone import localtime
+from datetime import timedelta
+from pathlib import Path
+import gzip
+import json
+import logging
+import re
+
+from peddleconcept.models import ChangeLog
+from peddleconcept.settings import get_changelog_retention_setting
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = (
+    'id', 'model_type', 'model_description', 'change_remote', 'change_type', 'change_description', 'data',
+    'timestamp', 'timestamp_saved',
+)
+
+# identifies the record in the model_description of ChangeLogs from MutableDataRecord
+RECORD_KEY_RE = re.compile(r'\[pk=\S* source_row_id=[^\]]*\]$')
+
+def get_archive_dir(config):
+    if config.get('archive_dir'):
+        return Path(config['archive_dir'])
+    return settings.BASE_DIR.parent / 'changelog_archive'
+
+def get_archive_path(archive_dir, timestamp):
+    """ the archive is split into one file per month, by the local time of each change """
+    return archive_dir / ('changelog-%s.jsonl.gz' % localtime(timestamp).strftime('%Y-%m'))
+
+def archive_changelog(cutoff, archive_dir=None, batch_size=2000, dry_run=False):
+    """
+    Move the ChangeLogs from before cutoff to compressed JSON lines files in archive_dir (or just delete them if
+    archive_dir is None), batch_size rows at a time. Each batch is only deleted after it has been written, so rows
+    may be archived twice if interrupted, but are never lost. Returns the number of rows removed.
+    """
+    if archive_dir is not None and not dry_run:
+        archive_dir.mkdir(parents=True, exist_ok=True)
+
+    num_removed = 0
+    last_id = 0
+    while True:
+        rows = list(ChangeLog.objects.filter(
+            timestamp__lt=cutoff, id__gt=last_id,
+        ).order_by('id').values(*ARCHIVE_FIELDS)[:batch_size])
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        num_removed += len(rows)
+        if dry_run:
+            continue
+
+        if archive_dir is not None:
+            rows_by_path = {}
+            for row in rows:
+                rows_by_path.setdefault(get_archive_path(archive_dir, row['timestamp']), []).append(row)
+            for path, path_rows in rows_by_path.items():
+                # appending adds another gzip member to the file, which is read back as a single stream
+                with gzip.open(path, 'at', encoding='utf-8') as f:
+                    for row in path_rows:
+                        f.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+
+        ChangeLog.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        logger.info('archive_changelog: removed %d rows up to id %d' % (len(rows), last_id))
+
+    return num_removed
+
+def get_record_key(chglog):
+    match = RECORD_KEY_RE.search(chglog['model_description'])
+    return (
+        chglog['model_type'], chglog['change_remote'],
+        match.group(0) if match else chglog['model_description'],
+    )
+
+def compact_changelog(batch_size=2000, dry_run=False):
+    """
+    Collapse 'changed' ChangeLogs which repeat the previous change to the same record (eg. a scan which keeps
+    overwriting a local edit with the same value) into the first one, which counts the repeats in data['repeat_count'] and keeps the
+    time of the last one in data['last_timestamp']. Returns the number of rows removed.
+    """
+    qs = ChangeLog.objects.filter(change_type='changed').order_by('id').values(
+        'id', 'model_type', 'model_description', 'change_remote', 'change_description', 'data', 'timestamp',
+    )
+    # record key -> the last distinct change to that record
+    last_changes = {}
+    kept_changed = {} # id -> kept ChangeLog which absorbed some repeats
+    repeat_ids = []
+
+    for chglog in qs.iterator(chunk_size=batch_size):
+        key = get_record_key(chglog)
+        prev = last_changes.get(key)
+        if prev is None or prev['change_description'] != chglog['change_description']:
+            last_changes[key] = chglog
+            continue
+
+        data = prev['data'] if isinstance(prev['data'], dict) else {}
+        # the repeat might have absorbed repeats itself in an earlier compaction
+        repeat_data = chglog['data'] if isinstance(chglog['data'], dict) else {}
+        data['repeat_count'] = data.get('repeat_count', 1) + repeat_data.get('repeat_count', 1)
+        data['last_timestamp'] = repeat_data.get('last_timestamp') or chglog['timestamp'].isoformat()
+        prev['data'] = data
+        kept_changed[prev['id']] = prev
+        repeat_ids.append(chglog['id'])
+
+    if dry_run or not repeat_ids:
+        return len(repeat_ids)
+
+    with transaction.atomic():
+        ChangeLog.objects.bulk_update(
+            [ChangeLog(id=chglog['id'], data=chglog['data']) for chglog in kept_changed.values()],
+            fields=['data'], batch_size=batch_size,
+        )
+        for i in range(0, len(repeat_ids), batch_size):
+            ChangeLog.objects.filter(id__in=repeat_ids[i:i + batch_size]).delete()
+
+    return len(repeat_ids)
+
+def apply_changelog_retention(keep_days=None, archive=None, archive_dir=None, compact=None, dry_run=False):
+    """
+    Apply the changelog retention setting (see settings.get_changelog_retention_setting), any of which can be
+    overridden by the arguments. Returns a dict of the number of rows archived and compacted.
+    """
+    config = get_changelog_retention_setting()
+    keep_days = int(keep_days if keep_days is not None else config['keep_days'])
+    archive = archive if archive is not None else config['archive']
+    compact = compact if compact is not None else config['compact_changes']
+    batch_size = int(config.get('batch_size') or 2000)
+
+    cutoff = timezone.now() - timedelta(days=keep_days)
+    num_archived = archive_changelog(
+        cutoff,
+        archive_dir=(Path(archive_dir) if archive_dir else get_archive_dir(config)) if archive else None,
+        batch_size=batch_size,
+        dry_run=dry_run,
+    )
+    num_compacted = compact_changelog(batch_size=batch_size, dry_run=dry_run) if compact else 0
+
+    return {
+        'archived' if archive else 'deleted': num_archived,
+        'compacted': num_compacted,
+    }
@@ -1,7 +1,11 @@
 import logging
+from datetime import timedelta
 from django.db import transaction
 from django.db.models import Q
-from peddleconcept.models import Person, Area, Roster, ChangeLog
+from django.utils import timezone
+from peddleconcept.models import Person, Area, Roster, ChangeLog, DeputyTimeOff
+from peddleconcept.settings import get_deputy_api_setting
+from peddleconcept.util import json_datetime, from_json_datetime, add_days
 from django.contrib import messages
 
 from peddleconcept.deputy_api import DeputyAPI
@@ -107,6 +111,89 @@ def sync_deputy_areas(push_deputy=True, dry_run=False):
     ))
     return status_msg
 
+def refresh_deputy_time_off(dates, api=None):
+    """
+    Query Deputy for the leave and unavailability on the dates (with a single date range query) and cache it in
+    DeputyTimeOff rows. Returns the updated rows in the same order as dates.
+    """
+    dates = list(dates)
+    if not dates:
+        return []
+    if api is None:
+        api = DeputyAPI()
+
+    time_off_by_date = api.query_leave_unavailability_range(min(dates), max(dates))
+    now = timezone.now()
+    rows = []
+    for time_off_date in dates:
+        row, created = DeputyTimeOff.objects.update_or_create(time_off_date=time_off_date, defaults={
+            'data': {
+                emp_id: [[json_datetime(start), json_datetime(end), comment] for start, end, comment in emp_time]
+                for emp_id, emp_time in time_off_by_date[time_off_date].items()
+            },
+            'updated': now,
+        })
+        rows.append(row)
+    return rows
+
+def refresh_upcoming_deputy_time_off(start_date, num_days=None):
+    """ Refresh the cached time off for the upcoming days (default from the Deputy API settings) """
+    if num_days is None:
+        num_days = int(get_deputy_api_setting().get('time_off_days_ahead', 14))
+    rows = refresh_deputy_time_off([add_days(start_date, day) for day in range(num_days)])
+    # nothing will ask for the past dates again
+    DeputyTimeOff.objects.filter(time_off_date__lt=start_date).delete()
+    return rows
+
+def refresh_stale_deputy_time_off(start_date):
+    """
+    Refresh the cached time off for the upcoming days if any of them are missing or past half of
+    time_off_stale_minutes, so the editor never shows stale data. Called from the dispatch command.
+    Returns the refreshed rows, or [] if they were all up to date.
+    """
+    deputy_conf = get_deputy_api_setting()
+    num_days = int(deputy_conf.get('time_off_days_ahead', 14))
+    refresh_before = timezone.now() - timedelta(minutes=int(deputy_conf.get('time_off_stale_minutes', 60)) / 2)
+    num_fresh = DeputyTimeOff.objects.filter(
+        time_off_date__range=(start_date, add_days(start_date, num_days - 1)), updated__gte=refresh_before,
+    ).count()
+    if num_fresh >= num_days:
+        return []
+    return refresh_upcoming_deputy_time_off(start_date, num_days)
+
+def is_deputy_time_off_stale(row):
+    if row is None or getattr(row, 'refresh_failed', False):
+        return True
+    stale_minutes = int(get_deputy_api_setting().get('time_off_stale_minutes', 60))
+    return row.updated < timezone.now() - timedelta(minutes=stale_minutes)
+
+def get_deputy_time_off(time_off_date, refresh=False):
+    """
+    Returns the cached leave and unavailability on the date, in the same format as
+    DeputyAPI.query_leave_unavailability(), plus the DeputyTimeOff row to check how old it is (None if the date
+    isn't cached). Deputy is only queried if refresh=True: if that fails, the cached row is kept but marked with
+    refresh_failed, so it shows as stale.
+    """
+    row = DeputyTimeOff.objects.filter(time_off_date=time_off_date).first()
+    if refresh:
+        try:
+            row = refresh_deputy_time_off([time_off_date])[0]
+        except Exception as e:
+            if row is None:
+                raise
+            logger.error('Error refreshing Deputy time off for %s, using the cached data: %s: %s' % (
+                time_off_date.isoformat(), type(e).__name__, str(e)))
+            row.refresh_failed = True
+
+    if row is None:
+        # not waiting for Deputy: the upcoming days are refreshed by the dispatch command
+        return {}, None
+
+    return {
+        emp_id: [(from_json_datetime(start), from_json_datetime(end), comment) for start, end, comment in emp_time]
+        for emp_id, emp_time in row.data.items()
+    }, row
+
 def person_name_key(person):
     fname = (person.first_name or '').lower().split()
     lname = (person.last_name or '').lower().split()
@@ -241,7 +328,15 @@ def sort_rosters(rosters_list):
     )
 
 def sync_deputy_rosters(tours_date, area, tour_rosters_list, publish_keys=None, dry_run=False):
+    """ Sync the rosters for the tour schedule of one date and area, see sync_deputy_rosters_range() """
+    return sync_deputy_rosters_range(tours_date, tours_date, [area], tour_rosters_list,
+        publish_keys=publish_keys, dry_run=dry_run)
+
+def sync_deputy_rosters_range(start_date, end_date, areas, tour_rosters_list, publish_keys=None, dry_run=False):
     """
+    Sync the rosters for the tour schedule of all the areas and dates from start_date to end_date at once, with a
+    single Roster QUERY, then adding and updating rosters in as few BULK calls as possible.
+
     Shift swaps? Some rosters in Deputy may be changed remotely - if they match the key then 
         we could update them locally.
         - but this would also have to update the tour riders, in theory, so we don't do that
@@ -266,21 +361,24 @@ def sync_deputy_rosters(tours_date, area, tour_rosters_list, publish_keys=None,
 
     api = DeputyAPI()
     try:
-        dpt_rosters = api.query_rosters(tours_date, tours_date, area, people_by_srid=people_by_srid)
+        dpt_rosters = api.query_rosters_range(start_date, end_date, areas, people_by_srid=people_by_srid)
     except Exception as e:
         logger.error('Deputy query_rosters error: %s: %s' % (type(e).__name__, str(e)))
         return [], []
     
+    # the same shift could be rostered in more than one area
+    def roster_key(roster):
+        return (roster.area.source_row_id if roster.area else '', roster.cmp_key())
+
     # Live Rosters in Deputy
     dpt_rosters_by_key = {} # match with tour schedule shifts
-    dpt_rosters_manual = [] # rosters not created automatically in Deputy will not be affected by the sync
     for roster in dpt_rosters:
-        key = roster.cmp_key()
+        key = roster_key(roster)
         dpt_rosters_by_key[key] = roster
         
     # Rosters calculated from tour schedule (source of truth for all roster data)
     tour_rosters_by_key = {
-        roster.cmp_key(): roster
+        roster_key(roster): roster
         for roster in tour_rosters_list
     }
     
@@ -305,19 +403,20 @@ def sync_deputy_rosters(tours_date, area, tour_rosters_list, publish_keys=None,
     num_add_ok = num_add_fail = 0
     num_unchanged = num_update_ok = num_update_fail = 0
     num_delete_ok = num_delete_fail = 0
-    logger.info('%sUpdating rosters in Deputy for date %s, area %s' % (
-        'DRY RUN: ' if dry_run else '', tours_date.isoformat(), area.name,
+    logger.info('%sUpdating rosters in Deputy for dates %s to %s, areas %s' % (
+        'DRY RUN: ' if dry_run else '', start_date.isoformat(), end_date.isoformat(),
+        ', '.join(area.name for area in areas),
     ))
     # Add rosters to Deputy & record changelogs for successful items
     rosters_added = [ tour_rosters_by_key[key] for key in tour_rosters_extra ]
     if not dry_run and len(rosters_added) > 0:
         try:
-            rosters_added = api.add_rosters(rosters_added)
+            rosters_added = api.create_rosters(rosters_added)
         except Exception as e:
             logger.error('add_rosters error %s: %s'  % (type(e).__name__, str(e)))
     
     for r in rosters_added:
-        key = r.cmp_key()
+        key = roster_key(r)
         if r.source_row_id or dry_run:
             num_add_ok += 1
             if (chglog := tour_rosters_by_key[key].mark_source_added()):
@@ -338,7 +437,7 @@ def sync_deputy_rosters(tours_date, area, tour_rosters_list, publish_keys=None,
         dpt_roster = dpt_rosters_by_key[key]
         roster.source_row_id = dpt_roster.source_row_id # make sure Deputy ID is preserved
         if publish_keys is not None:
-            roster.published = key in publish_keys
+            roster.published = key[1] in publish_keys
         else:
             roster.published = dpt_roster.published
 
@@ -347,20 +446,27 @@ def sync_deputy_rosters(tours_date, area, tour_rosters_list, publish_keys=None,
             changelogs.append(chglog)
             rosters_to_update[roster.source_row_id] = roster
             if publish_keys is not None:
-                roster.published = key in publish_keys
+                roster.published = key[1] in publish_keys
 
         else:
             roster.source_row_state = 'unchanged' # record change status with source_row_state for the Roster viewer
             num_unchanged += 1
             results.append(roster)
     
-    if not dry_run and rosters_to_update:
+    # only rosters which were correlated with their comment still need the real comment
+    rosters_comment_pending = [r for r in rosters_added if r.source_row_id and getattr(r, '_comment_pending', False)]
+    if not dry_run and (rosters_to_update or rosters_comment_pending):
         try:
-            updated_ids, update_error_ids = api.update_rosters(rosters_to_update.values())
+            updated_ids, update_error_ids = api.update_rosters(
+                list(rosters_to_update.values()), added_rosters=rosters_comment_pending,
+            )
         except Exception as e:
             logger.error('update_rosters error %s: %s' % (type(e).__name__, str(e)))
             updated_ids = []
             update_error_ids = rosters_to_update.keys()
+        # the results also include the comments of the added rosters
+        updated_ids = [srid for srid in updated_ids if srid in rosters_to_update]
+        update_error_ids = [srid for srid in update_error_ids if srid in rosters_to_update]
 
         for srid in updated_ids:
             r = rosters_to_update[srid] 
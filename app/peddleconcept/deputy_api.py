@@ -1,19 +1,47 @@
 import requests
+import asyncio
 import logging
 import json
+import time as time_mod
+import threading
 import uuid
+from asgiref.sync import async_to_sync
 from django.db import transaction
 from peddleconcept.settings import get_deputy_api_setting, DEPUTY_API_SETTING
 from peddleconcept.models import Person, Area
-from peddleconcept.util import log_response
+from peddleconcept.util import log_response, add_days
 from django.contrib import messages
 from django.utils.timezone import get_default_timezone
-from datetime import datetime, time
+from datetime import date, datetime, time
 
 from peddleconcept.deputy_objects import *
 
 logger = logging.getLogger(__name__)
 
+DEPUTY_TIMEOUT_SECONDS_DEFAULT = 30
+DEPUTY_MAX_RETRIES_DEFAULT = 3
+# max number of rosters sent in each BULK call
+DEPUTY_ROSTER_BULK_SIZE_DEFAULT = 100
+# max number of records returned by each QUERY call (Deputy returns at most 500)
+DEPUTY_QUERY_PAGE_SIZE_DEFAULT = 500
+DEPUTY_RETRY_BACKOFF_SECONDS = 0.5
+# rate limited or temporarily unavailable: worth trying again
+DEPUTY_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# one pooled session per process, so connections to Deputy are kept alive between API calls and requests
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=10)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
 class DeputyAPI:
     """ Instantiated to allow making a few Deputy API calls in the scope of a single 'session' """
     def __init__(self, request=None):
@@ -25,6 +53,10 @@ class DeputyAPI:
         self.creator_id = deputy_conf.get('api_creator_id')
         self.default_company_id = deputy_conf.get('company_id')
         self.default_employee_role_id = deputy_conf.get('employee_role_id')
+        self.timeout = deputy_conf.get('timeout_seconds', DEPUTY_TIMEOUT_SECONDS_DEFAULT)
+        self.max_retries = deputy_conf.get('max_retries', DEPUTY_MAX_RETRIES_DEFAULT)
+        self.roster_bulk_size = deputy_conf.get('roster_bulk_size', DEPUTY_ROSTER_BULK_SIZE_DEFAULT)
+        self.query_page_size = deputy_conf.get('query_page_size', DEPUTY_QUERY_PAGE_SIZE_DEFAULT)
 
         if not self.token:
             logger.error('Deputy API cannot be used without endpoint and auth token: make sure %s is configured in Settings' % 
@@ -35,25 +67,63 @@ class DeputyAPI:
     def make_url(self, url):
         return '%s/%s' % (self.endpoint, url)
 
-    def get(self, url):
-        full_url = self.make_url(url)
-        resp = requests.get(full_url, headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer %s' % self.token,
-        })
-        log_response(resp)
-        return resp.json()
+    def get_retry_delay(self, attempt, resp=None):
+        """ exponential backoff, or as long as Deputy asks for when rate limited """
+        if resp is not None and (retry_after := resp.headers.get('Retry-After', '')).isdigit():
+            return min(int(retry_after), self.timeout)
+        return DEPUTY_RETRY_BACKOFF_SECONDS * (2 ** attempt)
 
-    def post(self, url, data):
+    def send(self, method, url, idempotent=True, **kwargs):
+        """
+        Make an API call using the pooled session, retrying with exponential backoff if Deputy is rate limiting
+        or temporarily failing. Calls which aren't idempotent (eg. BULK uploads) are only retried if rate limited,
+        since any other failure might have happened after Deputy made the changes.
+        """
         full_url = self.make_url(url)
-        resp = requests.post(full_url, json=data, headers={
+        headers = {
             'Accept': 'application/json',
-            'Content-Type': 'application/json',
             'Authorization': 'Bearer %s' % self.token,
-        })
+        }
+        for attempt in range(self.max_retries + 1):
+            is_last = attempt == self.max_retries
+            try:
+                resp = get_session().request(method, full_url, headers=headers, timeout=self.timeout, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                # includes connection timeouts, but not read timeouts
+                if is_last or not (idempotent or isinstance(e, requests.exceptions.ConnectTimeout)):
+                    raise
+                logger.warning('Deputy API %s %s failed, retrying: %s' % (method, url, e))
+                time_mod.sleep(self.get_retry_delay(attempt))
+                continue
+
+            if resp.status_code in DEPUTY_RETRY_STATUS_CODES and not is_last and (idempotent or resp.status_code == 429):
+                logger.warning('Deputy API %s %s returned %d, retrying' % (method, url, resp.status_code))
+                time_mod.sleep(self.get_retry_delay(attempt, resp))
+                continue
+            break
+
         log_response(resp)
         return resp.json()
 
+    def get(self, url):
+        return self.send('GET', url)
+
+    def post(self, url, data, idempotent=False):
+        """ POST data as JSON, set idempotent for calls which only read data (eg. QUERY) so they can be retried """
+        return self.send('POST', url, idempotent=idempotent, json=data)
+
+    async def aget(self, url):
+        """ same as get() without blocking the event loop, to run several calls concurrently """
+        return await asyncio.to_thread(self.get, url)
+
+    async def apost(self, url, data, idempotent=False):
+        """ same as post() without blocking the event loop, to run several calls concurrently """
+        return await asyncio.to_thread(self.post, url, data, idempotent=idempotent)
+
+    async def aquery_all(self, url, query):
+        """ same as query_all() without blocking the event loop, to run several queries concurrently """
+        return await asyncio.to_thread(self.query_all, url, query)
+
     def query_all_areas(self):
         resp = self.post(
             'api/v1/resource/OperationalUnit/QUERY',
@@ -61,7 +131,7 @@ class DeputyAPI:
                 "search": { 
                     "s1": { "field": "Company", "data": self.default_company_id, "type": "eq" },
                 },
-            })
+            }, idempotent=True)
 
         return ( parse_operationalunit_json(ou) for ou in resp )
     
@@ -185,144 +255,168 @@ class DeputyAPI:
 
     def query_leave_unavailability(self, avl_date):
         """
-        Run two Resource API queries: Leave and EmployeeAvailability.
+        Run two Resource API queries concurrently: Leave and EmployeeAvailability.
         Returns all leave for all employees during that period in the form of:
         { employee_id: [(start_time_unix, end_time_unix, comment), ...] }
         """
+        return self.query_leave_unavailability_range(avl_date, avl_date)[avl_date]
 
-        # leave is based on both start and end date
-        dpt_leave = self.post('api/v1/resource/Leave/QUERY', {
-            "search": {
-                "s1": {"field": "DateStart", "type": "le", "data": avl_date.isoformat()}, # AND
-                "s2": {"field": "DateEnd", "type": "ge", "data": avl_date.isoformat()},
-            },
-        })
-        # availability is based on schedule but entries are generated for each calculated occurence date
-        dpt_unavail = self.post('api/v1/resource/EmployeeAvailability/QUERY', {
-            "search": {
-                "s1": {"field": "Date", "type": "eq", "data": avl_date.isoformat()},
-            },
-        })
-
-        employee_time_off = {}
-        for leave in dpt_leave:
-            emp_id = str(leave['Employee'])
-            emp_time = employee_time_off.setdefault(emp_id, [])
-            comment = 'on leave'
-            if leave['Comment']:
-                comment += ' (%s)' % leave['Comment']
-            emp_time.append(
-                ( 
-                    datetime.fromtimestamp(leave['Start']), datetime.fromtimestamp(leave['End']),
-                    comment
-                )
-            )
+    async def aquery_leave_unavailability(self, avl_date):
+        """ same as query_leave_unavailability(), for async callers """
+        return (await self.aquery_leave_unavailability_range(avl_date, avl_date))[avl_date]
 
-        for avail in dpt_unavail:
-            emp_id = str(avail['Employee'])
-            emp_time = employee_time_off.setdefault(emp_id, [])
-            comment = 'unavailable'
-            if avail['Comment']:
-                comment += ' (%s)' % avail['Comment']
-            emp_time.append(
-                ( 
-                    datetime.fromtimestamp(avail['StartTime']), datetime.fromtimestamp(avail['EndTime']),
-                    comment
-                )
-            )
-        
-        return employee_time_off
+    def query_leave_unavailability_range(self, start_date, end_date):
+        """
+        Same as query_leave_unavailability() for every date from start_date to end_date, still using only two
+        queries in total (unless there are more than a page of results). Returns { date: { employee_id: [(start, end, comment), ...] } } including empty dates.
+        """
+        return async_to_sync(self.aquery_leave_unavailability_range)(start_date, end_date)
+
+    async def aquery_leave_unavailability_range(self, start_date, end_date):
+        """ same as query_leave_unavailability_range(), for async callers """
+        dpt_leave, dpt_unavail = await asyncio.gather(
+            # leave is based on both start and end date: find any leave overlapping the date range
+            self.aquery_all('api/v1/resource/Leave/QUERY', {
+                "search": {
+                    "s1": {"field": "DateStart", "type": "le", "data": end_date.isoformat()}, # AND
+                    "s2": {"field": "DateEnd", "type": "ge", "data": start_date.isoformat()},
+                },
+            }),
+            # availability is based on schedule but entries are generated for each calculated occurence date
+            self.aquery_all('api/v1/resource/EmployeeAvailability/QUERY', {
+                "search": {
+                    "s1": {"field": "Date", "type": "ge", "data": start_date.isoformat()}, # AND
+                    "s2": {"field": "Date", "type": "le", "data": end_date.isoformat()},
+                },
+            }),
+        )
+        return parse_leave_unavailability(dpt_leave, dpt_unavail, start_date, end_date)
 
     def query_rosters(self, start_date, end_date, area, people_by_srid=None):
+        return self.query_rosters_range(start_date, end_date, [area], people_by_srid=people_by_srid)
+
+    def query_all(self, url, query):
+        """
+        POST a resource QUERY, a page of query_page_size records at a time (ordered by Id so the pages don't overlap)
+        until a short page comes back. Returns all of the records.
+        """
+        results = []
+        while True:
+            resp = self.post(url, dict(query, sort={"Id": "asc"}, start=len(results), max=self.query_page_size),
+                idempotent=True)
+            results.extend(resp)
+            if len(resp) < self.query_page_size:
+                return results
+
+    def query_rosters_range(self, start_date, end_date, areas, people_by_srid=None):
+        """
+        Query the rosters in all of the areas from start_date to end_date, with a single API call unless there are
+        more than a page of them
+        """
+        area_dict = {area.source_row_id: area for area in areas}
         dt_start = datetime.combine(start_date, time(0, 0, 0), tzinfo=get_default_timezone())
         dt_end = datetime.combine(end_date, time(23, 59, 59), tzinfo=get_default_timezone())
-        resp = self.post('api/v1/resource/Roster/QUERY', {
+        resp = self.query_all('api/v1/resource/Roster/QUERY', {
             "search": {
                 "s1": {"field": "StartTime", "type": "ge", "data": int(dt_start.timestamp()) },
                 "s2": {"field": "EndTime", "type": "le", "data": int(dt_end.timestamp()) },
-                "s3": {"field": "OperationalUnit", "type": "eq", "data": area.source_row_id },
+                "s3": {"field": "OperationalUnit", "type": "in", "data": [int(srid) for srid in area_dict] },
             }
         })
         
         return [
-            parse_roster_json(item, employee_dict=people_by_srid, area_dict={area.source_row_id: area}, api_creator_id=self.creator_id)
+            parse_roster_json(item, employee_dict=people_by_srid, area_dict=area_dict, api_creator_id=self.creator_id)
             for item in resp
         ]
 
-    def add_rosters(self, roster_list):
+    def bulk_rosters(self, roster_data):
+        """
+        Send Roster BULK calls with up to roster_bulk_size rosters in each (see the deputy_api setting).
+        Returns the combined (results, errors) lists from the responses.
+        """
+        results, errors = [], []
+        for i in range(0, len(roster_data), self.roster_bulk_size):
+            resp = self.post('api/v1/resource/Roster/BULK', roster_data[i:i + self.roster_bulk_size])
+            if not isinstance(resp, dict):
+                continue
+            if isinstance(resp.get('results'), list):
+                results += resp['results']
+            if isinstance(resp.get('errors'), list):
+                errors += resp['errors']
+                logger.debug('response json: %s', resp)
+        return results, errors
+
+    def create_rosters(self, roster_list):
         """
         BULK upload Roster instances into Deputy Roster objects and record source row IDs.
-        Use two calls - first to create rosters using comment field for ID correlation.
-        Second call to update comments with actual comment data.
+        Each created roster is matched by its (employee, start, end, area) key in the results. Only rosters with the
+        same key as another one use the comment field for ID correlation instead: their comments still have to be
+        set with update_rosters(added_rosters=...) and are marked with _comment_pending.
         """
+        rosters_json = [make_roster_json(roster) for roster in roster_list]
+        num_by_key = {}
+        for data in rosters_json:
+            key = get_roster_json_key(data)
+            num_by_key[key] = num_by_key.get(key, 0) + 1
 
-        # assign each roster a unique identifier to identify exactly which ones exist and which ones are errored
+        # assign each ambiguous roster a unique identifier to identify exactly which ones exist and which ones are errored
         roster_correlation = {}
-        for roster in roster_list:
-            uid = str(uuid.uuid4()) # random UUID for identifying roster
-            roster._shift_notes = roster.shift_notes
-            roster.shift_notes = uid
-            roster_correlation[uid] = roster
-
-        resp = self.post('api/v1/resource/Roster/BULK', [
-            make_roster_json(roster) for roster in roster_correlation.values()
-        ])
-
-        res = resp.get('results')
-        errors = resp.get('errors')
-        if isinstance(errors, list):
+        for roster, data in zip(roster_list, rosters_json):
+            key = get_roster_json_key(data)
+            roster._comment_pending = key is None or num_by_key[key] > 1
+            if roster._comment_pending:
+                key = str(uuid.uuid4()) # random UUID for identifying roster
+                data['Comment'] = key
+            roster_correlation[key] = roster
+
+        res, errors = self.bulk_rosters(rosters_json)
+        if errors:
             logger.warning("Received roster bulk upload error for %d items" % len(errors))
-            logger.debug('response json: %s', resp)
-
-        if isinstance(res, list):
-            for dpt_roster in res:
-                roster = roster_correlation.get(dpt_roster.get('Comment'))
-                if not roster:
-                    logger.warning("Missing UUID in comment for Deputy roster, result=%s" % dpt_roster)
-                    continue
-                roster.source_row_id = dpt_roster.get('Id')
-        
-        for roster in roster_correlation.values():
-            roster.shift_notes = roster._shift_notes
 
-        resp = self.post('api/v1/resource/Roster/BULK', [
-            {
-                'Id': int(roster.source_row_id),
-                'Comment': roster._shift_notes,
-            }
-            for roster in roster_correlation.values()
-            if roster.source_row_id
-        ])
+        for dpt_roster in res:
+            roster = roster_correlation.get(dpt_roster.get('Comment')) or roster_correlation.get(
+                get_roster_json_key(dpt_roster))
+            if not roster:
+                logger.warning("Unmatched Deputy roster in bulk upload results, result=%s" % dpt_roster)
+                continue
+            roster.source_row_id = dpt_roster.get('Id')
+
+        return list(roster_list)
 
-        return list(roster_correlation.values())
+    def add_rosters(self, roster_list):
+        """
+        BULK upload Roster instances into Deputy Roster objects and record source row IDs, see create_rosters().
+        A second call updates the comments with actual comment data, only if any rosters needed comment correlation.
+        """
+        rosters = self.create_rosters(roster_list)
+        self.update_rosters([], added_rosters=rosters)
+        return rosters
 
-    def update_rosters(self, roster_list):
-        """ Update the roster objects in Deputy """
+    def update_rosters(self, roster_list, added_rosters=()):
+        """
+        Update the roster objects in Deputy, and the comments of any rosters just added with create_rosters(),
+        in the same BULK call(s)
+        """
 
-        resp = self.post('api/v1/resource/Roster/BULK', [
+        res, errors = self.bulk_rosters([
             make_roster_json(roster) for roster in roster_list
+        ] + [
+            {
+                'Id': int(roster.source_row_id),
+                'Comment': roster.shift_notes,
+            }
+            for roster in added_rosters
+            if roster.source_row_id and roster._comment_pending
         ])
-        if not isinstance(resp, dict):
-            return [], []
 
-        res = resp.get('results')
-        errors = resp.get('errors')
-
-        if isinstance(errors, list):
+        if errors:
             logger.warning("update_rosters got errors for %d rows" % len(errors))
-            logger.debug("response json: %s", resp)
-            error_ids = [
-                str(err['resource'].get('Id')) for err in errors
-            ]
-        else:
-            error_ids = []
-        
-        if isinstance(res, list):
-            updated_ids = [
-                str(r.get('Id')) for r in res
-            ]
-        else:
-            updated_ids = []
+        error_ids = [
+            str(err['resource'].get('Id')) for err in errors
+        ]
+        updated_ids = [
+            str(r.get('Id')) for r in res
+        ]
 
         return updated_ids, error_ids
 
@@ -336,4 +430,65 @@ class DeputyAPI:
         else:
             return [
                 str(item.get('Id')) for item in resp
-            ]
\ No newline at end of file
+            ]
+
+def get_roster_json_key(data):
+    """ (employee, start, end, area) of a Deputy Roster object, used to match created rosters to the results """
+    try:
+        return (
+            str(data['Employee']), int(data['StartTime']), int(data['EndTime']), str(data['OperationalUnit']),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def get_deputy_date(value, fallback_timestamp):
+    """ date part of a Deputy date field (eg. '2024-01-31T00:00:00+08:00'), or the local date of the timestamp """
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except (TypeError, ValueError):
+        return datetime.fromtimestamp(fallback_timestamp).date()
+
+def parse_leave_unavailability(dpt_leave, dpt_unavail, start_date, end_date):
+    """
+    combine Deputy Leave and EmployeeAvailability query results into buckets for each date from start_date to
+    end_date, see DeputyAPI.query_leave_unavailability_range()
+    """
+    time_off_by_date = {
+        add_days(start_date, day): {} for day in range((end_date - start_date).days + 1)
+    }
+
+    def add_time_off(first_date, last_date, emp_id, time_off):
+        for day in range((min(last_date, end_date) - max(first_date, start_date)).days + 1):
+            employee_time_off = time_off_by_date[add_days(max(first_date, start_date), day)]
+            employee_time_off.setdefault(emp_id, []).append(time_off)
+
+    for leave in dpt_leave:
+        comment = 'on leave'
+        if leave['Comment']:
+            comment += ' (%s)' % leave['Comment']
+        # all of the leave is included on every date it covers
+        add_time_off(
+            get_deputy_date(leave.get('DateStart'), leave['Start']),
+            get_deputy_date(leave.get('DateEnd'), leave['End']),
+            str(leave['Employee']),
+            ( 
+                datetime.fromtimestamp(leave['Start']), datetime.fromtimestamp(leave['End']),
+                comment
+            ),
+        )
+
+    for avail in dpt_unavail:
+        comment = 'unavailable'
+        if avail['Comment']:
+            comment += ' (%s)' % avail['Comment']
+        avl_date = get_deputy_date(avail.get('Date'), avail['StartTime'])
+        add_time_off(
+            avl_date, avl_date,
+            str(avail['Employee']),
+            ( 
+                datetime.fromtimestamp(avail['StartTime']), datetime.fromtimestamp(avail['EndTime']),
+                comment
+            ),
+        )
+    
+    return time_off_by_date
@@ -17,10 +17,13 @@ class Command(BaseCommand):
         parser.add_argument('start-date')
         parser.add_argument('end-date')
         parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--full', action='store_true', help='Merge every day, even if the manifest is unchanged')
+        parser.add_argument('--concurrency', type=int, help='Number of days to fetch at once (default from settings)')
 
     def handle(self, *args, **options):
         start_date = date.fromisoformat(options['start-date'])
         end_date = date.fromisoformat(options['end-date'])
         
-        update_from_rezdy(start_date, end_date, dry_run=options['dry_run'])
+        update_from_rezdy(start_date, end_date, dry_run=options['dry_run'], concurrency=options['concurrency'],
+            full=options['full'])
         
\ No newline at end of file
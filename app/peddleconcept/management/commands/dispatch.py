@@ -5,9 +5,12 @@ from datetime import date, datetime
 from peddleconcept.util import json_datetime, from_json_datetime, add_days
 
 from django.db import transaction
+from django.utils.timezone import localdate
 
 from peddleconcept.models import Settings
 from peddleconcept.settings import get_setting_or_default, set_setting, get_auto_update_setting, AUTO_UPDATE_STATUS, AUTO_UPDATE_SETTING
+from peddleconcept.settings import get_deputy_api_setting
+from peddleconcept.deputy import refresh_stale_deputy_time_off
 from peddleconcept.tours.rezdy import update_from_rezdy
 from peddleconcept.tours.fringe import update_from_fringe
 
@@ -19,8 +22,9 @@ class Command(BaseCommand):
         parser.add_argument('--force', action='store_true', help='Run a scan regardless of the last scan time')
         parser.add_argument('--start-date', help='Date from which to start scanning, defaults to today (iso format)')
         parser.add_argument('--num-days', help='Override number of days in settings', type=int)
+        parser.add_argument('--full', action='store_true', help='Merge every Rezdy day, even if the manifest is unchanged')
 
-    def handle(self, *args, dry_run=False, force=False, start_date=None, num_days=None, **kwargs):
+    def handle(self, *args, dry_run=False, force=False, start_date=None, num_days=None, full=False, **kwargs):
         scan_status = get_setting_or_default(AUTO_UPDATE_STATUS, {
             'last_update_begin': 0,
             'last_update': 0,
@@ -58,6 +62,15 @@ class Command(BaseCommand):
         if not dry_run:
             set_setting(AUTO_UPDATE_STATUS, scan_status)
 
+        # independent of the scan interval, so the Tour Schedule Editor doesn't have to wait for Deputy
+        if not dry_run and get_deputy_api_setting().get('auth_token'):
+            try:
+                rows = refresh_stale_deputy_time_off(localdate())
+                if rows:
+                    print('Refreshed Deputy time off for %d days' % len(rows), file=stderr)
+            except Exception as e:
+                print('Error refreshing Deputy time off: %s: %s' % (type(e).__name__, str(e)), file=stderr)
+
         if not force and last_update_mins < auto_update_interval:
             return
 
@@ -77,7 +90,7 @@ class Command(BaseCommand):
         fringe_msg = 'N/A'
 
         if update_rezdy:
-            ok, log = update_from_rezdy(start_date, end_date, dry_run=dry_run)
+            ok, log = update_from_rezdy(start_date, end_date, dry_run=dry_run, full=full)
             print(log, file=stderr)
             status_msgs += log.split('\n')
         if update_fringe:
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand, CommandError
+from sys import stderr
+from datetime import date, datetime
+
+from django.db import transaction, connection
+from django.db.models import Q
+
+from peddleconcept.util import get_date_filter, add_days, today
+from peddleconcept.models import Area, Tour, Session, TourRider, RiderPaySlot
+
+# indexes added for the time-range queries (see migrations 0003_time_range_indexes and 0009_session_source_row_id_idx)
+TIME_RANGE_INDEXES = (
+    (Tour, ('tour_time_start_idx', 'tour_area_time_start_idx', 'tour_source_time_start_idx', 'tour_source_row_id_idx')),
+    (Session, ('session_time_start_idx', 'session_source_time_idx', 'session_source_row_id_idx')),
+    (RiderPaySlot, ('payslot_time_start_idx', )),
+)
+
+def get_hot_queries(start_date, end_date):
+    """ returns list of (description, queryset) resembling the most frequent queries in the app """
+    date_filter = get_date_filter(start_date, end_date, 'time_start')
+    area = Area.objects.filter(active=True).order_by('sort_order').first()
+    srids = list(Tour.objects.filter(source='rezdy').values_list('source_row_id', flat=True)[:50])
+
+    return [
+        ('Tour schedule (get_tour_schedule_data)', Tour.objects.filter(
+            tour_area=area, **date_filter).order_by('time_start', 'tour_type', 'customer_name')),
+        ('Tour dashboard (get_tour_summary)', Tour.objects.filter(
+            **date_filter).order_by('time_start', 'tour_type')),
+        ('Rezdy tours merge (update_from_rezdy)', Tour.objects.filter(
+            Q(source='rezdy', **date_filter) | Q(source='rezdy', source_row_id__in=srids))),
+        ('Rezdy sessions merge (update_from_rezdy)', Session.objects.filter(source='rezdy', **date_filter)),
+        ('Rider schedule (get_rider_schedule)', TourRider.objects.filter(
+            **get_date_filter(start_date, end_date, 'tour__time_start')).order_by('tour__time_start')),
+        ('Pay report (load_tour_pay_report)', RiderPaySlot.objects.filter(**date_filter)),
+    ]
+
+class Command(BaseCommand):
+    help = 'Show query plans and timings for the main tour/session/payslot time range queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help='First date of the range to query (iso format), defaults to today')
+        parser.add_argument('--num-days', type=int, default=7, help='Number of days in the range to query')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of times to run each query for timing')
+        parser.add_argument('--analyze', action='store_true', help='Use EXPLAIN ANALYZE (PostgreSQL only)')
+        parser.add_argument('--compare', action='store_true',
+            help='Also show plans without the time range indexes. The indexes are dropped temporarily inside a '
+            'transaction which is rolled back (this locks the tables while running!)')
+
+    def handle(self, *args, start_date=None, num_days=7, repeat=5, analyze=False, compare=False, **options):
+        try:
+            start_date = date.fromisoformat(start_date) if start_date else today()
+        except ValueError:
+            raise CommandError('Bad --start-date format (expecting YYYY-MM-DD)')
+        end_date = add_days(start_date, max(num_days - 1, 0))
+
+        print('Query plans for %s to %s on %s' % (
+            start_date.isoformat(), end_date.isoformat(), connection.vendor), file=stderr)
+        self.explain_all(start_date, end_date, repeat, analyze, 'with indexes')
+
+        if compare:
+            with transaction.atomic(), connection.cursor() as cursor:
+                for model, index_names in TIME_RANGE_INDEXES:
+                    for name in index_names:
+                        cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+                self.explain_all(start_date, end_date, repeat, analyze, 'WITHOUT indexes')
+                transaction.set_rollback(True)
+
+    def explain_all(self, start_date, end_date, repeat, analyze, title):
+        explain_opts = {'analyze': True} if analyze and connection.vendor == 'postgresql' else {}
+
+        for desc, qs in get_hot_queries(start_date, end_date):
+            time_start = datetime.now()
+            for i in range(max(repeat, 1)):
+                num_rows = len(qs.all())
+            avg_ms = (datetime.now() - time_start).total_seconds() * 1000 / max(repeat, 1)
+
+            self.stdout.write('=== [%s] %s: %d rows, %0.2fms avg' % (title, desc, num_rows, avg_ms))
+            self.stdout.write(qs.explain(**explain_opts))
+            self.stdout.write('')
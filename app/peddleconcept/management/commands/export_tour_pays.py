@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from sys import stderr, stdout
+from datetime import date, timedelta
+
+from django.utils.timezone import localdate
+
+from peddleconcept.pay_export import get_pay_export, get_pay_export_filename, PAY_EXPORT_FORMATS
+from peddleconcept.util import start_of_week
+
+class Command(BaseCommand):
+    help = 'Export the weekly tour pay totals as a CSV summary or an ABA direct entry bank file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help='A date in the week to export, defaults to last week (iso format)')
+        parser.add_argument('--num-weeks', type=int, default=1, help='Number of weeks to export, one file each')
+        parser.add_argument('-f', '--format', choices=PAY_EXPORT_FORMATS, default='csv', help='Export format')
+        parser.add_argument('-o', '--output-dir', help='Write TourPays_<start>_<end>.<format> files here '
+            'instead of to stdout')
+        parser.add_argument('--process-date', help='Processing date for ABA files, defaults to today (iso format)')
+        parser.add_argument('--no-recalculate', action='store_true', help='Export the pay slots as they are')
+
+    def handle(self, *args, start_date=None, num_weeks=1, format='csv', output_dir=None, process_date=None,
+            no_recalculate=False, **options):
+        try:
+            start_date = date.fromisoformat(start_date) if start_date else localdate() - timedelta(days=7)
+            process_date = date.fromisoformat(process_date) if process_date else None
+        except ValueError:
+            raise CommandError('Bad date format (expecting YYYY-MM-DD)')
+
+        week_start = start_of_week(start_date)
+        for n in range(num_weeks):
+            week_end = week_start + timedelta(days=6)
+            skipped = []
+            try:
+                lines = get_pay_export(week_start, week_end, format, process_date=process_date, skipped=skipped,
+                    recalculate=not no_recalculate)
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            if output_dir:
+                filename = '%s/%s' % (output_dir, get_pay_export_filename(week_start, week_end, format))
+                # newline='' keeps the CRLF line endings of both formats
+                with open(filename, 'w', newline='') as f:
+                    f.writelines(lines)
+                print('Exported %s' % filename, file=stderr)
+            else:
+                stdout.writelines(lines)
+
+            for total in skipped:
+                print('  skipped %s (%d): bank details %s, pay $%d.%02d' % (
+                    total['name'], total['id'], 'valid' if total['bank_valid'] else 'invalid',
+                    *divmod(total['pay_cents'], 100),
+                ), file=stderr)
+            week_start += timedelta(days=7)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from sys import stderr
+
+from peddleconcept.changelog import apply_changelog_retention
+from peddleconcept.settings import CHANGELOG_RETENTION_SETTING
+
+class Command(BaseCommand):
+    help = "Archive and delete old ChangeLogs, as configured in the '%s' setting" % CHANGELOG_RETENTION_SETTING
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Show how many rows would be removed without doing anything")
+        parser.add_argument('--keep-days', type=int, help='Override the number of days of ChangeLogs to keep')
+        parser.add_argument('--archive-dir', help='Override the folder for the archived ChangeLogs')
+        parser.add_argument('--no-archive', action='store_true', help='Delete old ChangeLogs without archiving them')
+        parser.add_argument('--compact', action='store_true', help="Also collapse repeated 'changed' ChangeLogs")
+
+    def handle(self, *args, dry_run=False, keep_days=None, archive_dir=None, no_archive=False, compact=False, **options):
+        try:
+            stats = apply_changelog_retention(
+                keep_days=keep_days,
+                archive=False if no_archive else None,
+                archive_dir=archive_dir,
+                compact=True if compact else None,
+                dry_run=dry_run,
+            )
+        except (KeyError, TypeError, ValueError):
+            raise CommandError("Invalid syntax in configuration setting '%s'" % CHANGELOG_RETENTION_SETTING)
+
+        print('%s%s' % (
+            'Dry run: ' if dry_run else '',
+            ', '.join('%s %d rows' % (action, num) for action, num in stats.items()),
+        ), file=stderr)
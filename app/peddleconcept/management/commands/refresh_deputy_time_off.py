@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from sys import stderr
+from datetime import date
+
+from django.utils.timezone import localdate
+
+from peddleconcept.deputy import refresh_upcoming_deputy_time_off
+
+class Command(BaseCommand):
+    help = 'Refresh the cached Deputy leave/unavailability for the upcoming days, used by the Tour Schedule Editor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help='First date to refresh, defaults to today (iso format)')
+        parser.add_argument('--num-days', type=int, help='Override number of days in the Deputy API settings')
+
+    def handle(self, *args, start_date=None, num_days=None, **options):
+        try:
+            start_date = date.fromisoformat(start_date) if start_date else localdate()
+        except ValueError:
+            raise CommandError('Bad date format (expecting YYYY-MM-DD)')
+
+        rows = refresh_upcoming_deputy_time_off(start_date, num_days)
+        print('Refreshed Deputy time off for %d days from %s' % (len(rows), start_date.isoformat()), file=stderr)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from sys import stderr
+from datetime import date
+
+from django.db.models import Min, Max
+from django.utils.timezone import localdate
+
+from peddleconcept.util import add_days
+from peddleconcept.models import Tour
+from peddleconcept.tours.schedules import refresh_tour_summaries
+
+class Command(BaseCommand):
+    help = 'Recalculate the precomputed Tour Dashboard summaries (defaults to all tour dates)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help='First date to recalculate (iso format)')
+        parser.add_argument('--end-date', help='Last date to recalculate (iso format)')
+
+    def handle(self, *args, start_date=None, end_date=None, **options):
+        tour_range = Tour.objects.aggregate(first=Min('time_start'), last=Max('time_start'))
+        if not tour_range['first']:
+            print('No tours found', file=stderr)
+            return
+
+        try:
+            start_date = date.fromisoformat(start_date) if start_date else localdate(tour_range['first'])
+            end_date = date.fromisoformat(end_date) if end_date else localdate(tour_range['last'])
+        except ValueError:
+            raise CommandError('Bad date format (expecting YYYY-MM-DD)')
+
+        # one month at a time to keep the queries reasonably sized
+        num_days = (end_date - start_date).days + 1
+        for month_start in range(0, num_days, 31):
+            dates = [add_days(start_date, day) for day in range(month_start, min(month_start + 31, num_days))]
+            refresh_tour_summaries(dates)
+            print('Refreshed tour summaries from %s to %s' % (dates[0].isoformat(), dates[-1].isoformat()), file=stderr)
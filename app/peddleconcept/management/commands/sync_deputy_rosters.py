@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from sys import stderr
+from datetime import date
+
+from django.db.models import Q
+from django.utils.timezone import localdate
+
+from peddleconcept.models import Area
+from peddleconcept.tours.schedules import sync_tour_rosters_range
+
+class Command(BaseCommand):
+    help = 'Sync the rosters for the tour schedules of all active Deputy sync enabled areas with Deputy, for a week at once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--dry-run', action='store_true', help='Compare with Deputy but make no changes')
+        parser.add_argument('--start-date', help='First date to sync, defaults to today (iso format)')
+        parser.add_argument('--num-days', type=int, default=7, help='Number of days to sync')
+        parser.add_argument('--area', action='append', help='Only sync the area with this name (can be repeated)')
+        parser.add_argument('--publish', action='store_true', help='Publish all the rosters')
+
+    def handle(self, *args, start_date=None, num_days=7, area=None, publish=False, dry_run=False, **options):
+        try:
+            start_date = date.fromisoformat(start_date) if start_date else localdate()
+        except ValueError:
+            raise CommandError('Bad date format (expecting YYYY-MM-DD)')
+
+        areas = Area.objects.filter(active=True, deputy_sync_enabled=True)
+        if area:
+            areas = areas.filter(Q(area_name__in=area) | Q(display_name__in=area))
+
+        rosters, roster_errors = sync_tour_rosters_range(start_date, num_days, areas=areas,
+            publish=publish, dry_run=dry_run)
+        print('%sSynced %d rosters with Deputy for %d days from %s, %d errors' % (
+            'DRY RUN: ' if dry_run else '', len(rosters), num_days, start_date.isoformat(), len(roster_errors),
+        ), file=stderr)
+        for roster in roster_errors:
+            print('  %s: %s' % (roster.source_row_state, roster.cmp_key()), file=stderr)
@@ -0,0 +1,127 @@
+from django.db import transaction
+from django.utils import timezone
+import copy
+
+def bulk_update_changed(model, changed_rows, batch_size=None):
+    """
+    Save only the changed fields of each row, with one bulk_update() per distinct set of changed fields.
+    changed_rows is a list of (row, iterable of changed field names). Returns the number of rows updated.
+    """
+    rows_by_fields = {} # frozenset of field names -> list of rows
+    for row, fields in changed_rows:
+        if fields:
+            rows_by_fields.setdefault(frozenset(fields), []).append(row)
+
+    num_updated = 0
+    for fields, rows in rows_by_fields.items():
+        num_updated += model.objects.bulk_update(rows, fields=sorted(fields), batch_size=batch_size)
+    return num_updated
+
+class MergeSet:
+    """
+    Tracks the changes made to the DB rows of a MutableDataRecord model while merging them with data from an
+    external source (eg. Rezdy or Fringe), so that save() only writes the rows and fields which actually changed.
+    Every DB row must be passed to track() before it is changed in any way, eg. by matching code which rewrites
+    its source_row_id.
+    """
+    def __init__(self, model, rows=()):
+        self.model = model
+        self.rows = [] # tracked DB rows
+        self.orig_values = [] # field values of each tracked row when first tracked
+        self.tracked_ids = set()
+        self.to_add = []
+        self.created = [] # rows added by save()
+        self.changed = [] # tracked rows with any changes, set by save()
+        self.num_deleted = 0
+        self.changelogs = []
+        for row in rows:
+            self.track(row)
+
+    def get_field_values(self, row):
+        # deep copy, since update_field() changes field_auto_values in place
+        return {f.name: copy.deepcopy(getattr(row, f.attname)) for f in self.model._meta.concrete_fields}
+
+    def track(self, row):
+        if row.pk is None or row.pk in self.tracked_ids:
+            return
+        self.tracked_ids.add(row.pk)
+        self.rows.append(row)
+        self.orig_values.append(self.get_field_values(row))
+
+    def update(self, dst_row, src_row):
+        """ Copies changes from the source row into the DB row, returns ChangeLog instance if any changes """
+        self.track(dst_row)
+        if (chglog := dst_row.update_from_instance(src_row)) is not None:
+            self.changelogs.append(chglog)
+        return chglog
+
+    def delete(self, dst_row):
+        """ Marks the DB row as deleted from the data source """
+        self.track(dst_row)
+        self.num_deleted += 1
+        if (chglog := dst_row.mark_source_deleted()):
+            self.changelogs.append(chglog)
+        return chglog
+
+    def mark_added(self, row):
+        """ Marks a row as found in the data source, eg. after it was deleted """
+        self.track(row)
+        if (chglog := row.mark_source_added()):
+            self.changelogs.append(chglog)
+        return chglog
+
+    def add(self, src_row):
+        """ Adds a new row which isn't in the DB yet """
+        self.to_add.append(src_row)
+
+    def get_changed_rows(self):
+        """ returns a list of (row, set of changed field names) for the tracked rows with any changes """
+        changed_rows = []
+        for row, orig_values in zip(self.rows, self.orig_values):
+            values = self.get_field_values(row)
+            if (fields := set(f for f, v in values.items() if v != orig_values[f])):
+                changed_rows.append((row, fields))
+        return changed_rows
+
+    def save(self, dry_run=False):
+        """
+        Bulk creates the added rows and bulk updates the changed fields of the tracked rows.
+        Returns a dict of stats, including the number of rows with changes to each field.
+        """
+        changed_rows = self.get_changed_rows()
+        self.changed = [row for row, fields in changed_rows]
+        changed_fields = {}
+        for row, fields in changed_rows:
+            for f in fields:
+                changed_fields[f] = changed_fields.get(f, 0) + 1
+
+        if not dry_run:
+            # bulk_update() doesn't set auto_now fields
+            now = timezone.now()
+            for row, fields in changed_rows:
+                row.updated = now
+                fields.add('updated')
+            with transaction.atomic():
+                num_updated = bulk_update_changed(self.model, changed_rows)
+                self.created = self.model.objects.bulk_create(self.to_add)
+            for row in self.created:
+                if (chglog := row.mark_source_added()):
+                    self.changelogs.append(chglog)
+        else:
+            num_updated = len(changed_rows)
+            self.created = []
+
+        return {
+            'added': len(self.to_add),
+            'updated': num_updated,
+            'deleted': self.num_deleted,
+            'unchanged': len(self.rows) - num_updated,
+            'update_queries': len(set(frozenset(fields) for row, fields in changed_rows)),
+            'changed_fields': changed_fields,
+        }
+
+def format_merge_stats(name, stats):
+    return "save %s: added=%d, updated/cancelled=%d, cancelled=%d, unchanged=%d, queries=%d, fields=%s" % (
+        name, stats['added'], stats['updated'], stats['deleted'], stats['unchanged'], stats['update_queries'],
+        ','.join('%s:%d' % (f, n) for f, n in sorted(stats['changed_fields'].items())) or '-',
+    )
@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peddleconcept", "0002_deputy_models_upgrade"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(fields=["time_start"], name="session_time_start_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(
+                fields=["source", "time_start"], name="session_source_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tour",
+            index=models.Index(fields=["time_start"], name="tour_time_start_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="tour",
+            index=models.Index(
+                fields=["tour_area", "time_start"], name="tour_area_time_start_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tour",
+            index=models.Index(
+                fields=["source", "time_start"], name="tour_source_time_start_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tour",
+            index=models.Index(
+                fields=["source", "source_row_id"], name="tour_source_row_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="riderpayslot",
+            index=models.Index(fields=["time_start"], name="payslot_time_start_idx"),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peddleconcept", "0003_time_range_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TourSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tour_date", models.DateField()),
+                ("cancelled", models.PositiveIntegerField(default=0)),
+                ("needs_riders", models.PositiveIntegerField(default=0)),
+                ("filled", models.PositiveIntegerField(default=0)),
+                (
+                    "tours",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        help_text="Tours list as shown on the Tour Dashboard",
+                    ),
+                ),
+                (
+                    "tours_updated",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="Latest update time of the tours",
+                        null=True,
+                    ),
+                ),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "tour_area",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="peddleconcept.area",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Tour Summary (Advanced)",
+                "verbose_name_plural": "Tour Summaries (Advanced)",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="toursummary",
+            index=models.Index(fields=["tour_date"], name="toursummary_tour_date_idx"),
+        ),
+    ]
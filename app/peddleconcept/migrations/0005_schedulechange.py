@@ -0,0 +1,48 @@
+# Generated by Django 5.0 on 2026-10-17 16:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peddleconcept", "0004_toursummary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScheduleChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tour_date", models.DateField()),
+                (
+                    "created",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                (
+                    "tour_area",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="peddleconcept.area",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Schedule Change (Advanced)",
+                "verbose_name_plural": "Schedule Changes (Advanced)",
+            },
+        ),
+    ]
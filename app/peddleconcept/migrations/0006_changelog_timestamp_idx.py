@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-17 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peddleconcept", "0005_schedulechange"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="changelog",
+            index=models.Index(fields=["timestamp"], name="changelog_timestamp_idx"),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0 on 2026-10-17 19:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peddleconcept", "0006_changelog_timestamp_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeputyTimeOff",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("time_off_date", models.DateField(unique=True)),
+                ("data", models.JSONField(blank=True, default=dict)),
+                ("updated", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "verbose_name": "Deputy Time Off (Advanced)",
+                "verbose_name_plural": "Deputy Time Off (Advanced)",
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.0 on 2026-10-17 21:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peddleconcept", "0007_deputytimeoff"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PayCalcDay",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("pay_date", models.DateField(unique=True)),
+                ("config_version", models.CharField(blank=True, max_length=64)),
+                ("calculated", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "verbose_name": "Pay Calculation Day (Advanced)",
+                "verbose_name_plural": "Pay Calculation Days (Advanced)",
+            },
+        ),
+        migrations.CreateModel(
+            name="RiderPayDirty",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("pay_date", models.DateField()),
+                ("created", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "person",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="peddleconcept.person",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Rider Pay Dirty (Advanced)",
+                "verbose_name_plural": "Rider Pay Dirty (Advanced)",
+                "indexes": [
+                    models.Index(fields=["pay_date"], name="riderpaydirty_pay_date_idx")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("peddleconcept", "0008_paycalcday_riderpaydirty"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="session",
+            index=models.Index(
+                fields=["source", "source_row_id"], name="session_source_row_id_idx"
+            ),
+        ),
+    ]
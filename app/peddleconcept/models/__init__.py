@@ -1,5 +1,5 @@
 from .base import MutableDataRecord, Settings, ChangeLog, ScheduledTask
-from .payroll import Timesheet, RiderPaySlot
+from .payroll import Timesheet, RiderPaySlot, PayCalcDay, RiderPayDirty
 from .people import Person, PersonToken
-from .rosters import Roster
-from .tours import Area, Tour, Session, TourRider, RIDER_ROLES, Venue, TourVenue
\ No newline at end of file
+from .rosters import Roster, DeputyTimeOff
+from .tours import Area, Tour, Session, TourRider, RIDER_ROLES, Venue, TourVenue, TourSummary, ScheduleChange
\ No newline at end of file
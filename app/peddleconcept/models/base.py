@@ -39,6 +39,12 @@ class ScheduledTask(models.Model):
 class ChangeLog(models.Model):
     """ Represents addition/change/deletion or similar with regard to some model and some external data system """
 
+    class Meta:
+        indexes = [
+            # for the admin ordering and for archiving old rows, see changelog.py
+            models.Index(fields=['timestamp'], name='changelog_timestamp_idx'),
+        ]
+
     CHANGE_REMOTE_CHOICES = [
         (x, x) for x in ['rezdy', 'fringe', 'deputy', 'local-history']
     ]
@@ -125,6 +131,13 @@ class MutableDataRecord(models.Model):
         for field, value in data.items():
             self.update_field(field, value, source)
 
+    # fields needed to build the JSON data without a model instance, see get_json_values()
+    JSON_FIELDS = ()
+
+    def get_json_values(self):
+        """ returns a dict of the JSON_FIELDS, same as from .values(*JSON_FIELDS) """
+        return {field: getattr(self, field) for field in self.JSON_FIELDS}
+
     def update_field(self, field_name, new_value, source=None):
         """
         Try to update the field with a new value, where the source
@@ -29,6 +29,9 @@ class RiderPaySlot(MutableDataRecord):
     class Meta:
         verbose_name = 'Rider Pay Slot (Advanced)'
         verbose_name_plural = 'Rider Pay Slots (Advanced)'
+        indexes = [
+            models.Index(fields=['time_start'], name='payslot_time_start_idx'),
+        ]
     
     MUTABLE_FIELDS = ('slot_type', 'pay_rate', 'pay_reason', 'pay_minutes', 'description')
     # rider removed
@@ -51,7 +54,7 @@ class RiderPaySlot(MutableDataRecord):
             'id': self.id,
             'rider_id': self.person.id,
             'slot_type': self.slot_type,
-            'tour_rider_id': self.tour_rider.id if self.tour_rider else None,
+            'tour_rider_id': self.tour_rider_id,
             'pay_rate': self.pay_rate,
             'pay_reason': self.pay_reason,
             'pay_minutes': self.pay_minutes,
@@ -59,4 +62,38 @@ class RiderPaySlot(MutableDataRecord):
             'time_start': json_datetime(self.time_start),
             'time_end': json_datetime(self.time_end),
             'field_auto_values': self.field_auto_values,
+            # sent back with any changes to detect conflicting edits, see pay_reports.update_payslots()
+            'updated': json_datetime(self.updated),
         }
+
+class PayCalcDay(models.Model):
+    """
+    A date whose generated RiderPaySlots are up to date with the tour schedule and the pay config (by version),
+    apart from any RiderPayDirty rows for the date. See pay_reports.load_tour_pay_report()
+    """
+    class Meta:
+        verbose_name = 'Pay Calculation Day (Advanced)'
+        verbose_name_plural = 'Pay Calculation Days (Advanced)'
+
+    pay_date = models.DateField(unique=True)
+    config_version = models.CharField(max_length=64, blank=True)
+    calculated = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "%s: pay calculated %s" % (self.pay_date.isoformat(), self.calculated.isoformat())
+
+class RiderPayDirty(models.Model):
+    """
+    A rider-day (or all riders on the date if person is null) whose pay slots must be recalculated, because their
+    tours changed since the last calculation. See pay_reports.mark_pay_slots_dirty()
+    """
+    class Meta:
+        verbose_name = 'Rider Pay Dirty (Advanced)'
+        verbose_name_plural = 'Rider Pay Dirty (Advanced)'
+        indexes = [
+            models.Index(fields=['pay_date'], name='riderpaydirty_pay_date_idx'),
+        ]
+
+    pay_date = models.DateField()
+    person = models.ForeignKey('Person', on_delete=models.CASCADE, null=True, blank=True)
+    created = models.DateTimeField(default=timezone.now)
@@ -67,4 +67,21 @@ class Roster(MutableDataRecord):
             'source_row_id': self.source_row_id,
             'readonly': getattr(self, '_is_manual', False),
         }
-        
\ No newline at end of file
+        
+
+class DeputyTimeOff(models.Model):
+    """
+    Leave and unavailability of all Deputy employees on one date, so the Tour Schedule Editor doesn't have to wait
+    for Deputy when opened. Refreshed in the background, see deputy.refresh_deputy_time_off()
+    """
+    class Meta:
+        verbose_name = 'Deputy Time Off (Advanced)'
+        verbose_name_plural = 'Deputy Time Off (Advanced)'
+
+    time_off_date = models.DateField(unique=True)
+    # Deputy employee ID -> list of [start, end, comment] with JSON datetimes
+    data = models.JSONField(default=dict, blank=True)
+    updated = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "%s: time off for %d employees" % (self.time_off_date.isoformat(), len(self.data))
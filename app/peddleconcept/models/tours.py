@@ -85,6 +85,12 @@ class Session(MutableDataRecord):
     """
     class Meta:
         verbose_name = 'Tour Session'
+        indexes = [
+            models.Index(fields=['time_start'], name='session_time_start_idx'),
+            models.Index(fields=['source', 'time_start'], name='session_source_time_idx'),
+            # the importers look up sessions by their source ID, same as tours
+            models.Index(fields=['source', 'source_row_id'], name='session_source_row_id_idx'),
+        ]
 
     MUTABLE_FIELDS = ('session_type', 'time_start', 'time_end', 'session_note', 'title')
 
@@ -109,21 +115,39 @@ class Session(MutableDataRecord):
     def get_title(self):
         return "%s - %s — %s" % (format_time(self.time_start), format_time(self.time_end), self.session_type)
 
-    def to_json(self, in_editor=False):
+    # fields used by values_to_json(), eg. for Session.objects.values(*Session.JSON_FIELDS)
+    JSON_FIELDS = ('id', 'time_start', 'time_end', 'session_type', 'title', 'source_row_state', 'field_auto_values')
+
+    @staticmethod
+    def values_to_json(values, in_editor=False):
+        """ Session JSON data from a dict of the JSON_FIELDS, without needing a model instance """
         data = {
-            'id': self.id,
-            'time_start': json_datetime(self.time_start),
-            'time_end': json_datetime(self.time_end),
-            'title': self.title or self.get_title(),
-            'source_row_state': self.source_row_state,
+            'id': values['id'],
+            'time_start': json_datetime(values['time_start']),
+            'time_end': json_datetime(values['time_end']),
+            'title': values['title'] or "%s - %s — %s" % (
+                format_time(values['time_start']), format_time(values['time_end']), values['session_type']),
+            'source_row_state': values['source_row_state'],
         }
         
         if in_editor:
-            data['field_auto_values'] = self.field_auto_values
+            data['field_auto_values'] = values['field_auto_values']
 
         return data
 
+    def to_json(self, in_editor=False):
+        return self.values_to_json(self.get_json_values(), in_editor=in_editor)
+
 class Tour(MutableDataRecord):
+    class Meta:
+        indexes = [
+            # most tour queries are date ranges (see util.get_date_filter), often for one area or data source
+            models.Index(fields=['time_start'], name='tour_time_start_idx'),
+            models.Index(fields=['tour_area', 'time_start'], name='tour_area_time_start_idx'),
+            models.Index(fields=['source', 'time_start'], name='tour_source_time_start_idx'),
+            models.Index(fields=['source', 'source_row_id'], name='tour_source_row_id_idx'),
+        ]
+
     MUTABLE_FIELDS = ('time_start', 'time_end',
         'tour_type', 'pickup_location', 'customer_name', 'customer_contact',
         'quantity', 'bikes', 'pax', 'notes', 'tour_area_id', 'session_id'
@@ -162,25 +186,41 @@ class Tour(MutableDataRecord):
     def is_cancelled(self):
         return self.source_row_state == 'deleted'
 
-    def to_json(self, with_related_data=False, in_editor=False):
+    # fields used by values_to_json(), eg. for Tour.objects.values(*Tour.JSON_FIELDS)
+    JSON_FIELDS = (
+        'id', 'tour_area_id', 'session_id', 'time_start', 'time_end', 'tour_type', 'pickup_location',
+        'customer_name', 'customer_contact', 'quantity', 'bikes', 'pax', 'notes', 'venue_notes',
+        'source_row_state', 'field_auto_values',
+    )
+
+    @staticmethod
+    def values_to_json(values, in_editor=False):
+        """ Tour JSON data (without riders & venues) from a dict of the JSON_FIELDS, without needing a model instance """
         data = {
-            'id': self.id,
-            'area_id': self.tour_area_id,
-            'session_id': self.session_id,
-            'time_start': json_datetime(self.time_start),
-            'time_end': json_datetime(self.time_end),
-            'tour_type': self.tour_type,
-            'pickup_location': self.pickup_location,
-            'customer_name': self.customer_name,
-            'customer_contact': self.customer_contact,
-            'quantity': self.quantity,
-            'bikes': self.bikes,
-            'pax': self.pax,
-            'notes': self.notes,
-            'venue_notes': self.venue_notes,
-            'source_row_state': self.source_row_state,
+            'id': values['id'],
+            'area_id': values['tour_area_id'],
+            'session_id': values['session_id'],
+            'time_start': json_datetime(values['time_start']),
+            'time_end': json_datetime(values['time_end']),
+            'tour_type': values['tour_type'],
+            'pickup_location': values['pickup_location'],
+            'customer_name': values['customer_name'],
+            'customer_contact': values['customer_contact'],
+            'quantity': values['quantity'],
+            'bikes': values['bikes'],
+            'pax': values['pax'],
+            'notes': values['notes'],
+            'venue_notes': values['venue_notes'],
+            'source_row_state': values['source_row_state'],
         }
 
+        if in_editor:
+            data['field_auto_values'] = values['field_auto_values']
+        return data
+
+    def to_json(self, with_related_data=False, in_editor=False):
+        data = self.values_to_json(self.get_json_values(), in_editor=in_editor)
+
         if with_related_data:
             data['riders'] = [ 
                 tr.to_json() 
@@ -190,12 +230,69 @@ class Tour(MutableDataRecord):
                 tv.to_json(in_editor=in_editor)
                 for tv in sorted(self.venues.all(), key=lambda v: v.time_arrive)
             ]
-
-        if in_editor:
-            data['field_auto_values'] = self.field_auto_values
         return data
 
 
+class TourSummary(models.Model):
+    """
+    Precomputed Tour Dashboard summary for all tours in one area on one day.
+    Recalculated whenever tours or tour riders change, see tours.schedules.on_schedule_changed()
+    """
+    class Meta:
+        verbose_name = 'Tour Summary (Advanced)'
+        verbose_name_plural = 'Tour Summaries (Advanced)'
+        indexes = [
+            models.Index(fields=['tour_date'], name='toursummary_tour_date_idx'),
+        ]
+
+    tour_date = models.DateField()
+    tour_area = models.ForeignKey(Area, on_delete=models.CASCADE, null=True)
+    cancelled = models.PositiveIntegerField(default=0)
+    needs_riders = models.PositiveIntegerField(default=0)
+    filled = models.PositiveIntegerField(default=0)
+    tours = models.JSONField(default=list, blank=True, help_text="Tours list as shown on the Tour Dashboard")
+    tours_updated = models.DateTimeField(null=True, blank=True, help_text="Latest update time of the tours")
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s: %d tours in area %s" % (self.tour_date.isoformat(), len(self.tours), self.tour_area_id)
+
+    def to_json(self):
+        # areaInfo in TourDashboard.jsx
+        return {
+            'cancelled': self.cancelled,
+            'needs_riders': self.needs_riders,
+            'filled': self.filled,
+            'tours': self.tours,
+            'area_id': self.tour_area_id,
+        }
+
+
+class ScheduleChange(models.Model):
+    """
+    Notification of a committed change to the tours in one area on one day, streamed to the Tour Schedule Viewer
+    and Tour Dashboard. Old rows are pruned automatically, see tours.schedule_events.record_schedule_changes()
+    """
+    class Meta:
+        verbose_name = 'Schedule Change (Advanced)'
+        verbose_name_plural = 'Schedule Changes (Advanced)'
+
+    tour_date = models.DateField()
+    tour_area = models.ForeignKey(Area, on_delete=models.CASCADE, null=True)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return "%s: changes in area %s" % (self.tour_date.isoformat(), self.tour_area_id)
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'tour_area_id': self.tour_area_id,
+            'tours_date': json_datetime(self.tour_date),
+            'isodate': self.tour_date.isoformat(),
+        }
+
+
 RIDER_ROLES = {
     'lead': ('L', 'Tour Lead'),
     'colead': ('CL', 'Tour Co-lead'),
@@ -227,19 +324,27 @@ class TourRider(MutableDataRecord):
     def __str__(self):
         return '%s: %s' % (str(self.tour), self.person.name)
 
-    def to_json(self):
+    # fields used by values_to_json(), eg. for TourRider.objects.values(*TourRider.JSON_FIELDS)
+    JSON_FIELDS = ('id', 'person_id', 'tour_id', 'rider_role')
+
+    @staticmethod
+    def values_to_json(values, tour_values):
+        """ TourRider JSON data from dicts of the JSON_FIELDS and the tour's Tour.JSON_FIELDS """
         return {
-            'id': self.id,
-            'tr_id': self.id,
-            'rider_id': self.person_id,
-            'tour_id': self.tour_id,
-            'rider_role': self.rider_role,
-            'rider_role_short': self.display_role_short(),
-            'time_start': json_datetime(self.tour.time_start),
-            'time_end': json_datetime(self.tour.time_end),
-            'tour_type': self.tour.tour_type,
+            'id': values['id'],
+            'tr_id': values['id'],
+            'rider_id': values['person_id'],
+            'tour_id': values['tour_id'],
+            'rider_role': values['rider_role'],
+            'rider_role_short': RIDER_ROLES[values['rider_role']][0],
+            'time_start': json_datetime(tour_values['time_start']),
+            'time_end': json_datetime(tour_values['time_end']),
+            'tour_type': tour_values['tour_type'],
         }
 
+    def to_json(self):
+        return self.values_to_json(self.get_json_values(), self.tour.get_json_values())
+
 
 class TourVenue(MutableDataRecord):
     class Meta:
@@ -270,18 +375,26 @@ class TourVenue(MutableDataRecord):
                 (self.time_depart - self.time_arrive).total_seconds() // 60
             )
 
-    def to_json(self, in_editor=False):
+    # fields used by values_to_json(), eg. for TourVenue.objects.values(*TourVenue.JSON_FIELDS)
+    JSON_FIELDS = ('id', 'tour_id', 'venue_id', 'activity', 'time_arrive', 'time_depart', 'notes', 'field_auto_values')
+
+    @staticmethod
+    def values_to_json(values, in_editor=False):
+        """ TourVenue JSON data from a dict of the JSON_FIELDS, without needing a model instance """
         data = {
-            'id': self.id,
-            'tour_id': self.tour_id,
-            'venue_id': self.venue_id if self.venue_id else None,
-            'activity': self.activity,
-            'duration': (self.time_depart - self.time_arrive).total_seconds() // 60,
-            'notes': self.notes,
+            'id': values['id'],
+            'tour_id': values['tour_id'],
+            'venue_id': values['venue_id'] if values['venue_id'] else None,
+            'activity': values['activity'],
+            'duration': (values['time_depart'] - values['time_arrive']).total_seconds() // 60,
+            'notes': values['notes'],
         }
         if in_editor:
-            data['field_auto_values'] = self.field_auto_values
+            data['field_auto_values'] = values['field_auto_values']
         return data
 
+    def to_json(self, in_editor=False):
+        return self.values_to_json(self.get_json_values(), in_editor=in_editor)
+
 
 
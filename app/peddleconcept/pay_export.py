@@ -0,0 +1,207 @@
+import csv, logging, re
+
+from django.utils.timezone import localdate
+
+from peddleconcept.actions import Echo
+from peddleconcept.models import RiderPaySlot
+from peddleconcept.models.people import BSB_REGEX, BANK_ACCT_REGEX
+from peddleconcept.pay_reports import get_tour_pay_config, recalculate_tour_pay_slots
+from peddleconcept.settings import get_pay_export_setting, PAY_EXPORT_SETTING
+from peddleconcept.util import get_date_filter
+
+logger = logging.getLogger(__name__)
+
+PAY_EXPORT_FORMATS = ('csv', 'aba')
+
+# read from the pay slots for the totals, ordered by rider
+PAY_TOTAL_COLUMNS = (
+    'person_id', 'person__first_name', 'person__last_name', 'person__display_name', 'person__user__username',
+    'person__bank_bsb', 'person__bank_acct', 'pay_minutes', 'pay_rate',
+)
+
+PAY_TOTAL_CSV_HEADER = ('Rider Name', 'Hours', 'Pay', 'BSB', 'Account Number', 'Bank Details Valid')
+
+# ABA (Australian direct entry / "Cemtext") file format: fixed width records of 120 characters
+ABA_RECORD_LENGTH = 120
+ABA_TXN_CODE_PAY = '53'
+ABA_ACCOUNT_MAX_LEN = 9
+# characters outside the BECS character set are replaced with spaces
+ABA_BAD_CHARS_REGEX = re.compile(r"[^A-Za-z0-9 &'()*+,./:;?@-]")
+ABA_REQUIRED_SETTINGS = (
+    'aba_bank_code', 'aba_user_name', 'aba_user_id', 'aba_remitter_name', 'aba_trace_bsb', 'aba_trace_account',
+)
+
+def get_person_name(first_name, last_name, display_name, username):
+    """ same as Person.name, from the values_list() columns """
+    return ('%s %s' % (first_name, last_name)).strip() or display_name or username or '(no name)'
+
+def get_aba_bsb(bsb):
+    """ returns the BSB in the XXX-XXX format used by ABA files, or None if it isn't valid """
+    bsb = (bsb or '').strip()
+    if not BSB_REGEX.fullmatch(bsb):
+        return None
+    digits = bsb.replace('-', '')
+    return '%s-%s' % (digits[:3], digits[3:])
+
+def is_aba_account(acct):
+    acct = (acct or '').strip()
+    return bool(BANK_ACCT_REGEX.fullmatch(acct)) and len(acct) <= ABA_ACCOUNT_MAX_LEN
+
+def iter_pay_totals(start_date, end_date, chunk_size=2000):
+    """
+    Generates the pay totals for each rider with pay slots between the dates, ordered by rider name:
+    { id, name, bsb, acct, pay_minutes, pay_cents, num_slots, bank_valid }
+    The pay slots are read as values_list() rows ordered by rider, chunk_size rows at a time, so only one rider's
+    totals are kept in memory.
+    """
+    rows = (
+        RiderPaySlot.objects.filter(person__isnull=False, **get_date_filter(start_date, end_date, 'time_start'))
+        .exclude(source_row_state='deleted')
+        .order_by('person__first_name', 'person__last_name', 'person_id', 'time_start')
+        .values_list(*PAY_TOTAL_COLUMNS)
+    )
+
+    def finish(total):
+        # pay_rate is per hour: round the rider's total to the nearest cent, not each pay slot
+        total['pay_cents'] = (total.pop('rate_minutes') * 100 + 30) // 60
+        return total
+
+    total = None
+    for person_id, first_name, last_name, display_name, username, bsb, acct, pay_minutes, pay_rate in rows.iterator(
+            chunk_size=chunk_size):
+        if total is None or total['id'] != person_id:
+            if total is not None:
+                yield finish(total)
+            total = {
+                'id': person_id,
+                'name': get_person_name(first_name, last_name, display_name, username),
+                'bsb': bsb,
+                'acct': acct,
+                'bank_valid': get_aba_bsb(bsb) is not None and is_aba_account(acct),
+                'pay_minutes': 0,
+                'rate_minutes': 0,
+                'num_slots': 0,
+            }
+        total['pay_minutes'] += pay_minutes
+        total['rate_minutes'] += pay_rate * pay_minutes
+        total['num_slots'] += 1
+
+    if total is not None:
+        yield finish(total)
+
+def iter_pay_totals_csv(totals):
+    """ Generates the lines of a CSV summary of the pay totals, same columns as the pay report's Export CSV """
+    writer = csv.writer(Echo())
+    yield writer.writerow(PAY_TOTAL_CSV_HEADER)
+    for total in totals:
+        yield writer.writerow([
+            total['name'],
+            '%.2f' % (total['pay_minutes'] / 60),
+            '$%d.%02d' % divmod(total['pay_cents'], 100),
+            total['bsb'],
+            total['acct'],
+            'yes' if total['bank_valid'] else 'no',
+        ])
+
+def aba_field(value, length, align='left', fill=' '):
+    value = ABA_BAD_CHARS_REGEX.sub(' ', str(value))[:length]
+    return value.ljust(length, fill) if align == 'left' else value.rjust(length, fill)
+
+def aba_record(*fields):
+    record = ''.join(fields)
+    if len(record) != ABA_RECORD_LENGTH:
+        raise ValueError('ABA record is %d characters, expected %d' % (len(record), ABA_RECORD_LENGTH))
+    return record + '\r\n'
+
+def iter_aba_records(totals, export_setting, process_date, reference, skipped=None):
+    """
+    Generates the records of an ABA direct entry file paying each rider's total, as lines of text.
+    Riders without valid bank details or with nothing to pay are left out, and appended to skipped if given.
+    """
+    trace_bsb = get_aba_bsb(export_setting['aba_trace_bsb'])
+    trace_account = export_setting['aba_trace_account'].strip()
+    remitter_name = export_setting['aba_remitter_name']
+
+    # descriptive record
+    yield aba_record(
+        '0', ' ' * 17, '01',
+        aba_field(export_setting['aba_bank_code'], 3), ' ' * 7,
+        aba_field(export_setting['aba_user_name'], 26),
+        aba_field(export_setting['aba_user_id'], 6, 'right', '0'),
+        aba_field(export_setting.get('aba_description') or 'PAYROLL', 12),
+        process_date.strftime('%d%m%y'), ' ' * 40,
+    )
+
+    num_records = 0
+    total_cents = 0
+    for total in totals:
+        if not total['bank_valid'] or total['pay_cents'] <= 0:
+            logger.warning('ABA export: skipped %s (%d), bank details %s, pay %d cents' % (
+                total['name'], total['id'], 'valid' if total['bank_valid'] else 'invalid', total['pay_cents'],
+            ))
+            if skipped is not None:
+                skipped.append(total)
+            continue
+
+        # detail record
+        yield aba_record(
+            '1', get_aba_bsb(total['bsb']),
+            aba_field(total['acct'].strip(), 9, 'right'), ' ', ABA_TXN_CODE_PAY,
+            aba_field(total['pay_cents'], 10, 'right', '0'),
+            aba_field(total['name'], 32),
+            aba_field(reference, 18),
+            trace_bsb, aba_field(trace_account, 9, 'right'),
+            aba_field(remitter_name, 16),
+            '0' * 8,
+        )
+        num_records += 1
+        total_cents += total['pay_cents']
+
+    # file total record: credits only, no balancing debit
+    yield aba_record(
+        '7', '999-999', ' ' * 12,
+        aba_field(total_cents, 10, 'right', '0'),
+        aba_field(total_cents, 10, 'right', '0'),
+        aba_field(0, 10, 'right', '0'),
+        ' ' * 24,
+        aba_field(num_records, 6, 'right', '0'),
+        ' ' * 40,
+    )
+
+def check_aba_setting(export_setting):
+    """ returns the names of the ABA settings which are missing or not valid """
+    bad_settings = [name for name in ABA_REQUIRED_SETTINGS if not str(export_setting.get(name) or '').strip()]
+    if 'aba_trace_bsb' not in bad_settings and get_aba_bsb(export_setting['aba_trace_bsb']) is None:
+        bad_settings.append('aba_trace_bsb')
+    if 'aba_trace_account' not in bad_settings and not is_aba_account(export_setting['aba_trace_account']):
+        bad_settings.append('aba_trace_account')
+    return bad_settings
+
+def get_pay_export_filename(start_date, end_date, export_format):
+    return 'TourPays_%s_%s.%s' % (start_date.isoformat(), end_date.isoformat(), export_format)
+
+def get_pay_export(start_date, end_date, export_format, process_date=None, skipped=None, recalculate=True):
+    """
+    Returns a generator of the lines of the weekly pay totals export in export_format ('csv' or 'aba'), after
+    recalculating the pay slots which changed since the last calculation.
+    Raises ValueError if the format is unknown or the ABA export isn't configured.
+    """
+    if export_format not in PAY_EXPORT_FORMATS:
+        raise ValueError('Unknown pay export format: %s' % export_format)
+
+    export_setting = get_pay_export_setting()
+    if export_format == 'aba' and (bad_settings := check_aba_setting(export_setting)):
+        raise ValueError('ABA export is not configured: please check %s in %s Settings' % (
+            ', '.join(bad_settings), PAY_EXPORT_SETTING,
+        ))
+
+    # done now rather than when the export is first read
+    if recalculate:
+        recalculate_tour_pay_slots(start_date, end_date, get_tour_pay_config())
+
+    totals = iter_pay_totals(start_date, end_date, chunk_size=export_setting.get('chunk_size', 2000))
+    if export_format == 'csv':
+        return iter_pay_totals_csv(totals)
+
+    reference = '%s %s' % (export_setting.get('aba_description') or 'PAYROLL', start_date.strftime('%d%m%y'))
+    return iter_aba_records(totals, export_setting, process_date or localdate(), reference, skipped=skipped)
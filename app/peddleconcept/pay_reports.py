@@ -1,7 +1,13 @@
 from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.timezone import localdate, localtime
+import copy
+import hashlib
+import json
 import logging
 import math
+from .merge import bulk_update_changed
 from .models import *
 from .util import *
 from .settings import *
@@ -9,11 +15,15 @@ from .settings import *
 def get_tour_pay_config():
     pay_config = get_setting(TOUR_PAY_SETTING) or {}
     
-    tour_types_qs = Tour.objects.all().order_by('tour_type')
-
     pay_config.setdefault('roles', {})
     pay_config.setdefault('tour_types', {})
 
+    # only the tour types which are not fully configured yet need to be looked at
+    tour_types_qs = Tour.objects.exclude(tour_type__in=[
+        tour_type for tour_type, tt in pay_config['tour_types'].items()
+        if isinstance(tt, dict) and 'pay_rate' in tt and 'paid_duration_mins' in tt
+    ]).exclude(tour_type__icontains='custom').order_by('tour_type')
+
     # ensure pay config is fully up to date with actual tours
     for role_id, role in RIDER_ROLES.items():
         if role_id == '':
@@ -68,276 +78,467 @@ def save_tour_pay_config(pay_config):
 
     set_setting(TOUR_PAY_SETTING, conf)
 
-def get_pay_rate(pay_config, tour_rider):
-    """ returns the _default_ hourly pay rate for a given TourRider along with a reason """
+# changed whenever calculate_tour_pay_slots() calculates different pay slots, to recalculate every date
+PAY_CALC_VERSION = 2
+# the Weekly Tour Pays report only recalculates the weeks starting up to this many days ago
+PAY_RECALCULATE_DAYS = 14
+
+def get_pay_config_version(pay_config):
+    """
+    Changes whenever anything besides the tour schedule which affects the calculated pay slots is changed:
+    the pay config (including the fixed rider rates), the rider pay rates and the rider classes
+    """
+    data = [
+        PAY_CALC_VERSION,
+        pay_config,
+        get_rider_payrate_setting(),
+        list(Person.objects.filter(rider_class__gt='').order_by('id').values_list('id', 'rider_class')),
+    ]
+    return hashlib.md5(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+def mark_pay_slots_dirty(keys):
+    """
+    Record that the pay slots for each (date, person ID) in keys must be recalculated, or all the riders on the
+    date if the person ID is None. Called from tours.schedules.on_schedule_changed() for every schedule change.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+
+    # only one row per rider-day until it is recalculated
+    keys -= set(RiderPayDirty.objects.filter(
+        pay_date__in=set(pay_date for pay_date, person_id in keys),
+    ).values_list('pay_date', 'person_id'))
+    RiderPayDirty.objects.bulk_create(
+        RiderPayDirty(pay_date=pay_date, person_id=person_id) for pay_date, person_id in keys
+    )
+
+    # the report doesn't recalculate older dates, so forget their calculation instead: any later recalculation
+    # (eg. for an export) recalculates them in full
+    oldest = add_days(localdate(), -PAY_RECALCULATE_DAYS)
+    if old_dates := set(RiderPayDirty.objects.filter(pay_date__lt=oldest).values_list('pay_date', flat=True)):
+        PayCalcDay.objects.filter(pay_date__in=old_dates).delete()
+        RiderPayDirty.objects.filter(pay_date__in=old_dates).delete()
+
+def get_dirty_rider_days(start_date, end_date, config_version):
+    """
+    Returns { date: set of person IDs, or None for all riders } for the dates from start_date to end_date which need
+    their pay slots recalculated, and the IDs of the RiderPayDirty rows included.
+    Dates which were never calculated, or calculated with a different pay config version, are recalculated in full.
+    """
+    calculated_dates = set(PayCalcDay.objects.filter(
+        pay_date__range=(start_date, end_date), config_version=config_version,
+    ).values_list('pay_date', flat=True))
+    rider_days = {
+        pay_date: None
+        for n in range((end_date - start_date).days + 1)
+        if (pay_date := add_days(start_date, n)) not in calculated_dates
+    }
+
+    dirty_ids = []
+    for dirty_id, pay_date, person_id in RiderPayDirty.objects.filter(
+        pay_date__range=(start_date, end_date),
+    ).values_list('id', 'pay_date', 'person_id'):
+        dirty_ids.append(dirty_id)
+        if pay_date in rider_days and rider_days[pay_date] is None:
+            continue
+        if person_id is None:
+            rider_days[pay_date] = None
+        else:
+            rider_days.setdefault(pay_date, set()).add(person_id)
+
+    return rider_days, dirty_ids
+
+def get_person_pay_rate(pay_config, person, rider_pay_rates):
+    """ returns the _default_ hourly pay rate for a Person along with a reason, given the rider pay rates setting """
 
     # Rider pay rate takes precedence
-    if tour_rider.person.override_pay_rate:
-        return (tour_rider.person.override_pay_rate, 'Fixed rider rate')
+    if person.override_pay_rate:
+        return (person.override_pay_rate, 'Fixed rider rate')
 
-    rider_rate = tour_rider.person.pay_rate()
+    rider_rate = rider_pay_rates.get(person.rider_class) if person.rider_class else None
     if rider_rate:
-        return (rider_rate, tour_rider.person.rider_class_label())
+        return (rider_rate, person.rider_class_label())
 
     # fall back to defailt rate
     return (
         pay_config.get('default_rate', 30),
         'Default rate'
     )
-    
 
+def get_pay_rate(pay_config, tour_rider):
+    """ returns the _default_ hourly pay rate for a given TourRider along with a reason """
+    return get_person_pay_rate(pay_config, tour_rider.person, get_rider_payrate_setting())
+
+# TourRider columns loaded by calculate_tour_pay_slots()
+PAY_SLOT_TOUR_RIDER_COLUMNS = (
+    'id', 'person_id', 'rider_role', 'tour__time_start', 'tour__time_end', 'tour__tour_type',
+)
 
-def generate_tour_pay_slots(start_date, end_date, pay_config):
+def calculate_tour_pay_slots(start_date, end_date, pay_config, rider_days=None):
     """
-    Make some PaySlot instances for each Rider's scheduled TourRiders and break times for the pay period.
-    Returns a list of RiderPaySlots.
+    Calculate the pay slots for each Rider's scheduled TourRiders and break times for the pay period, from the
+    TourRider columns loaded with a single query (no model instances) and the pay rate of each rider looked up once.
+    If rider_days is given, only those are calculated, see get_dirty_rider_days().
+    Returns a list of dicts of RiderPaySlot field values, the set of tour types seen and the people by ID.
 
     post-processing: update paid break times
     maximise to daily unpaid break time
     
     enforce minimum pay time
     """
-    tour_riders = TourRider.objects.select_related('tour', 'person', 'tour__session').filter(
-        **get_date_filter(start_date, end_date, 'tour__time_start')
-    ).order_by('person__id', 'tour__time_start')
-
-    # Group TourRiders by Rider, as lists of tours per day
-    riders_tours = {}
-    day = None
-    last_rider = None
-    for tr in tour_riders:
-        # for each rider ID, store the TourRiders in time order
-        if (today := tr.tour.time_start.date()) != day or last_rider != tr.person:
-            tours_today = []
-            riders_tours.setdefault(tr.person.id, []).append(tours_today)
-            day = today
-            
-        tours_today.append(tr)
-        last_rider = tr.person
+    tour_riders_qs = TourRider.objects.filter(**get_date_filter(start_date, end_date, 'tour__time_start'))
+    if rider_days is not None:
+        rider_days_q = Q(pk__in=[])
+        for pay_date, person_ids in rider_days.items():
+            day_q = Q(**get_date_filter(pay_date, pay_date, 'tour__time_start'))
+            if person_ids is not None:
+                day_q &= Q(person_id__in=person_ids)
+            rider_days_q |= day_q
+        tour_riders_qs = tour_riders_qs.filter(rider_days_q)
+
+    tour_rider_rows = tour_riders_qs.order_by(
+        'person__id', 'tour__time_start',
+    ).values_list(*PAY_SLOT_TOUR_RIDER_COLUMNS)
+    if not tour_rider_rows:
+        return [], set(), {}
+    tr_ids, person_ids, rider_roles, times_start, times_end, tour_types = zip(*tour_rider_rows)
+
+    people = Person.objects.in_bulk(set(person_ids))
+    rider_pay_rates = get_rider_payrate_setting()
+    pay_rates = {
+        person_id: get_person_pay_rate(pay_config, person, rider_pay_rates)
+        for person_id, person in people.items()
+    }
+    tour_types_config = pay_config.get('tour_types', {})
 
     time_before_unpaid_break = pay_config.get('time_before_unpaid_break', 100000)
     daily_unpaid_break_mins = pay_config.get('daily_unpaid_break_mins', 30)
     min_daily_mins = pay_config.get('min_daily_mins', 0) # give me this day my daily minute
     break_pay_rate = pay_config.get('break_pay_rate', 0)
     paid_break_max = pay_config.get('paid_break_max_len', 0)
-    tour_types_seen = set()
 
     pay_slots = []
-    # process one rider at a time
-    for rider_id, tours_days in riders_tours.items():
-        for tours_today in tours_days:
-            # don't roll-over from one day to the next, break slots are only inserted _in between_ tours on the same day
+
+    def add_pay_slot(slot_type, i, time_start, time_end, pay_minutes, pay_rate, pay_reason, description, slot_id):
+        pay_slots.append({
+            'source_row_id': slot_id, # important: this should be unique!
+            'source': 'generate_pay_report',
+            'person_id': person_ids[i],
+            'slot_type': slot_type,
+            'tour_rider_id': tr_ids[i],
+            'time_start': time_start,
+            'time_end': time_end,
+            'pay_minutes': pay_minutes,
+            'pay_rate': pay_rate,
+            'pay_reason': pay_reason,
+            'description': description,
+        })
+        return pay_slots[-1]
+
+    def finish_day(last):
+        # add the minimum pay for the rider-day ending with the TourRider at index last
+        if my_total_mins < min_daily_mins:
+            extra_mins = min_daily_mins - my_total_mins
+            add_pay_slot('break', last, last_ps['time_end'], last_ps['time_end'] + timedelta(minutes=extra_mins),
+                extra_mins, last_ps['pay_rate'], last_ps['pay_reason'],
+                'Extra pay (minimum %0.2fh)' % (min_daily_mins / 60),
+                '%d_extra_%d' % (person_ids[last], tr_ids[last]))
+
+    # one pass over the TourRiders, which are in order of rider then time
+    day_key = None
+    for i in range(len(tr_ids)):
+        # don't roll-over from one day to the next, break slots are only inserted _in between_ tours on the same day
+        if (person_ids[i], localdate(times_start[i])) != day_key:
+            if day_key is not None:
+                finish_day(i - 1)
+            day_key = (person_ids[i], localdate(times_start[i]))
             # cumulative statistics for each rider-day
-            my_pay_slots = []
             my_total_mins = 0 # total paid time (mins)
-            my_total_break = 0 # total paid break time (mins)
             my_unpaid_break = 0 # total unpaid break time (mins)
 
-            last_tr = None
-
-            for tr in tours_today:
-                if last_tr is not None:
-                    # this is not the first tour slot of the day, calculate break time as a pay slot
-                    slot_id = '%d_break_%d' % (last_tr.person.id, last_tr.id)
-                    desc = 'Break between tours'
+        else:
+            # this is not the first tour slot of the day, calculate break time as a pay slot
+            tour_end = last_ps['time_end']
+            pay_end = last_ps['time_start'] + timedelta(minutes=last_ps['pay_minutes'])
+
+            if pay_end >= tour_end:
+                break_mins = (times_start[i] - pay_end).seconds // 60
+            else:
+                break_mins = (times_start[i] - tour_end).seconds // 60
+
+            # check if the specific tour paid time overlaps or includes the actual break time (eg. for xmas lights tours)
+            if break_mins > 0:
+                if break_pay_rate:
+                    pay_rate, pay_reason = break_pay_rate, 'Paid breaks rate'
+                else:
+                    pay_rate, pay_reason = last_ps['pay_rate'], last_ps['pay_reason']
+                pay_minutes = break_mins
+                description = ''
+
+                if paid_break_max:
+                    # all breaks under the paid_break_max time are paid, disregard other options
+                    if break_mins > paid_break_max:
+                        pay_rate, pay_reason, description = 0, '', 'Unpaid break'
+                    else:
+                        description = 'Paid break'
 
-                    tour_end = last_ps.time_end
-                    pay_end = last_ps.time_start + timedelta(minutes=last_ps.pay_minutes)
+                elif my_total_mins >= time_before_unpaid_break and my_unpaid_break < daily_unpaid_break_mins:
+                    # check if the total paid time so far allows an unpaid break, and we have not exceeded max unpaid break time yet
+                    unpaid_break_mins = min(daily_unpaid_break_mins - my_unpaid_break, break_mins)
+                    break_paid_mins = break_mins - unpaid_break_mins
+                    my_unpaid_break += unpaid_break_mins
 
-                    if pay_end >= tour_end:
-                        break_mins = (tr.tour.time_start - pay_end).seconds // 60
+                    if break_paid_mins > 0:
+                        description = 'Partially paid break'
+                        pay_minutes = break_paid_mins
                     else:
-                        break_mins = (tr.tour.time_start - tour_end).seconds // 60
-
-                    # check if the specific tour paid time overlaps or includes the actual break time (eg. for xmas lights tours)
-                    if break_mins > 0:
-                        ps_break = RiderPaySlot(
-                            source_row_id = slot_id, # important: this should be unique!
-                            source = 'generate_pay_report',
-                            person = last_tr.person,
-                            slot_type = 'break',
-                            tour_rider = last_tr,
-                            time_start = last_ps.time_end,
-                            time_end = tr.tour.time_start,
-                            pay_minutes = break_mins,
-                        )
-
-                        if break_pay_rate:
-                            ps_break.pay_rate = break_pay_rate
-                            ps_break.pay_reason = 'Paid breaks rate'
-                        else:
-                            ps_break.pay_rate = last_ps.pay_rate
-                            ps_break.pay_reason = last_ps.pay_reason
-
-                        if paid_break_max:
-                            # all breaks under the paid_break_max time are paid, disregard other options
-                            if break_mins > paid_break_max:
-                                ps_break.pay_rate = 0
-                                ps_break.pay_reason = ''
-                                ps_break.description = 'Unpaid break'
-                            else:
-                                ps_break.description = 'Paid break'
-
-                        elif my_total_mins >= time_before_unpaid_break and my_unpaid_break < daily_unpaid_break_mins:
-                            # check if the total paid time so far allows an unpaid break, and we have not exceeded max unpaid break time yet
-                            unpaid_break_mins = min(daily_unpaid_break_mins - my_unpaid_break, break_mins)
-                            daily_unpaid_break_mins += unpaid_break_mins
-                            break_paid_mins = break_mins - unpaid_break_mins
-                            my_unpaid_break += unpaid_break_mins
-                            desc = 'Unpaid break' if break_mins == 0 else 'Partially unpaid break'
-
-                            if break_paid_mins > 0:
-                                ps_break.description = 'Partially paid break'
-                                ps_break.pay_minutes = break_paid_mins
-                            else:
-                                ps_break.description = 'Unpaid break'
-                                ps_break.pay_rate = 0
-                                ps_break.pay_reason = ''
-
-                        my_total_break += break_mins
-                        my_total_mins += break_mins
-
-                        pay_slots.append(ps_break)
-                        my_pay_slots.append(ps_break)
-                
-                pay_rate, pay_reason = get_pay_rate(pay_config, tr)
-
-                # configured "paid time" for the tour type should override the actual time duration
-                pay_time = (tr.tour.time_end - tr.tour.time_start).seconds // 60
-                if (cfg_pay_time := pay_config.get('tour_types', {}).get(tr.tour.tour_type, {}).get('paid_duration_mins', 0)):
-                    pay_time = cfg_pay_time
-
-                slot_id = '%d_tour_%d' % (tr.person.id, tr.id)
-                
-                ps = RiderPaySlot(
-                    source_row_id = slot_id,
-                    source = 'generate_pay_report',
-                    person = tr.person,
-                    slot_type = 'tour',
-                    tour_rider = tr,
-                    pay_rate = pay_rate,
-                    pay_reason = pay_reason,
-                    pay_minutes = pay_time,
-                    description = '%s (Role: %s)' % (tr.tour.tour_type, RIDER_ROLES[tr.rider_role][1]),
-                    time_start = tr.tour.time_start,
-                    time_end = tr.tour.time_end,
-                )
-
-                my_total_mins += pay_time
-
-                pay_slots.append(ps)
-                my_pay_slots.append(ps)
-                tour_types_seen.add(tr.tour.tour_type)
-
-                last_tr = tr
-                last_ps = ps
-            
-            # do some last things before moving on to the next day
-            logger.debug('%s rider %s: %d payslots, %d mins paid, %d paid break, %d unpaid break' %
-                (day.isoformat(), last_tr.person.display_name, len(my_pay_slots), my_total_mins, my_total_break, my_unpaid_break))
-            
-            if my_total_mins < min_daily_mins:
-                # update last payslot with difference
-                extra_mins = min_daily_mins - my_total_mins
-                pay_slots.append(RiderPaySlot(
-                    source_row_id = '%d_extra_%d' % (last_tr.person.id, last_tr.id),
-                    source = 'generate_pay_report',
-                    person = last_tr.person,
-                    slot_type = 'break',
-                    tour_rider = last_tr,
-                    pay_rate = last_ps.pay_rate,
-                    pay_reason = last_ps.pay_reason,
-                    pay_minutes = extra_mins,
-                    description = 'Extra pay (minimum %0.2fh)' % (min_daily_mins / 60),
-                    time_start = last_ps.time_end,
-                    time_end = last_ps.time_end + timedelta(minutes=extra_mins),
-                ))
-
-    return pay_slots, tour_types_seen
+                        pay_rate, pay_reason, description = 0, '', 'Unpaid break'
+
+                my_total_mins += break_mins
+                add_pay_slot('break', i - 1, last_ps['time_end'], times_start[i], pay_minutes, pay_rate, pay_reason,
+                    description, '%d_break_%d' % (person_ids[i - 1], tr_ids[i - 1]))
+
+        pay_rate, pay_reason = pay_rates[person_ids[i]]
+
+        # configured "paid time" for the tour type should override the actual time duration
+        pay_time = (times_end[i] - times_start[i]).seconds // 60
+        if (cfg_pay_time := tour_types_config.get(tour_types[i], {}).get('paid_duration_mins', 0)):
+            pay_time = cfg_pay_time
+
+        my_total_mins += pay_time
+        last_ps = add_pay_slot('tour', i, times_start[i], times_end[i], pay_time, pay_rate, pay_reason,
+            '%s (Role: %s)' % (tour_types[i], RIDER_ROLES[rider_roles[i]][1]),
+            '%d_tour_%d' % (person_ids[i], tr_ids[i]))
+
+    # do some last things before moving on to the next day
+    finish_day(len(tr_ids) - 1)
+
+    return pay_slots, set(tour_types), people
+
+def make_pay_slot(values, people):
+    """ RiderPaySlot instance from field values of calculate_tour_pay_slots(), with the person already loaded """
+    return RiderPaySlot(
+        person=people[values['person_id']], **{f: v for f, v in values.items() if f != 'person_id'}
+    )
+
+def generate_tour_pay_slots(start_date, end_date, pay_config):
+    """
+    Make some PaySlot instances for each Rider's scheduled TourRiders and break times for the pay period.
+    Returns a list of RiderPaySlots, see calculate_tour_pay_slots().
+    """
+    pay_slots, tour_types_seen, people = calculate_tour_pay_slots(start_date, end_date, pay_config)
+    return [make_pay_slot(values, people) for values in pay_slots], tour_types_seen
+
+def compare_pay_slot_values(pay_slots, existing_rows, people):
+    """
+    Same as match_and_compare_rows() by source_row_id on the RiderPaySlot.MUTABLE_FIELDS, for the field values from
+    calculate_tour_pay_slots(). Only the added rows are made into RiderPaySlot instances, and changed rows are
+    (existing row, field values, diff).
+    """
+    old_data = { row.source_row_id: row for row in existing_rows }
+    new_data = { values['source_row_id']: values for values in pay_slots }
+
+    rows_changed, rows_added, rows_deleted, rows_unchanged = {}, {}, {}, {}
+    for row_id, values in new_data.items():
+        if (row := old_data.get(row_id)) is None:
+            rows_added[row_id] = make_pay_slot(values, people)
+        elif (diff := {
+            f: (getattr(row, f), values[f]) for f in RiderPaySlot.MUTABLE_FIELDS if getattr(row, f) != values[f]
+        }):
+            rows_changed[row_id] = (row, values, diff)
+        else:
+            rows_unchanged[row_id] = (row, values)
+
+    for row_id, row in old_data.items():
+        if not row_id in new_data:
+            rows_deleted[row_id] = row
+
+    return rows_changed, rows_added, rows_deleted, rows_unchanged, {}
 
 def update_payslots(payslot_data):
-    """ Updates payslots in database with json-style payslot data """
+    """
+    Updates payslots in database with json-style payslot data, only writing the fields which changed with one
+    bulk_update() per set of changed fields. Payslots which were changed by someone else since the data was loaded
+    (going by the 'updated' timestamp sent back with the data) are not updated, if the data would overwrite them.
+    Returns a list of { id, result: 'updated', 'unchanged', 'conflict' or 'missing', fields: [changed fields] }
+    for each payslot, with the current payslot data for conflicts.
+    """
     payslots = {
         ps.get('id'): ps for ps in payslot_data
     }
+    results = []
+    changed_rows = [] # (row, set of changed field names)
+    now = timezone.now()
+
     with transaction.atomic():
-        payslots_db = RiderPaySlot.objects.in_bulk(id_list=payslots.keys())
+        payslots_db = RiderPaySlot.objects.select_related('person').select_for_update(of=('self',)).in_bulk(
+            id_list=payslots.keys())
 
         for ps_id, ps_json in payslots.items():
             ps = payslots_db.get(ps_id)
             if ps is None:
+                results.append({'id': ps_id, 'result': 'missing', 'fields': []})
+                continue
+
+            fields = [f for f in RiderPaySlot.MUTABLE_FIELDS if f in ps_json and ps_json[f] != getattr(ps, f)]
+            if fields and ps_json.get('updated') is not None and ps_json['updated'] != json_datetime(ps.updated):
+                results.append({'id': ps_id, 'result': 'conflict', 'fields': fields, 'payslot': ps.to_json()})
                 continue
 
-            ps.update_from_dict(ps_json, 'user')
-            ps.save()
+            fields = [f for f in fields if ps.update_field(f, ps_json[f], 'user')]
+            if fields:
+                # bulk_update() doesn't set auto_now fields
+                ps.updated = now
+                changed_rows.append((ps, set(fields) | {'updated'}))
+            results.append({'id': ps_id, 'result': 'updated' if fields else 'unchanged', 'fields': fields})
+
+        bulk_update_changed(RiderPaySlot, changed_rows)
+
+    return results
 
 
 def update_db_rowset(changed, added, deleted, change_source, existing_rows):
     """
     Typical input comes from match_and_compare_rows().
     Returns resulting list of rows, including deleted rows marked with source_row_state='deleted'.
+    Rows are written in bulk: one bulk_update() per set of changed fields, one bulk_create() for the new rows
+    and one update() for the deleted rows.
     """
     result_set = {
         row.id: row for row in existing_rows
     }
+    now = timezone.now()
+
+    # New rows which are matched with an existing row: update the existing row, preserve row ID
+    changed_rows = [] # (row, set of changed field names)
+    for row_id, chg in changed.items():
+        # chg is a 3-tuple of (old_inst, new_inst, diff) - from match_and_compare_rows
+        # diff is a dict of field_name: (old_value, new_value)
+
+        existing_row = chg[0]
+        orig_auto_values = copy.deepcopy(existing_row.field_auto_values)
+        # copy the new data into the existing Model instance
+        fields = set(
+            field_name for field_name, diff in chg[2].items()
+            if existing_row.update_field(field_name, diff[1], change_source)
+        )
+        if existing_row.field_auto_values != orig_auto_values:
+            fields.add('field_auto_values')
+        if fields:
+            # bulk_update() doesn't set auto_now fields
+            existing_row.updated = now
+            fields.add('updated')
+            changed_rows.append((existing_row, fields))
+        result_set[existing_row.id] = existing_row
+
+    # New rows
+    for new_row in added.values():
+        new_row.source = change_source
 
     with transaction.atomic():
-        # New rows which are matched with an existing row: update the existing row, preserve row ID
-        for row_id, chg in changed.items():
-            # chg is a 3-tuple of (old_inst, new_inst, diff) - from match_and_compare_rows
-            # diff is a dict of field_name: (old_value, new_value)
-            # create a Changes row to represent each create/update/delete operation performed on the DB
-
-            existing_row = chg[0]
-            # copy the new data into the existing Model instance
-            for field_name, diff in chg[2].items():
-                existing_row.update_field(field_name, diff[1], change_source)
-            existing_row.save()
-            result_set[existing_row.id] = existing_row
-
-        # New rows
-        for row_id, new_row in added.items():
-            new_row.source = change_source
-            new_row.save()
-            result_set[new_row.id] = new_row
+        if changed_rows:
+            bulk_update_changed(type(changed_rows[0][0]), changed_rows)
+
+        if added:
+            for new_row in type(next(iter(added.values()))).objects.bulk_create(added.values()):
+                result_set[new_row.id] = new_row
 
         # Deleted rows
-        for row_id, del_row in deleted.items():
-            del_row.source_row_state = 'deleted'
-            del_row.save()
-            if del_row.id in result_set:
-                del result_set[del_row.id]
+        if deleted:
+            del_rows = list(deleted.values())
+            type(del_rows[0]).objects.filter(id__in=[row.id for row in del_rows]).update(
+                source_row_state='deleted', updated=now,
+            )
+            for del_row in del_rows:
+                del_row.source_row_state = 'deleted'
+                del_row.updated = now
+                if del_row.id in result_set:
+                    del result_set[del_row.id]
         
     return result_set.values()
 
 
+def is_in_rider_days(row, rider_days):
+    pay_date = localdate(row.time_start)
+    return pay_date in rider_days and (rider_days[pay_date] is None or row.person_id in rider_days[pay_date])
+
+def recalculate_tour_pay_slots(start_date, end_date, pay_config):
+    """
+    Recalculates the pay slots for the rider-days which changed since the last calculation, see get_dirty_rider_days(),
+    and merges them with the existing RiderPaySlots in the database.
+    Returns the resulting list of RiderPaySlots for the dates, or None if nothing needed to be recalculated.
+    """
+    date_filter = get_date_filter(start_date, end_date, 'time_start')
+    config_version = get_pay_config_version(pay_config)
+    rider_days, dirty_ids = get_dirty_rider_days(start_date, end_date, config_version)
+    num_days = (end_date - start_date).days + 1
+    all_days = len(rider_days) == num_days and all(v is None for v in rider_days.values())
+
+    if not rider_days:
+        return None
+
+    calc_pay_slots, tour_types_seen, people = calculate_tour_pay_slots(
+        start_date, end_date, pay_config, rider_days=None if all_days else rider_days,
+    )
+
+    with transaction.atomic():
+        existing_pay_slots = list(RiderPaySlot.objects.filter(**date_filter).select_related('person'))
+        if all_days:
+            compare_pay_slots = existing_pay_slots
+        else:
+            # slots which were calculated before for the rider-days, or can be matched with new slots
+            calc_ids = set(values['source_row_id'] for values in calc_pay_slots)
+            compare_pay_slots = [
+                row for row in existing_pay_slots
+                if is_in_rider_days(row, rider_days) or row.source_row_id in calc_ids
+            ]
+
+        changed, added, deleted, unchanged, ignored = compare_pay_slot_values(
+            calc_pay_slots, compare_pay_slots, people,
+        )
+
+        logger.info('match_and_compare: %d changes, %d added, %d deleted, %d unchanged (%d rider-days)' % (
+            len(changed), len(added), len(deleted), len(unchanged),
+            sum(len(v) if v is not None else 1 for v in rider_days.values()),
+        ))
+
+        # rows deleted before stay deleted, unless they were matched with a new slot again (changed)
+        result_rows = update_db_rowset(changed, added, deleted, 'generate_pay_report', existing_rows=[
+            row for row in existing_pay_slots if row.source_row_state != 'deleted'
+        ])
+
+        # changes made while calculating are left in RiderPayDirty for next time
+        RiderPayDirty.objects.filter(id__in=dirty_ids).delete()
+        PayCalcDay.objects.filter(pay_date__range=(start_date, end_date)).delete()
+        PayCalcDay.objects.bulk_create(
+            PayCalcDay(pay_date=add_days(start_date, n), config_version=config_version)
+            for n in range(num_days)
+        )
+
+    return result_rows
+
 def load_tour_pay_report(start_date, end_date, recalculate=True, reset=False):
     """
     Calculates pay slots based on TourRiders in DB and merges with existing RiderPaySlots from DB in memory.
+    Only the rider-days which changed since the last calculation are recalculated, see recalculate_tour_pay_slots().
     """
 
     pay_config = get_tour_pay_config()
     date_filter = get_date_filter(start_date, end_date, 'time_start')
 
-    result_rows = RiderPaySlot.objects.filter(**date_filter)
     if reset:
-        result_rows.delete()
+        RiderPaySlot.objects.filter(**date_filter).delete()
+        PayCalcDay.objects.filter(pay_date__range=(start_date, end_date)).delete()
         recalculate = True
     
+    result_rows = (
+        RiderPaySlot.objects.filter(**date_filter).exclude(source_row_state='deleted').select_related('person')
+    )
     if recalculate:
-        calc_pay_slots, tour_types_seen = generate_tour_pay_slots(start_date, end_date, pay_config)
-
-        with transaction.atomic():
-            existing_pay_slots = RiderPaySlot.objects.filter(**date_filter)
-
-            changed, added, deleted, unchanged, ignored = match_and_compare_rows(
-                calc_pay_slots, existing_pay_slots, 'source_row_id',
-                fields = RiderPaySlot.MUTABLE_FIELDS,
-            )
-
-            logger.info('match_and_compare: %d changes, %d added, %d deleted, %d unchanged' % (len(changed), len(added), len(deleted), len(unchanged)))
-
-            result_rows = update_db_rowset(changed, added, deleted, 'generate_pay_report', existing_rows=existing_pay_slots)
+        calc_rows = recalculate_tour_pay_slots(start_date, end_date, pay_config)
+        if calc_rows is not None:
+            result_rows = calc_rows
 
     # start and end datetimes are at midnight on the corresponding day, need to add 1 more day to capture entire 7 day duration
     num_days = (end_date - start_date).days + 1
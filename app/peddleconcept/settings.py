@@ -1,9 +1,13 @@
 from django.conf import settings
+from django.db import connection
+from uuid import uuid4
+import copy
 from .models import Settings
 
 # Rezdy scraper settings
 REZDY_LOGIN_SETTING = 'rezdy_login'
 REZDY_COOKIES_SETTING = 'rezdy_cookies'
+REZDY_FINGERPRINTS_SETTING = 'rezdy_manifest_fingerprints'
 
 REZDY_NOTES_FIELDS = ('extras', 'order-special-requirements', 'order-internal-notes')
 # only care about changes to these fields, which are also updated directly from Rezdy
@@ -24,6 +28,7 @@ FRINGE_UPDATE_FIELDS = (
 TOUR_PAY_SETTING = 'tour_pay_config'
 AUTO_UPDATE_SETTING = 'auto_update_config'
 AUTO_UPDATE_STATUS = 'auto_update_state'
+REZDY_FETCH_CONCURRENCY_DEFAULT = 4
 BIKES_SETTING = 'bike_types'
 
 VENUES_PRESETS_SETTING = 'venues_presets'
@@ -34,14 +39,79 @@ AVAILABILITY_DEFAULT_WEEK_SETTING = 'availability_week_default'
 DEPUTY_API_SETTING = 'deputy_api'
 
 RIDER_PAYRATE_SETTING = 'rider_pay_rates'
+PAY_EXPORT_SETTING = 'pay_export'
+
+CHANGELOG_RETENTION_SETTING = 'changelog_retention'
+
+# changed whenever any setting is changed, so every process knows to reload its cached settings
+SETTINGS_VERSION_SETTING = 'settings_version'
+# runtime state written by the scrapers and dispatch on every scan, not configuration: these are always read from
+# the database and writing them doesn't change the settings version
+STATE_SETTINGS = frozenset((
+    AUTO_UPDATE_STATUS, REZDY_COOKIES_SETTING, FRINGE_COOKIES_SETTING, REZDY_FINGERPRINTS_SETTING,
+))
+# not a setting: the venues data is cached with the settings, see get_cached_data()
+VENUES_CACHE_NAME = '_venues_json'
+# not a setting: digest of the settings data in the schedule data, see tours.schedules.get_schedule_settings_version()
+SCHEDULE_SETTINGS_CACHE_NAME = '_schedule_settings_version'
+
+# Django cache alias for the rendered schedule data, see tours.schedules.get_cached_tour_schedule_data()
+SCHEDULE_CACHE_NAME = 'schedules'
+
+# Process-local cache of setting name to data, valid while the settings version is unchanged
+settings_cache = {}
+# marks a name which isn't in settings_cache: a single get() can't race with another thread clearing the cache
+_MISSING = object()
+settings_cache_version = None
+
+def check_settings_version(**kwargs):
+    """ Clear the settings cache if the settings have changed in another process. Called at the start of each request """
+    global settings_cache_version
+    version = Settings.objects.filter(name=SETTINGS_VERSION_SETTING).values_list('data', flat=True).first()
+    if version != settings_cache_version:
+        settings_cache.clear()
+        settings_cache_version = version
+
+def bump_settings_version():
+    """ Invalidate cached settings in this process and all others """
+    global settings_cache_version
+    settings_cache.clear()
+    settings_cache_version = {'version': uuid4().hex}
+    Settings.objects.update_or_create(name=SETTINGS_VERSION_SETTING, defaults={'data': settings_cache_version})
+
+def get_settings_version():
+    """ returns the version of the settings currently cached by this process """
+    return settings_cache_version
+
+def cache_setting(setting_name, data):
+    # don't cache data which might be rolled back later, or state which other processes change without a new version
+    if not connection.in_atomic_block and setting_name not in STATE_SETTINGS:
+        settings_cache[setting_name] = copy.deepcopy(data)
+
+def get_cached_data(cache_name, get_data):
+    """
+    Process-local cache for data which isn't a setting but rarely changes (eg. Venues), cleared along with the
+    settings cache. Anything which changes the data must call bump_settings_version()
+    """
+    if (data := settings_cache.get(cache_name, _MISSING)) is not _MISSING:
+        return copy.deepcopy(data)
+
+    data = get_data()
+    cache_setting(cache_name, data)
+    return data
 
 def get_setting_or_default(setting_name, default):
+    if (data := settings_cache.get(setting_name, _MISSING)) is not _MISSING:
+        # callers often modify the data so always return a copy
+        return copy.deepcopy(data)
+
     try:
         s = Settings.objects.get(name=setting_name)
     except Settings.DoesNotExist:
         s = Settings(name=setting_name, data=default)
         s.save()
     
+    cache_setting(setting_name, s.data)
     return s.data
 
 def get_roster_setup_time():
@@ -125,6 +195,24 @@ def get_auto_update_setting():
         'scan_days_ahead': 7,
         'scan_days_behind': 0,
         'update_interval_minutes': 15,
+        'rezdy_fetch_concurrency': REZDY_FETCH_CONCURRENCY_DEFAULT,
+    })
+
+def get_rezdy_fetch_concurrency():
+    """ number of Rezdy manifest days to fetch at once: older configs may not have this set """
+    try:
+        return max(1, int(get_auto_update_setting().get('rezdy_fetch_concurrency', REZDY_FETCH_CONCURRENCY_DEFAULT)))
+    except (TypeError, ValueError):
+        return 1
+
+def get_changelog_retention_setting():
+    """ see changelog.apply_changelog_retention(), an empty archive_dir means changelog_archive/ next to the app """
+    return get_setting_or_default(CHANGELOG_RETENTION_SETTING, {
+        'keep_days': 90,
+        'archive': True,
+        'archive_dir': '',
+        'batch_size': 2000,
+        'compact_changes': False,
     })
 
 def get_deputy_api_setting():
@@ -133,6 +221,13 @@ def get_deputy_api_setting():
         'auth_token': '',
         'default_company_id': 1,
         'default_employee_role_id': 50, # corresponds to "Employee" in our Deputy setup
+        'timeout_seconds': 30,
+        'max_retries': 3,
+        'roster_bulk_size': 100,
+        'query_page_size': 500,
+        # cached leave/unavailability, see deputy.refresh_deputy_time_off()
+        'time_off_days_ahead': 14,
+        'time_off_stale_minutes': 60,
     })
 
 def get_rider_payrate_setting():
@@ -143,11 +238,35 @@ def get_rider_payrate_setting():
         '30_rider_professional': 36,
     })
 
+def get_pay_export_setting():
+    """ see pay_export.py, the aba_ values are the paying account's details as registered with the bank """
+    return get_setting_or_default(PAY_EXPORT_SETTING, {
+        'aba_bank_code': '', # 3 letter financial institution code, eg. CBA
+        'aba_user_name': '',
+        'aba_user_id': '', # 6 digit APCA direct entry user ID
+        'aba_description': 'PAYROLL',
+        'aba_remitter_name': '',
+        'aba_trace_bsb': '',
+        'aba_trace_account': '',
+        'chunk_size': 2000,
+    })
+
 def get_setting(setting_name):
+    if (data := settings_cache.get(setting_name, _MISSING)) is not _MISSING:
+        return copy.deepcopy(data)
+
     try:
-        return Settings.objects.get(name=setting_name).data
+        data = Settings.objects.get(name=setting_name).data
     except Settings.DoesNotExist:
-        return None
+        data = None
+    cache_setting(setting_name, data)
+    return data
 
 def set_setting(setting_name, data):
+    current = list(Settings.objects.filter(name=setting_name).values_list('data', flat=True)[:1])
+    if current and current[0] == data:
+        return # no change: keep everyone's cached settings
+
     Settings.objects.update_or_create(name=setting_name, defaults={'name': setting_name, 'data': data})
+    if setting_name not in STATE_SETTINGS:
+        bump_settings_version()
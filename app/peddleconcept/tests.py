@@ -1,3 +1,1022 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.urls import reverse
+from django.db import transaction
+from django.test import TransactionTestCase
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.utils import timezone
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+import gzip
+import json
+import tempfile
 
-# Create your tests here.
+from django.contrib.admin.sites import site
+from peddleconcept.actions import download_as_csv
+from peddleconcept.deputy import refresh_deputy_time_off, refresh_stale_deputy_time_off
+from peddleconcept.deputy_api import DeputyAPI
+from peddleconcept.changelog import archive_changelog, compact_changelog
+from peddleconcept.merge import MergeSet
+from peddleconcept.tours import rezdy
+from peddleconcept.tours.schedule_events import schedule_event_stream
+from peddleconcept import pay_reports
+from peddleconcept.pay_export import get_pay_export, iter_pay_totals
+from peddleconcept.pay_reports import (
+    calculate_tour_pay_slots, get_tour_pay_config, load_tour_pay_report, save_tour_pay_config, update_db_rowset,
+    update_payslots, mark_pay_slots_dirty, PAY_RECALCULATE_DAYS,
+)
+from peddleconcept.models import (
+    Area, ChangeLog, DeputyTimeOff, PayCalcDay, Person, RiderPayDirty, RiderPaySlot, Roster, ScheduleChange, Session,
+    Settings, Tour, TourRider, TourVenue, Venue,
+)
+from peddleconcept.settings import (
+    settings_cache, get_deputy_api_setting, get_rider_payrate_setting, DEPUTY_API_SETTING, SCHEDULE_CACHE_NAME,
+    get_pay_export_setting, PAY_EXPORT_SETTING, AUTO_UPDATE_STATUS, SETTINGS_VERSION_SETTING,
+    check_settings_version, get_setting, get_settings_version, set_setting, get_bikes_setting, BIKES_SETTING,
+)
+from peddleconcept.util import add_days, json_datetime, match_and_compare_rows
+from peddleconcept.tours.schedules import (
+    get_rider_schedule, get_tour_schedule_data, get_tours_json,
+    get_cached_tour_schedule_data, get_tour_schedule_version, refresh_tour_summaries, get_rider_time_off_json,
+    on_schedule_changed,
+    sync_tour_rosters_range, save_tour_schedule, fill_missing_tour_summaries, get_tour_summary,
+)
+
+# TransactionTestCase, since settings and venues are not cached inside a transaction (see settings.cache_setting)
+class SettingsCacheTests(TransactionTestCase):
+    def setUp(self):
+        settings_cache.clear()
+        check_settings_version()
+
+    def test_invalidated_by_other_process(self):
+        set_setting('test_config', {'value': 1})
+        check_settings_version()
+        self.assertEqual(get_setting('test_config'), {'value': 1})
+        with self.assertNumQueries(0):
+            get_setting('test_config')
+
+        # another process changes the setting and the version
+        Settings.objects.filter(name='test_config').update(data={'value': 2})
+        Settings.objects.filter(name=SETTINGS_VERSION_SETTING).update(data={'version': 'other process'})
+        self.assertEqual(get_setting('test_config'), {'value': 1})
+        check_settings_version()
+        self.assertEqual(get_setting('test_config'), {'value': 2})
+
+    def test_unchanged_and_state_settings_keep_version(self):
+        set_setting('test_config', {'value': 1})
+        version = get_settings_version()
+        set_setting('test_config', {'value': 1})
+        self.assertEqual(get_settings_version(), version)
+
+        # runtime state is always read from the database
+        set_setting(AUTO_UPDATE_STATUS, {'last_scan': 1})
+        self.assertEqual(get_settings_version(), version)
+        self.assertEqual(get_setting(AUTO_UPDATE_STATUS), {'last_scan': 1})
+        Settings.objects.filter(name=AUTO_UPDATE_STATUS).update(data={'last_scan': 2})
+        self.assertEqual(get_setting(AUTO_UPDATE_STATUS), {'last_scan': 2})
+
+    def test_not_cached_in_atomic_block(self):
+        Settings.objects.create(name='test_config', data={'value': 1})
+        with transaction.atomic():
+            self.assertEqual(get_setting('test_config'), {'value': 1})
+        self.assertNotIn('test_config', settings_cache)
+        get_setting('test_config')
+        self.assertIn('test_config', settings_cache)
+
+    def test_cleared_by_other_thread(self):
+        class ClearedDict(dict):
+            """ another thread clears the cache as soon as this one has checked for a name """
+            def __contains__(self, name):
+                found = super().__contains__(name)
+                self.clear()
+                return found
+
+        Settings.objects.create(name='test_config', data={'value': 1})
+        with mock.patch('peddleconcept.settings.settings_cache', ClearedDict(test_config={'value': 1})):
+            self.assertEqual(get_setting('test_config'), {'value': 1})
+
+
+class TourScheduleDataTests(TransactionTestCase):
+    def setUp(self):
+        settings_cache.clear()
+        caches[SCHEDULE_CACHE_NAME].clear()
+        self.tours_date = timezone.localdate()
+        time_start = timezone.make_aware(datetime.combine(self.tours_date, time(17, 0)))
+        self.area = Area.objects.create(area_name='Perth', display_name='Perth')
+        venue = Venue.objects.create(name='The Bar')
+        self.riders = [
+            Person.objects.create(first_name='Rider', last_name=str(i), display_name='Rider %d' % i,
+                active=True, rider_class='rider')
+            for i in range(6)
+        ]
+        # archived riders should never be loaded
+        for i in range(10):
+            Person.objects.create(first_name='Old', last_name=str(i), display_name='Old %d' % i, active=False)
+
+        for i in range(4):
+            sess = Session.objects.create(time_start=time_start, time_end=time_start, session_type='Tour %d' % i)
+            tour = Tour.objects.create(tour_area=self.area, session=sess, time_start=time_start, time_end=time_start,
+                tour_type='Tour %d' % i, bikes={'bike': 1})
+            TourRider.objects.create(tour=tour, person=self.riders[i], rider_role='lead')
+            TourVenue.objects.create(tour=tour, venue=venue, time_arrive=time_start, time_depart=time_start)
+
+    def test_schedule_riders(self):
+        data = get_tour_schedule_data(self.area, self.tours_date, in_editor=False)
+        self.assertEqual(set(data['riders'].keys()), set(r.id for r in self.riders[:4]))
+
+        # editor also shows the active riders not on the schedule
+        data = get_tour_schedule_data(self.area, self.tours_date, in_editor=True)
+        self.assertEqual(set(data['riders'].keys()), set(r.id for r in self.riders))
+
+    def test_schedule_num_queries(self):
+        # the first call loads the venues and settings into the cache
+        get_tour_schedule_data(self.area, self.tours_date, in_editor=False)
+
+        # tours (+ session), riders, venues and people
+        with self.assertNumQueries(4):
+            get_tour_schedule_data(self.area, self.tours_date, in_editor=False)
+        with self.assertNumQueries(4):
+            get_tour_schedule_data(self.area, self.tours_date, in_editor=True)
+
+    def test_tours_json_matches_to_json(self):
+        tours_qs = Tour.objects.filter(tour_area=self.area).order_by('id')
+        for in_editor in (False, True):
+            tours_json, sessions_json = get_tours_json(tours_qs, in_editor=in_editor)
+            self.assertEqual(list(tours_json.values()), [
+                t.to_json(with_related_data=True, in_editor=in_editor) for t in tours_qs
+            ])
+            self.assertEqual(sessions_json, {t.session_id: t.session.to_json() for t in tours_qs})
+
+    def test_rider_schedule_num_queries(self):
+        start_date = self.tours_date - timedelta(days=2)
+        end_date = self.tours_date + timedelta(days=14)
+        get_rider_schedule(start_date, end_date, self.riders[0])
+
+        # tours (+ session), riders, venues, areas and people
+        with self.assertNumQueries(5):
+            data = get_rider_schedule(start_date, end_date, self.riders[0])
+        trs = data['tour_dates'][json_datetime(self.tours_date)]
+        self.assertEqual(len(trs), 1)
+        self.assertEqual(trs[0]['tourRider'], TourRider.objects.get(person=self.riders[0]).to_json())
+
+    def test_cached_schedule_data(self):
+        version = get_tour_schedule_version(self.area, self.tours_date)
+        data = get_cached_tour_schedule_data(self.area, self.tours_date, version)
+        self.assertEqual(data, get_tour_schedule_data(self.area, self.tours_date, in_editor=False))
+        with self.assertNumQueries(0):
+            get_cached_tour_schedule_data(self.area, self.tours_date, version)
+
+        # changes are picked up through the version, or when the writers clear the cache
+        tour = Tour.objects.filter(tour_area=self.area).first()
+        Tour.objects.filter(id=tour.id).update(customer_name='Changed', updated=timezone.now())
+        version = get_tour_schedule_version(self.area, self.tours_date)
+        data = get_cached_tour_schedule_data(self.area, self.tours_date, version)
+        self.assertEqual(data['tours'][tour.id]['customer_name'], 'Changed')
+
+        Tour.objects.filter(id=tour.id).update(customer_name='Changed again')
+        on_schedule_changed([self.tours_date])
+        data = get_cached_tour_schedule_data(self.area, self.tours_date, version)
+        self.assertEqual(data['tours'][tour.id]['customer_name'], 'Changed again')
+
+        # the riders' details are in the data too
+        self.riders[0].phone = '0400000000'
+        self.riders[0].save()
+        version = get_tour_schedule_version(self.area, self.tours_date)
+        data = get_cached_tour_schedule_data(self.area, self.tours_date, version)
+        self.assertEqual(data['riders'][self.riders[0].id]['phone'], '0400000000')
+
+    def test_schedule_data_etag(self):
+        self.client.force_login(get_user_model().objects.create_user('admin', is_staff=True))
+        def post(etag=None):
+            return self.client.post(reverse('tour_sched_data'), json.dumps({
+                'tours_date': json_datetime(self.tours_date), 'tour_area_id': self.area.id,
+            }), content_type='application/json', **({'HTTP_IF_NONE_MATCH': etag} if etag else {}))
+
+        etag = post()['ETag']
+        self.assertEqual(post(etag).status_code, 304)
+        # runtime state is not part of the schedule data
+        set_setting(AUTO_UPDATE_STATUS, {'last_scan': 1})
+        self.assertEqual(post(etag).status_code, 304)
+
+        # the riders' names and phone numbers are
+        self.riders[0].display_name = 'Renamed'
+        self.riders[0].save()
+        resp = post(etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['riders'][str(self.riders[0].id)]['title'], 'Renamed')
+
+        # and so are the bike types
+        etag = resp['ETag']
+        set_setting(BIKES_SETTING, dict(get_bikes_setting(), tandem={'name': 'Tandem', 'num_passengers': 1}))
+        resp = post(etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('tandem', resp.json()['bike_types'])
+
+    def test_rider_schedule_etag(self):
+        self.riders[0].signup_status = 'complete'
+        self.riders[0].save()
+        session = self.client.session
+        session['person_id'] = self.riders[0].id
+        session.save()
+        def post(etag=None):
+            return self.client.post(reverse('tours_rider_data'), json.dumps({
+                'startDate': json_datetime(self.tours_date), 'endDate': json_datetime(self.tours_date),
+            }), content_type='application/json', **({'HTTP_IF_NONE_MATCH': etag} if etag else {}))
+
+        etag = post()['ETag']
+        self.assertEqual(post(etag).status_code, 304)
+        # a new name for any rider
+        self.riders[5].display_name = 'Renamed'
+        self.riders[5].save()
+        resp = post(etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['riders'][str(self.riders[5].id)], 'Renamed')
+
+    def test_save_tour_schedule(self):
+        tours = list(Tour.objects.filter(tour_area=self.area).order_by('id'))
+        venue_ids = {tour.id: TourVenue.objects.get(tour=tour).id for tour in tours}
+        time_start = tours[0].time_start
+        empty_session = Session.objects.create(time_start=time_start, time_end=time_start, session_type='Empty')
+
+        save_tour_schedule(self.tours_date, {
+            'tours': {
+                # new role for the existing rider, and a new rider
+                str(tours[0].id): {'riders': [
+                    {'rider_id': self.riders[0].id, 'rider_role': 'colead'},
+                    {'rider_id': self.riders[4].id, 'rider_role': 'lead'},
+                ], 'notes': 'Bring lights'},
+                # rider removed
+                str(tours[1].id): {'riders': []},
+                # venue re-timed and a new venue after it
+                str(tours[2].id): {'venues': [
+                    {'id': venue_ids[tours[2].id], 'venue_id': None, 'activity': 'venue', 'duration': 30, 'notes': ''},
+                    {'venue_id': None, 'activity': 'transit', 'duration': 15, 'notes': 'Walk'},
+                ]},
+                # venue removed
+                str(tours[3].id): {'venues': []},
+            },
+            'sessions': {
+                str(tours[0].session_id): {'title': 'Evening'},
+                str(empty_session.id): {'title': 'Deleted'},
+            },
+        })
+
+        self.assertEqual(
+            sorted(TourRider.objects.filter(tour=tours[0]).values_list('person_id', 'rider_role')),
+            [(self.riders[0].id, 'colead'), (self.riders[4].id, 'lead')],
+        )
+        self.assertFalse(TourRider.objects.filter(tour=tours[1]).exists())
+        self.assertTrue(TourRider.objects.filter(tour=tours[2], person=self.riders[2]).exists())
+        self.assertEqual(Tour.objects.get(id=tours[0].id).notes, 'Bring lights')
+
+        self.assertEqual([
+            (tv.id == venue_ids[tours[2].id], tv.activity, tv.time_arrive, tv.time_depart, tv.notes)
+            for tv in TourVenue.objects.filter(tour=tours[2]).order_by('time_arrive')
+        ], [
+            (True, 'venue', time_start, time_start + timedelta(minutes=30), ''),
+            (False, 'transit', time_start + timedelta(minutes=30), time_start + timedelta(minutes=45), 'Walk'),
+        ])
+        self.assertFalse(TourVenue.objects.filter(tour=tours[3]).exists())
+        self.assertEqual(TourVenue.objects.filter(tour=tours[1]).count(), 1)
+
+        self.assertEqual(Session.objects.get(id=tours[0].session_id).title, 'Evening')
+        self.assertFalse(Session.objects.filter(id=empty_session.id).exists())
+
+    def test_editor_patch_save(self):
+        self.client.force_login(get_user_model().objects.create_user('admin', is_staff=True))
+        tour = Tour.objects.filter(tour_area=self.area).order_by('id').first()
+        def post(**data):
+            return self.client.post(reverse('tour_sched_admin_data'), json.dumps(dict({
+                'tours_date': json_datetime(self.tours_date), 'tour_area_id': self.area.id,
+            }, **data)), content_type='application/json')
+
+        version = post().json()['version']
+        resp = post(patch={'base_version': version, 'tours': {str(tour.id): {'notes': 'Bring lights'}}})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(Tour.objects.get(id=tour.id).notes, 'Bring lights')
+
+        # settings and rider profile changes don't conflict with the editor's changes
+        version = resp.json()['version']
+        set_setting(AUTO_UPDATE_STATUS, {'last_scan': 1})
+        set_setting(BIKES_SETTING, dict(get_bikes_setting(), tandem={'name': 'Tandem', 'num_passengers': 1}))
+        self.riders[0].phone = '0400000000'
+        self.riders[0].save()
+        resp = post(patch={'base_version': version, 'tours': {str(tour.id): {'notes': 'Bring more lights'}}})
+        self.assertEqual(resp.status_code, 200)
+
+        # someone else changed the schedule since it was loaded
+        version = resp.json()['version']
+        TourRider.objects.create(tour=tour, person=self.riders[5], rider_role='')
+        resp = post(patch={'base_version': version, 'tours': {str(tour.id): {'notes': 'Overwritten'}}})
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(Tour.objects.get(id=tour.id).notes, 'Bring more lights')
+
+    def test_tour_summary(self):
+        # the tours were created without summaries, as if from before they were added
+        self.assertEqual(get_tour_summary(self.tours_date, self.tours_date), [])
+        self.assertEqual(fill_missing_tour_summaries(self.tours_date, self.tours_date), {self.tours_date})
+        summary = get_tour_summary(self.tours_date, self.tours_date)
+        self.assertEqual([day['isodate'] for day in summary], [self.tours_date.isoformat()])
+        area_summary = summary[0]['areas'][self.area.id]
+        self.assertEqual((area_summary['filled'], area_summary['needs_riders'], len(area_summary['tours'])), (4, 0, 4))
+
+        # summaries and tour dates
+        with self.assertNumQueries(2):
+            self.assertEqual(fill_missing_tour_summaries(self.tours_date, self.tours_date), set())
+
+        TourRider.objects.filter(person=self.riders[0]).delete()
+        refresh_tour_summaries([self.tours_date])
+        area_summary = get_tour_summary(self.tours_date, self.tours_date)[0]['areas'][self.area.id]
+        self.assertEqual((area_summary['filled'], area_summary['needs_riders']), (3, 1))
+
+
+class DownloadAsCSVTests(TransactionTestCase):
+    def test_download_pay_slots(self):
+        time_start = timezone.now()
+        for i in range(5):
+            person = Person.objects.create(first_name='Rider', last_name=str(i), display_name='Rider %d' % i, active=True)
+            RiderPaySlot.objects.create(person=person, time_start=time_start, time_end=time_start, pay_minutes=60)
+
+        # the people are fetched along with the pay slots, not one query per row
+        with self.assertNumQueries(1):
+            resp = download_as_csv(site._registry[RiderPaySlot], None, RiderPaySlot.objects.order_by('id'))
+            lines = b''.join(resp.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].startswith('Id,First name,Last name'))
+        self.assertIn(',Rider,4,', lines[5])
+
+
+class ChangeLogRetentionTests(TransactionTestCase):
+    def create_changelog(self, days_ago, description='changed: quantity --> (2, 3)', pk=1):
+        return ChangeLog.objects.create(
+            model_type='tour', change_remote='rezdy', change_type='changed',
+            model_description='Tour %d [pk=%d source_row_id=R%d]' % (days_ago, pk, pk),
+            change_description=description, timestamp=timezone.now() - timedelta(days=days_ago),
+        )
+
+    def test_archive_changelog(self):
+        old = [self.create_changelog(100 + i) for i in range(5)]
+        recent = self.create_changelog(1)
+        with tempfile.TemporaryDirectory() as archive_dir:
+            num = archive_changelog(timezone.now() - timedelta(days=90), Path(archive_dir), batch_size=2)
+            self.assertEqual(num, 5)
+            self.assertEqual(list(ChangeLog.objects.values_list('id', flat=True)), [recent.id])
+
+            archived = []
+            for path in Path(archive_dir).glob('changelog-*.jsonl.gz'):
+                with gzip.open(path, 'rt', encoding='utf-8') as f:
+                    archived += [json.loads(line) for line in f]
+            self.assertEqual(sorted(row['id'] for row in archived), [c.id for c in old])
+
+    def test_compact_changelog(self):
+        first = self.create_changelog(5)
+        self.create_changelog(4)
+        other = self.create_changelog(4, pk=2)
+        changed = self.create_changelog(3, description='changed: quantity --> (3, 4)')
+        last = self.create_changelog(2, description='changed: quantity --> (3, 4)')
+
+        self.assertEqual(compact_changelog(), 2)
+        self.assertEqual(
+            list(ChangeLog.objects.order_by('id').values_list('id', flat=True)), [first.id, other.id, changed.id])
+        first.refresh_from_db()
+        self.assertEqual(first.data['repeat_count'], 2)
+        changed.refresh_from_db()
+        self.assertEqual(changed.data['last_timestamp'], last.timestamp.isoformat())
+
+
+class MergeSetTests(TransactionTestCase):
+    def make_tour(self, srid, **kwargs):
+        time_start = timezone.make_aware(datetime(2026, 1, 10, 17, 0))
+        return Tour(**{
+            'source': 'rezdy', 'source_row_id': srid, 'source_row_state': 'live', 'time_start': time_start,
+            'time_end': time_start, 'tour_type': 'Bar Tour', 'customer_name': 'Customer %s' % srid, **kwargs,
+        })
+
+    def test_merge_changed_fields(self):
+        Tour.objects.bulk_create(self.make_tour(str(i)) for i in range(4))
+        # the first scan fills in the auto values of every field
+        merge = MergeSet(Tour, Tour.objects.all())
+        for t in merge.rows:
+            merge.update(t, self.make_tour(t.source_row_id))
+        merge.save()
+
+        merge = MergeSet(Tour, Tour.objects.all())
+        db_tours = {t.source_row_id: t for t in merge.rows}
+
+        merge.update(db_tours['0'], self.make_tour('0', customer_name='New Name'))
+        merge.update(db_tours['1'], self.make_tour('1', pax=4))
+        merge.update(db_tours['2'], self.make_tour('2'))
+        merge.delete(db_tours['3'])
+        merge.add(self.make_tour('4'))
+
+        # one transaction, with one update per set of changed fields and the insert
+        with self.assertNumQueries(2 + 3 + 1):
+            stats = merge.save()
+        self.assertEqual(stats['added'], 1)
+        self.assertEqual(stats['updated'], 3)
+        self.assertEqual(stats['update_queries'], 3)
+        self.assertEqual(stats['deleted'], 1)
+        self.assertEqual(stats['unchanged'], 1)
+        self.assertEqual(stats['changed_fields']['customer_name'], 1)
+        self.assertNotIn('tour_type', stats['changed_fields'])
+        self.assertEqual(len(merge.changelogs), 3)
+
+        tours = {t.source_row_id: t for t in Tour.objects.all()}
+        self.assertEqual(tours['0'].customer_name, 'New Name')
+        self.assertEqual(tours['1'].pax, 4)
+        self.assertEqual(tours['3'].source_row_state, 'deleted')
+        self.assertEqual(len(tours), 5)
+
+
+class FakeRezdyScraper:
+    """ stands in for RezdyScraper: clones share the manifests and the list of fetches """
+    def __init__(self, manifests, login_expired_days=(), failed_days=(), error_days=(), fetches=None):
+        self.manifests = manifests
+        self.login_expired_days = login_expired_days
+        self.failed_days = failed_days
+        self.error_days = error_days
+        self.fetches = fetches if fetches is not None else [] # (date, allow_login)
+        self.clones = []
+        self.login_required = False
+        self.closed = False
+        self.session = mock.Mock(cookies={})
+
+    def clone(self):
+        worker = FakeRezdyScraper(self.manifests, self.login_expired_days, self.failed_days, self.error_days,
+            self.fetches)
+        self.clones.append(worker)
+        return worker
+
+    def fetch_manifest_data(self, manifest_date, allow_login=True):
+        self.fetches.append((manifest_date, allow_login))
+        if manifest_date in self.error_days:
+            raise RuntimeError('connection reset')
+        if manifest_date in self.failed_days:
+            return None
+        if manifest_date in self.login_expired_days and not allow_login:
+            self.login_required = True
+            return None
+        return self.manifests[manifest_date]
+
+    def get_last_error(self):
+        return 'failed'
+
+    def close(self):
+        self.closed = True
+
+
+class RezdyFetchTests(TransactionTestCase):
+    def setUp(self):
+        settings_cache.clear()
+        self.days = [add_days(timezone.localdate(), i) for i in range(7)]
+        self.manifests = {day: {'data': [], 'day': day.isoformat()} for day in self.days}
+
+    def fetch(self, concurrency=3, **kwargs):
+        scraper = FakeRezdyScraper(self.manifests, **kwargs)
+        results = rezdy.fetch_manifests(scraper, self.days, concurrency)
+        self.assertTrue(all(worker.closed for worker in scraper.clones))
+        return scraper, results
+
+    def test_concurrent_fetch(self):
+        scraper, results = self.fetch()
+        self.assertEqual([(day, resp) for day, resp, secs, error in results], list(self.manifests.items()))
+        self.assertEqual(len(scraper.clones), 3)
+        # only the first day may log in
+        self.assertEqual([allow_login for day, allow_login in scraper.fetches], [True] + [False] * 6)
+
+    def test_login_expired(self):
+        scraper, results = self.fetch(login_expired_days={self.days[2]})
+        self.assertEqual([(day, resp) for day, resp, secs, error in results], list(self.manifests.items()))
+        # the worker stops at the expired day, its remaining days are fetched with a login
+        self.assertEqual(sorted(day for day, allow_login in scraper.fetches if allow_login), [
+            self.days[0], self.days[2], self.days[5],
+        ])
+
+    def test_first_day_failed(self):
+        scraper, results = self.fetch(failed_days={self.days[0]})
+        self.assertEqual(results, [(self.days[0], None, mock.ANY, 'failed')])
+        self.assertEqual(scraper.fetches, [(self.days[0], True)])
+
+        # sequential fetch also stops at the first failure
+        scraper, results = self.fetch(concurrency=1, failed_days={self.days[1]})
+        self.assertEqual([(day, error) for day, resp, secs, error in results], [
+            (self.days[0], None), (self.days[1], 'failed'),
+        ])
+
+    def test_worker_error_closes_workers(self):
+        with self.assertRaises(RuntimeError):
+            self.fetch(error_days={self.days[3]})
+
+    def test_skip_unchanged_days(self):
+        scraper = FakeRezdyScraper(self.manifests)
+
+        def scan(**kwargs):
+            with mock.patch.object(rezdy, 'get_rezdy_scraper', return_value=(scraper, None)), \
+                    mock.patch.object(rezdy, 'parse_manifest_tours', wraps=rezdy.parse_manifest_tours) as parse:
+                ok, log = rezdy.update_from_rezdy(self.days[0], self.days[-1], concurrency=1, **kwargs)
+            self.assertTrue(ok, log)
+            return [c.args[0]['day'] for c in parse.call_args_list]
+
+        self.assertEqual(scan(), [day.isoformat() for day in self.days])
+        # the fingerprints are runtime state: storing them leaves the cached settings alone
+        version = get_settings_version()
+        self.assertEqual(scan(), [])
+        self.assertEqual(get_settings_version(), version)
+
+        self.manifests[self.days[3]] = {'data': [], 'day': self.days[3].isoformat(), 'changed': True}
+        self.assertEqual(scan(), [self.days[3].isoformat()])
+        self.assertEqual(scan(full=True), [day.isoformat() for day in self.days])
+
+
+class DeputyAPIRetryTests(TransactionTestCase):
+    def make_response(self, status_code):
+        resp = mock.Mock(status_code=status_code, headers={}, history=[])
+        resp.json.return_value = {'status': status_code}
+        return resp
+
+    def post(self, statuses, idempotent):
+        session = mock.Mock()
+        session.request.side_effect = [self.make_response(status) for status in statuses]
+        with mock.patch('peddleconcept.deputy_api.get_session', return_value=session), \
+                mock.patch('peddleconcept.deputy_api.time_mod.sleep'), \
+                mock.patch('peddleconcept.deputy_api.log_response'):
+            resp = DeputyAPI().post('api/v1/resource/Roster/QUERY', {}, idempotent=idempotent)
+        return resp, session.request.call_count
+
+    def test_retries(self):
+        self.assertEqual(self.post([503, 429, 200], idempotent=True), ({'status': 200}, 3))
+        # BULK uploads etc. might have been applied despite server errors, so are only retried when rate limited
+        self.assertEqual(self.post([429, 200], idempotent=False), ({'status': 200}, 2))
+        self.assertEqual(self.post([503, 200], idempotent=False), ({'status': 503}, 1))
+        self.assertEqual(self.post([503] * 4, idempotent=True), ({'status': 503}, 4))
+
+
+class DeputyRosterSyncTests(TransactionTestCase):
+    def test_sync_week(self):
+        settings_cache.clear()
+        start_date = timezone.localdate()
+        areas = [
+            Area.objects.create(area_name='Area %d' % i, deputy_sync_enabled=True, source_row_id=str(i + 1),
+                source_row_state='live')
+            for i in range(2)
+        ]
+        Area.objects.create(area_name='Not synced', source_row_id='3', source_row_state='live')
+        Area.objects.create(area_name='Hidden', deputy_sync_enabled=True, active=False, source_row_id='4',
+            source_row_state='live')
+        rider = Person.objects.create(first_name='Rider', last_name='1', display_name='Rider 1', active=True,
+            rider_class='rider', source='deputy', source_row_id='11', source_row_state='live')
+        for day in range(7):
+            for area in areas:
+                time_start = timezone.make_aware(datetime.combine(add_days(start_date, day), time(10 + area.id % 5, 0)))
+                tour = Tour.objects.create(tour_area=area, time_start=time_start,
+                    time_end=time_start + timedelta(hours=1), tour_type='Tour')
+                TourRider.objects.create(tour=tour, person=rider, rider_role='lead')
+
+        # the first day's roster in the first area is already in Deputy, with an old comment
+        first_roster = Tour.objects.filter(tour_area=areas[0]).order_by('time_start').first()
+        dpt_roster = {
+            'Id': 1000, 'Employee': 11, 'OperationalUnit': 1, 'Comment': 'old',
+            'StartTime': int((first_roster.time_start - timedelta(minutes=45)).timestamp()),
+            'EndTime': int(first_roster.time_end.timestamp()),
+        }
+        new_ids = iter(range(2000, 3000))
+
+        def post(self, url, data, idempotent=False):
+            if url.endswith('Roster/QUERY'):
+                return [dpt_roster]
+            return {'results': [dict(item, Id=item.get('Id') or next(new_ids)) for item in data]}
+
+        with mock.patch('peddleconcept.deputy_api.DeputyAPI.post', autospec=True, side_effect=post) as query:
+            rosters, roster_errors = sync_tour_rosters_range(start_date, 7)
+        # one query for all the areas and dates, then create the new rosters and update the changed one
+        self.assertEqual([c.args[1] for c in query.call_args_list], [
+            'api/v1/resource/Roster/QUERY', 'api/v1/resource/Roster/BULK', 'api/v1/resource/Roster/BULK',
+        ])
+        self.assertEqual(query.call_args_list[0].args[2]['search']['s3']['data'], [1, 2])
+        self.assertEqual(len(query.call_args_list[1].args[2]), 13)
+        self.assertEqual([r['Id'] for r in query.call_args_list[2].args[2]], [1000])
+        self.assertEqual((len(rosters), roster_errors), (14, []))
+        self.assertTrue(all(r.source_row_id for r in rosters))
+
+        # BULK calls are split up by the roster_bulk_size setting
+        Settings.objects.update_or_create(name=DEPUTY_API_SETTING, defaults={
+            'data': dict(get_deputy_api_setting(), roster_bulk_size=5),
+        })
+        settings_cache.clear()
+        with mock.patch('peddleconcept.deputy_api.DeputyAPI.post', autospec=True, side_effect=post) as query:
+            sync_tour_rosters_range(start_date, 7)
+        self.assertEqual(query.call_count, 1 + 3 + 1)
+
+    def test_query_rosters_paged(self):
+        area = Area.objects.create(area_name='Area', source_row_id='1', source_row_state='live')
+        time_start = int(timezone.now().timestamp())
+        dpt_rosters = [
+            {'Id': 1000 + i, 'Employee': 11, 'OperationalUnit': 1, 'StartTime': time_start, 'EndTime': time_start + 3600}
+            for i in range(12)
+        ]
+
+        def post(self, url, data, idempotent=False):
+            return dpt_rosters[data['start']:data['start'] + data['max']]
+
+        Settings.objects.update_or_create(name=DEPUTY_API_SETTING, defaults={
+            'data': dict(get_deputy_api_setting(), query_page_size=5),
+        })
+        settings_cache.clear()
+        with mock.patch('peddleconcept.deputy_api.DeputyAPI.post', autospec=True, side_effect=post) as query:
+            rosters = DeputyAPI().query_rosters(timezone.localdate(), timezone.localdate(), area)
+        # pages until a short page comes back
+        self.assertEqual([c.args[2]['start'] for c in query.call_args_list], [0, 5, 10])
+        self.assertEqual([r.source_row_id for r in rosters], [str(r['Id']) for r in dpt_rosters])
+
+    def test_add_rosters_correlation(self):
+        area = Area.objects.create(area_name='Area', source_row_id='1', source_row_state='live')
+        rider = Person.objects.create(first_name='Rider', last_name='1', display_name='Rider 1', active=True,
+            rider_class='rider', source='deputy', source_row_id='11', source_row_state='live')
+        time_start = timezone.now().replace(microsecond=0)
+        rosters = [
+            Roster(person=rider, area=area, time_start=time_start + timedelta(hours=hours), shift_notes=str(i),
+                time_end=time_start + timedelta(hours=hours + 1), tour_slots=[])
+            for i, hours in enumerate([0, 2, 2])
+        ]
+        new_ids = iter(range(2000, 3000))
+
+        def post(self, url, data, idempotent=False):
+            # results are not necessarily in the same order
+            return {'results': [dict(item, Id=item.get('Id') or next(new_ids)) for item in reversed(data)]}
+
+        with mock.patch('peddleconcept.deputy_api.DeputyAPI.post', autospec=True, side_effect=post) as query:
+            DeputyAPI().add_rosters(rosters)
+        self.assertEqual([r.source_row_id for r in rosters], [2002, 2001, 2000])
+        # the unique roster is matched by employee, times & area, only the duplicates use the comments
+        self.assertEqual(query.call_args_list[0].args[2][0]['Comment'], '0')
+        self.assertEqual(query.call_args_list[1].args[2], [{'Id': 2001, 'Comment': '1'}, {'Id': 2000, 'Comment': '2'}])
+
+        with mock.patch('peddleconcept.deputy_api.DeputyAPI.post', autospec=True, side_effect=post) as query:
+            DeputyAPI().add_rosters(rosters[:2])
+        self.assertEqual(query.call_count, 1)
+
+
+class DeputyTimeOffTests(TransactionTestCase):
+    def test_cached_time_off(self):
+        settings_cache.clear()
+        tours_date = timezone.localdate()
+        rider = Person.objects.create(first_name='Rider', last_name='1', display_name='Rider 1', active=True,
+            rider_class='rider', source='deputy', source_row_id='11', source_row_state='live')
+        leave_start = datetime.combine(tours_date, time(9, 0))
+        time_off = {'11': [(leave_start, leave_start + timedelta(hours=8), 'on leave')]}
+
+        with mock.patch('peddleconcept.deputy_api.DeputyAPI.query_leave_unavailability_range',
+                return_value={tours_date: time_off}) as query:
+            # opening the editor never waits for Deputy
+            data = get_rider_time_off_json(tours_date)
+            self.assertEqual((data['rider_time_off'], data['rider_time_off_stale']), ({}, True))
+            self.assertEqual(query.call_count, 0)
+
+            data = get_rider_time_off_json(tours_date, refresh=True)
+            self.assertEqual(query.call_count, 1)
+            self.assertEqual(data['rider_time_off'][rider.id][0]['start'], json_datetime(leave_start))
+            self.assertFalse(data['rider_time_off_stale'])
+
+            # opening the editor again uses the cached data
+            self.assertEqual(get_rider_time_off_json(tours_date), data)
+            self.assertEqual(query.call_count, 1)
+
+        # a failed refresh keeps the cached data, marked as stale
+        with mock.patch('peddleconcept.deputy_api.DeputyAPI.query_leave_unavailability_range',
+                side_effect=ConnectionError('Deputy is down')):
+            failed = get_rider_time_off_json(tours_date, refresh=True)
+        self.assertEqual(failed, dict(data, rider_time_off_stale=True))
+
+    def test_refresh_stale(self):
+        settings_cache.clear()
+        start_date = timezone.localdate()
+        with mock.patch('peddleconcept.deputy_api.DeputyAPI.query_leave_unavailability_range',
+                side_effect=lambda start, end: {add_days(start, day): {} for day in range((end - start).days + 1)},
+                ) as query:
+            self.assertEqual(len(refresh_stale_deputy_time_off(start_date)), 14)
+            self.assertEqual(refresh_stale_deputy_time_off(start_date), [])
+            # refreshed before it goes stale
+            DeputyTimeOff.objects.filter(time_off_date=start_date).update(
+                updated=timezone.now() - timedelta(minutes=40))
+            self.assertEqual(len(refresh_stale_deputy_time_off(start_date)), 14)
+        self.assertEqual(query.call_count, 2)
+
+    def test_time_off_range(self):
+        start_date = date(2024, 3, 4)
+        leave_start = datetime.combine(start_date, time(0, 0))
+        leave = {
+            'Employee': 11, 'Comment': 'holiday', 'DateStart': '2024-03-02T00:00:00+08:00',
+            'DateEnd': '2024-03-05T00:00:00+08:00', 'Start': leave_start.timestamp(), 'End': leave_start.timestamp(),
+        }
+        unavail = {
+            'Employee': 12, 'Comment': '', 'Date': '2024-03-06T00:00:00+08:00',
+            'StartTime': leave_start.timestamp(), 'EndTime': leave_start.timestamp(),
+        }
+        responses = {'Leave': [leave], 'EmployeeAvailability': [unavail]}
+
+        def post(self, url, data, idempotent=False):
+            return responses[url.split('/')[-2]]
+
+        dates = [add_days(start_date, day) for day in range(7)]
+        with mock.patch('peddleconcept.deputy_api.DeputyAPI.post', autospec=True, side_effect=post) as query:
+            rows = refresh_deputy_time_off(dates)
+        # one Leave and one EmployeeAvailability query for the whole week
+        self.assertEqual(query.call_count, 2)
+        self.assertEqual([list(row.data) for row in rows], [['11'], ['11'], ['12'], [], [], [], []])
+        self.assertEqual(rows[1].data['11'][0][2], 'on leave (holiday)')
+        self.assertEqual(DeputyTimeOff.objects.count(), 7)
+
+        # a full page of availability is followed by the next page
+        unavail_rows = [dict(unavail, Employee=20 + i) for i in range(3)]
+        responses['EmployeeAvailability'] = unavail_rows
+
+        def post_paged(self, url, data, idempotent=False):
+            return responses[url.split('/')[-2]][data['start']:data['start'] + data['max']]
+
+        Settings.objects.update_or_create(name=DEPUTY_API_SETTING, defaults={
+            'data': dict(get_deputy_api_setting(), query_page_size=2),
+        })
+        settings_cache.clear()
+        with mock.patch('peddleconcept.deputy_api.DeputyAPI.post', autospec=True, side_effect=post_paged) as query:
+            rows = refresh_deputy_time_off(dates)
+        self.assertEqual(sorted(c.args[2]['start'] for c in query.call_args_list), [0, 0, 2])
+        self.assertEqual(list(rows[2].data), ['20', '21', '22'])
+
+
+class ScheduleEventsTests(TransactionTestCase):
+    def setUp(self):
+        self.area = Area.objects.create(area_name='Perth')
+        self.tours_date = timezone.localdate()
+        self.changes = [
+            ScheduleChange.objects.create(tour_date=add_days(self.tours_date, day), tour_area=self.area)
+            for day in (0, 1, 0)
+        ]
+        self.client.force_login(get_user_model().objects.create_user('admin', is_staff=True))
+
+    def get_events(self, last_id=None):
+        headers = {'Last-Event-ID': str(last_id)} if last_id is not None else {}
+        response = self.client.get(reverse('tour_sched_events'), {
+            'tour_area_id': self.area.id, 'tours_date': json_datetime(self.tours_date),
+        }, headers=headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return b''.join(response.streaming_content).decode()
+
+    def test_wsgi_poll(self):
+        # under WSGI the stream ends straight away, and the browser reconnects later
+        last_id = self.changes[-1].id
+        self.assertEqual(self.get_events(), 'retry: 30000\nid: %d\n\n' % last_id)
+        events = self.get_events(self.changes[0].id)
+        self.assertEqual(events.count('data: '), 1)
+        self.assertIn('id: %d\ndata: ' % last_id, events)
+        self.assertEqual(self.get_events(last_id), 'retry: 30000\nid: %d\n\n' % last_id)
+
+        # changes elsewhere still move the client forward
+        other = ScheduleChange.objects.create(tour_date=add_days(self.tours_date, 1), tour_area=self.area)
+        self.assertEqual(self.get_events(last_id), 'retry: 30000\nid: %d\n\nretry: 30000\nid: %d\n\n' % (
+            last_id, other.id))
+
+    def test_reload_after_pruned(self):
+        ScheduleChange.objects.filter(id__in=[c.id for c in self.changes[:2]]).delete()
+        last_id = self.changes[-1].id
+        # nothing was missed since the second change
+        events = self.get_events(self.changes[1].id)
+        self.assertNotIn('reload', events)
+        self.assertIn('id: %d\ndata: ' % last_id, events)
+        reload = 'event: reload\nid: %d\ndata: {}\n\n' % last_id
+        self.assertIn(reload, self.get_events(self.changes[0].id))
+
+        with mock.patch('peddleconcept.tours.schedule_events.SCHEDULE_EVENTS_MAX_SECONDS', 0):
+            @async_to_sync
+            async def get_async_events():
+                return [event async for event in schedule_event_stream(self.changes[0].id, tour_area_id=self.area.id)]
+            self.assertEqual(get_async_events(), ['retry: 3000\n' + reload])
+
+class TourPaySlotTests(TransactionTestCase):
+    def setUp(self):
+        settings_cache.clear()
+        self.tours_date = timezone.localdate()
+        area = Area.objects.create(area_name='Perth')
+        self.rider = Person.objects.create(first_name='Rider', last_name='1', display_name='Rider 1', active=True,
+            rider_class='rider', override_pay_rate=40)
+        for hour in (10, 12):
+            time_start = timezone.make_aware(datetime.combine(self.tours_date, time(hour, 0)))
+            tour = Tour.objects.create(tour_area=area, time_start=time_start, time_end=time_start + timedelta(hours=1),
+                tour_type='Pub Tour')
+            TourRider.objects.create(tour=tour, person=self.rider, rider_role='lead')
+
+    def test_calculate_pay_slots(self):
+        pay_config = dict(get_tour_pay_config(), paid_break_max_len=0, min_daily_mins=240)
+        get_rider_payrate_setting() # loaded into the settings cache
+        # TourRiders and people, not a query per TourRider
+        with self.assertNumQueries(2):
+            pay_slots, tour_types, people = calculate_tour_pay_slots(self.tours_date, self.tours_date, pay_config)
+        self.assertEqual(tour_types, {'Pub Tour'})
+        self.assertEqual([(ps['slot_type'], ps['pay_minutes'], ps['pay_rate'], ps['description']) for ps in pay_slots], [
+            ('tour', 60, 40, 'Pub Tour (Role: Tour Lead)'),
+            ('break', 60, 40, ''),
+            ('tour', 60, 40, 'Pub Tour (Role: Tour Lead)'),
+            ('break', 60, 40, 'Extra pay (minimum 4.00h)'),
+        ])
+
+    def test_recalculate_unchanged(self):
+        data = load_tour_pay_report(self.tours_date, self.tours_date)
+        self.assertEqual(len(data['riders'][self.rider.id]['pay_days'][self.tours_date.isoformat()]), 3)
+        slots = list(RiderPaySlot.objects.order_by('id').values())
+        load_tour_pay_report(self.tours_date, self.tours_date)
+        self.assertEqual(list(RiderPaySlot.objects.order_by('id').values()), slots)
+
+    def test_recalculate_dirty_rider_days(self):
+        other = Person.objects.create(first_name='Rider', last_name='2', display_name='Rider 2', active=True)
+        tour = Tour.objects.order_by('time_start').first()
+        TourRider.objects.create(tour=tour, person=other, rider_role='')
+        on_schedule_changed([self.tours_date])
+
+        def load_report():
+            with mock.patch('peddleconcept.pay_reports.calculate_tour_pay_slots',
+                    wraps=pay_reports.calculate_tour_pay_slots) as calculate:
+                load_tour_pay_report(self.tours_date, self.tours_date)
+            return [c.kwargs['rider_days'] for c in calculate.call_args_list]
+
+        self.assertEqual(load_report(), [None])
+        # nothing changed
+        self.assertEqual(load_report(), [])
+
+        # changes which don't affect pay
+        save_tour_schedule(self.tours_date, {'tours': {str(tour.id): {'notes': 'Bring lights'}}})
+        self.assertEqual(load_report(), [])
+
+        # a new role for one rider only recalculates their day
+        save_tour_schedule(self.tours_date, {'tours': {str(tour.id): {'riders': [
+            {'rider_id': self.rider.id, 'rider_role': 'lead'}, {'rider_id': other.id, 'rider_role': 'colead'},
+        ]}}})
+        self.assertEqual(load_report(), [{self.tours_date: {other.id}}])
+        self.assertEqual(RiderPaySlot.objects.get(person=other, slot_type='tour').description,
+            'Pub Tour (Role: Tour Co-lead)')
+        self.assertEqual(RiderPaySlot.objects.filter(person=self.rider).count(), 3)
+
+        # removed riders stay out of the report, also when nothing changed since
+        save_tour_schedule(self.tours_date, {'tours': {str(tour.id): {'riders': [
+            {'rider_id': self.rider.id, 'rider_role': 'lead'},
+        ]}}})
+        for _ in range(2):
+            data = load_tour_pay_report(self.tours_date, self.tours_date)
+            self.assertEqual(list(data['riders']), [self.rider.id])
+        self.assertFalse(RiderPaySlot.objects.filter(person=other).exclude(source_row_state='deleted').exists())
+
+        # pay config changes recalculate everything
+        save_tour_pay_config(dict(get_tour_pay_config(), min_daily_mins=300))
+        self.assertEqual(load_report(), [None])
+        self.assertEqual(load_report(), [])
+
+    def test_incremental_matches_full(self):
+        other = Person.objects.create(first_name='Rider', last_name='2', display_name='Rider 2', active=True,
+            rider_class='rider', override_pay_rate=40)
+        for tour in Tour.objects.all():
+            TourRider.objects.create(tour=tour, person=other, rider_role='lead')
+        # the break between the tours is partly unpaid, for every rider
+        pay_config = dict(get_tour_pay_config(), paid_break_max_len=0, time_before_unpaid_break=60,
+            daily_unpaid_break_mins=30)
+
+        def get_slots(pay_slots):
+            return [(ps['slot_type'], ps['pay_minutes']) for ps in pay_slots if ps['person_id'] == other.id]
+
+        full = get_slots(calculate_tour_pay_slots(self.tours_date, self.tours_date, pay_config)[0])
+        self.assertEqual(full, [('tour', 60), ('break', 30), ('tour', 60)])
+        incremental = calculate_tour_pay_slots(self.tours_date, self.tours_date, pay_config,
+            rider_days={self.tours_date: {other.id}})[0]
+        self.assertEqual(get_slots(incremental), full)
+
+    def test_mark_dirty(self):
+        load_tour_pay_report(self.tours_date, self.tours_date)
+        old_date = add_days(self.tours_date, -PAY_RECALCULATE_DAYS - 7)
+        PayCalcDay.objects.create(pay_date=old_date, config_version='old')
+
+        keys = [(self.tours_date, self.rider.id), (self.tours_date, None)]
+        mark_pay_slots_dirty(keys)
+        mark_pay_slots_dirty(keys)
+        self.assertEqual(RiderPayDirty.objects.count(), 2)
+
+        # the report never recalculates old dates, so they are forgotten rather than left dirty
+        mark_pay_slots_dirty([(old_date, self.rider.id)])
+        self.assertEqual(sorted(RiderPayDirty.objects.values_list('pay_date', flat=True)), [self.tours_date] * 2)
+        self.assertFalse(PayCalcDay.objects.filter(pay_date=old_date).exists())
+        self.assertTrue(PayCalcDay.objects.filter(pay_date=self.tours_date).exists())
+
+    def test_update_db_rowset_bulk(self):
+        time_start = timezone.now()
+        def make_slot(i, pay_minutes, **kwargs):
+            return RiderPaySlot(person=self.rider, source_row_id=str(i), source='generate_pay_report',
+                time_start=time_start, time_end=time_start, pay_minutes=pay_minutes, **kwargs)
+
+        existing = [make_slot(i, 60) for i in range(5)]
+        for ps in existing:
+            ps.save()
+        # a manual change is kept
+        existing[1].update_field('pay_minutes', 90, 'user')
+        existing[1].save()
+
+        new_rows = [make_slot(i, 30) for i in range(3)] + [make_slot(9, 60)]
+        changed, added, deleted, unchanged, ignored = match_and_compare_rows(
+            new_rows, existing, 'source_row_id', fields=RiderPaySlot.MUTABLE_FIELDS,
+        )
+        # update rows 0, 2 (row 1 only has its auto value updated), add row 9, delete rows 3, 4 + BEGIN/COMMIT
+        with self.assertNumQueries(2 + 1 + 1 + 2):
+            result_rows = update_db_rowset(changed, added, deleted, 'generate_pay_report', existing)
+
+        self.assertEqual(sorted(ps.source_row_id for ps in result_rows), ['0', '1', '2', '9'])
+        self.assertEqual(dict(RiderPaySlot.objects.values_list('source_row_id', 'pay_minutes')), {
+            '0': 30, '1': 90, '2': 30, '3': 60, '4': 60, '9': 60,
+        })
+        self.assertEqual(RiderPaySlot.objects.get(source_row_id='1').field_auto_values['pay_minutes'], 30)
+        self.assertEqual(RiderPaySlot.objects.filter(source_row_state='deleted').count(), 2)
+
+    def test_update_payslots(self):
+        load_tour_pay_report(self.tours_date, self.tours_date)
+        slots = [ps.to_json() for ps in RiderPaySlot.objects.order_by('time_start')]
+        # someone else changed the last slot since it was loaded
+        RiderPaySlot.objects.filter(id=slots[2]['id']).update(updated=timezone.now() + timedelta(seconds=5))
+
+        edits = [
+            dict(slots[0], pay_minutes=45, description='Pub Tour (late start)'),
+            slots[1],
+            dict(slots[2], pay_minutes=30),
+            dict(slots[2], id=-1),
+        ]
+        # select + one bulk_update + BEGIN/COMMIT
+        with self.assertNumQueries(4):
+            results = update_payslots(edits)
+
+        self.assertEqual([(res['id'], res['result'], res['fields']) for res in results], [
+            (slots[0]['id'], 'updated', ['pay_minutes', 'description']),
+            (slots[1]['id'], 'unchanged', []),
+            (slots[2]['id'], 'conflict', ['pay_minutes']),
+            (-1, 'missing', []),
+        ])
+        self.assertEqual(results[2]['payslot']['pay_minutes'], slots[2]['pay_minutes'])
+        ps = RiderPaySlot.objects.get(id=slots[0]['id'])
+        self.assertEqual((ps.pay_minutes, ps.description), (45, 'Pub Tour (late start)'))
+        self.assertNotEqual(json_datetime(ps.updated), slots[0]['updated'])
+        self.assertEqual(RiderPaySlot.objects.get(id=slots[2]['id']).pay_minutes, slots[2]['pay_minutes'])
+
+    def test_pay_export(self):
+        self.rider.bank_bsb, self.rider.bank_acct = '123456', '12345678'
+        self.rider.save()
+        other = Person.objects.create(first_name='Another', last_name='Rider', display_name='Rider 2', active=True,
+            override_pay_rate=30)
+        TourRider.objects.create(tour=Tour.objects.order_by('time_start').first(), person=other, rider_role='')
+
+        with self.assertRaisesRegex(ValueError, 'aba_bank_code'):
+            get_pay_export(self.tours_date, self.tours_date, 'aba')
+
+        csv_lines = list(get_pay_export(self.tours_date, self.tours_date, 'csv'))
+        # one query for all the pay slots, ordered by rider
+        with self.assertNumQueries(1):
+            totals = list(iter_pay_totals(self.tours_date, self.tours_date, chunk_size=2))
+        self.assertEqual([(t['name'], t['bank_valid'], t['num_slots']) for t in totals], [
+            ('Another Rider', False, RiderPaySlot.objects.filter(person=other).count()),
+            ('Rider 1', True, RiderPaySlot.objects.filter(person=self.rider).count()),
+        ])
+        rate_minutes = sum(ps.pay_rate * ps.pay_minutes for ps in RiderPaySlot.objects.filter(person=self.rider))
+        rider_cents = (rate_minutes * 100 + 30) // 60
+        self.assertEqual(totals[1]['pay_cents'], rider_cents)
+        self.assertEqual(csv_lines[0], 'Rider Name,Hours,Pay,BSB,Account Number,Bank Details Valid\r\n')
+        self.assertEqual(csv_lines[2], 'Rider 1,%.2f,$%d.%02d,123456,12345678,yes\r\n' % (
+            totals[1]['pay_minutes'] / 60, *divmod(rider_cents, 100)))
+
+        Settings.objects.update_or_create(name=PAY_EXPORT_SETTING, defaults={'data': dict(get_pay_export_setting(),
+            aba_bank_code='CBA', aba_user_name='Peddle Concept', aba_user_id='123', aba_remitter_name='Peddle',
+            aba_trace_bsb='062-000', aba_trace_account='11112222',
+        )})
+        settings_cache.clear()
+        skipped = []
+        aba_lines = list(get_pay_export(self.tours_date, self.tours_date, 'aba', process_date=date(2024, 3, 4),
+            skipped=skipped))
+        self.assertEqual([t['name'] for t in skipped], ['Another Rider'])
+        self.assertEqual([len(line) for line in aba_lines], [122] * 3)
+        self.assertEqual(aba_lines[0][:62], '0' + ' ' * 17 + '01CBA' + ' ' * 7 + 'Peddle Concept'.ljust(26) + '000123')
+        self.assertEqual(aba_lines[0][74:80], '040324')
+        self.assertEqual(aba_lines[1][:30], '1123-456 12345678 53%010d' % rider_cents)
+        self.assertEqual(aba_lines[1][30:62].rstrip(), 'Rider 1')
+        self.assertEqual(aba_lines[1][80:96], '062-000 11112222')
+        self.assertEqual(aba_lines[2][:50], '7999-999' + ' ' * 12 + '%010d%010d%010d' % (rider_cents, rider_cents, 0))
+        self.assertEqual(aba_lines[2][74:80], '000001')
+
+    def test_pay_export_view(self):
+        load_tour_pay_report(self.tours_date, self.tours_date)
+        url = reverse('tour_pays_export', args=[self.tours_date.isoformat(), 'csv'])
+        # bank details are for staff only
+        self.client.force_login(get_user_model().objects.create_user('user'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(get_user_model().objects.create_user('admin', is_staff=True))
+        # exported from the stored pay slots, even if the schedule changed since
+        on_schedule_changed([self.tours_date])
+        with mock.patch('peddleconcept.pay_export.recalculate_tour_pay_slots') as recalculate:
+            response = self.client.get(url)
+            lines = list(response.streaming_content)
+        recalculate.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(lines[0], b'Rider Name,Hours,Pay,BSB,Account Number,Bank Details Valid\r\n')
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(self.client.post(url).status_code, 405)
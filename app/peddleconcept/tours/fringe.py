@@ -1,6 +1,6 @@
 from django.conf import settings
 from django.contrib import messages 
-from django.utils.timezone import make_aware, get_default_timezone
+from django.utils.timezone import make_aware, get_default_timezone, localdate
 from django.db import transaction
 from datetime import datetime, timedelta
 from peddleconcept.util import format_timedelta, update_model_with_dict, get_date_filter
@@ -12,8 +12,9 @@ import logging
 from requests.utils import dict_from_cookiejar
 
 from .red61_scraper import Red61Scraper
-from .schedules import get_bikes_json
+from .schedules import get_bikes_json, on_schedule_changed
 from .areas import load_areas_locations, get_tour_area, save_areas_locations
+from peddleconcept.merge import MergeSet, format_merge_stats
 
 logger = logging.getLogger(__name__)
 
@@ -159,15 +160,14 @@ def update_from_fringe(start_date, end_date, dry_run=False):
         log += log_msg + '\n'
         return False, log
 
-    changelogs = [] # keep track of row-by-row changes with ChangeLog instances
+    # keep track of row-by-row changes with ChangeLog instances, and only save the changed fields
+    tours_merge = MergeSet(Tour, db_tours.values())
+    sessions_merge = MergeSet(Session, db_sessions.values())
 
     # construct Tour model instances for each tour + a corresponding Session object
     tour_rows_matched = set() # keyed by source_row_id
-    tours_to_add = []
-    tours_to_update = []
+    summary_dates = set() # dates of changed tours before the changes, for refreshing the Tour Dashboard
     session_rows_matched = set()
-    sessions_to_add = []
-    sessions_to_update = []
 
     for t in tours.values():
         names = []
@@ -203,73 +203,47 @@ def update_from_fringe(start_date, end_date, dry_run=False):
             sess = db_sessions[fringe_src_id]
             tour_src.session = sess
             session_rows_matched.add(fringe_src_id)
-            if (chglog := sess.update_from_instance(sess_src)) is not None:
-                changelogs.append(chglog)
-                sessions_to_update.append(sess)
+            sessions_merge.update(sess, sess_src)
         else:
             # no existing session found - use new instance
             tour_src.session = sess_src
-            sessions_to_add.append(sess_src)
+            sessions_merge.add(sess_src)
         
         # match/update or create new tour
         if fringe_src_id in db_tours:
             tour = db_tours[fringe_src_id]
             tour_rows_matched.add(fringe_src_id)
-            if (chglog := tour.update_from_instance(tour_src)) is not None:
-                changelogs.append(chglog)
-                tours_to_update.append(tour)
+            tour_date = localdate(tour.time_start)
+            if tours_merge.update(tour, tour_src) is not None:
+                summary_dates.add(tour_date)
         else:
             # no existing tour - use the new one
-            tours_to_add.append(tour_src)
+            tours_merge.add(tour_src)
 
     sessions_to_delete = set(db_sessions.keys()) - session_rows_matched
     for srid in sessions_to_delete:
-        sess = db_sessions[srid]
-        if chglog := sess.mark_source_deleted():
-            changelogs.append(chglog)
-        sessions_to_update.append(sess)
+        sessions_merge.delete(db_sessions[srid])
     
-    if not dry_run:
-        sessions_created = Session.objects.bulk_create(sessions_to_add)
-        for s in sessions_created:
-            if (chglog := s.mark_source_added()):
-                changelogs.append(chglog)
-        sessions_updated = Session.objects.bulk_update(sessions_to_update, 
-            fields=[f.name for f in Session._meta.fields if not f.name == 'id'])
-        log_msg = "save sessions: added=%d, updated/cancelled=%d, cancelled=%d, unchanged=%d" % (
-            len(sessions_created), sessions_updated, len(sessions_to_delete),
-            len(db_sessions) - sessions_updated
-        )
-    else:   
-        log_msg = "dry run: no DB changes! sessions: added=%d, updated/cancelled=%d, cancelled=%d, unchanged=%d" % (
-            len(sessions_to_add), len(sessions_to_update), len(sessions_to_delete), len(db_sessions) - len(sessions_to_update)
-        )
+    log_msg = format_merge_stats('sessions', sessions_merge.save(dry_run=dry_run))
+    if dry_run:
+        log_msg = "dry run: no DB changes! %s" % log_msg
     logger.info(log_msg)
     log += log_msg + '\n'
     
     tours_to_delete = set(db_tours.keys()) - tour_rows_matched
     for srid in tours_to_delete:
-        tour = db_tours[srid]
-        if (chglog := tour.mark_source_deleted()):
-            changelogs.append(chglog)
-        tours_to_update.append(tour)
+        tours_merge.delete(db_tours[srid])
     
+    log_msg = format_merge_stats('tours', tours_merge.save(dry_run=dry_run))
+    changelogs = sessions_merge.changelogs + tours_merge.changelogs
     if not dry_run:
-        tours_created = Tour.objects.bulk_create(tours_to_add)
-        for t in tours_created:
-            if (chglog := t.mark_source_added()):
-                changelogs.append(chglog)
-        tours_updated = Tour.objects.bulk_update(tours_to_update,
-            fields=[f.name for f in Tour._meta.fields if not f.name == 'id'])
         new_changelogs = ChangeLog.objects.bulk_create(changelogs)
-        log_msg = "save tours: added=%d, updated/cancelled=%d, cancelled=%d, unchanged=%d, changelogs=%d" % (
-            len(tours_created), tours_updated, len(tours_to_delete), len(db_tours) - tours_updated, len(new_changelogs)
-        )
+        log_msg += ", changelogs=%d" % len(new_changelogs)
         save_areas_locations()
+        on_schedule_changed(summary_dates | set(
+            localdate(t.time_start) for t in tours_merge.changed + tours_merge.created))
     else:
-        log_msg = "dry run: no DB changes! tours: added=%d, updated/cancelled=%d, cancelled=%d, unchanged=%d, changelogs=%d" % (
-            len(tours_to_add), len(tours_to_update), len(tours_to_delete), len(db_tours) - len(tours_to_update), len(changelogs)
-        )
+        log_msg = "dry run: no DB changes! %s, changelogs=%d" % (log_msg, len(changelogs))
     logger.info(log_msg)
     log += log_msg + '\n'
 
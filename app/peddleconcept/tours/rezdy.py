@@ -2,13 +2,16 @@ import re
 import sys
 import logging
 import math
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from peddleconcept.models import Tour, Session, ChangeLog
 from peddleconcept.util import *
 from peddleconcept.settings import *
 from requests.utils import dict_from_cookiejar
 from datetime import time, datetime
 from django.utils import timezone, html
-from django.utils.timezone import get_default_timezone
+from django.utils.timezone import get_default_timezone, localdate
 from django.template.loader import get_template
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
@@ -17,6 +20,8 @@ from dateutil.parser import parse
 
 from .rezdy_scraper import RezdyScraper
 from .areas import load_areas_locations, get_tour_area, save_areas_locations
+from .schedules import on_schedule_changed
+from peddleconcept.merge import MergeSet, format_merge_stats
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +51,19 @@ def rezdy_save_cookies(scraper):
     }
     set_setting(REZDY_COOKIES_SETTING, data)
 
+def get_manifest_fingerprint(manifest_response):
+    """ content hash of a day's manifest JSON, to detect when nothing has changed in Rezdy """
+    return hashlib.sha1(json.dumps(manifest_response, sort_keys=True).encode('utf-8')).hexdigest()
+
+def rezdy_save_fingerprints(day_fingerprints):
+    """ store manifest fingerprints keyed by ISO date, forgetting any from before yesterday """
+    oldest = add_days(today(), -1).isoformat()
+    fingerprints = get_setting(REZDY_FINGERPRINTS_SETTING) or {}
+    fingerprints.update(day_fingerprints)
+    set_setting(REZDY_FINGERPRINTS_SETTING, {
+        day: fp for day, fp in fingerprints.items() if day >= oldest
+    })
+
 QTY_REGEX = re.compile(r'^(?P<num>\d+) (?P<what>(?P<num2>\d)? ?[a-z0-9 &()]+|)$')
 QTY_TERMS = {
     'solo': (1, 'bike'), # per bike
@@ -168,10 +186,72 @@ def parse_manifest_tours(manifest_response):
 
     return tour_dict
 
+def fetch_manifest_days(scraper, day_dates, allow_login=False):
+    """
+    Fetch the Rezdy manifest for each date in turn using the given scraper.
+    Returns a dict of date: (manifest_response, fetch_seconds, error).
+    Stops early on any error when allow_login=True, or when a login is required but not allowed.
+    """
+    results = {}
+    for day_date in day_dates:
+        time_start = datetime.now()
+        manifest_resp = scraper.fetch_manifest_data(day_date, allow_login=allow_login)
+        if scraper.login_required:
+            break
+        results[day_date] = (
+            manifest_resp,
+            (datetime.now() - time_start).total_seconds(),
+            None if manifest_resp else scraper.get_last_error(),
+        )
+        if not manifest_resp and allow_login:
+            break
+    return results
+
+def fetch_manifests(scraper, day_dates, concurrency=1):
+    """
+    Fetch the Rezdy manifests for a list of dates, using up to `concurrency` worker threads.
+    Each worker gets a copy of the logged-in scraper session (sharing cookies), after the first day is
+    fetched normally to make sure we are logged in. Workers never log in themselves: any days they can't fetch
+    due to an expired login are fetched one at a time afterwards using the original scraper.
+    Returns a list of (date, manifest_response, fetch_seconds, error) in date order for each day attempted.
+    """
+    results = {}
+    if concurrency > 1 and len(day_dates) > 1:
+        results.update(fetch_manifest_days(scraper, day_dates[:1], allow_login=True))
+
+        if not results.get(day_dates[0], (None,))[0]:
+            # the first day failed even with a login: the other days would fail the same way
+            return [ (day_dates[0], *results[day_dates[0]]) ] if day_dates[0] in results else []
+
+        workers = [ scraper.clone() for i in range(min(concurrency, len(day_dates) - 1)) ]
+        try:
+            # spread remaining days between the workers so each one reuses its own connection
+            worker_days = [ day_dates[1 + i::len(workers)] for i in range(len(workers)) ]
+            with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+                for worker_results in executor.map(fetch_manifest_days, workers, worker_days):
+                    results.update(worker_results)
+        finally:
+            for worker in workers:
+                worker.close()
+
+        if (num_missing := len(day_dates) - len(results)) > 0:
+            logger.info('Rezdy login required: fetching remaining %d days sequentially' % num_missing)
+
+    # sequential fetch, also used for any days not fetched concurrently
+    for day_date in day_dates:
+        if day_date not in results:
+            results.update(fetch_manifest_days(scraper, [day_date], allow_login=True))
+            if day_date not in results or not results[day_date][0]:
+                break
+
+    return [ (day_date, *results[day_date]) for day_date in day_dates if day_date in results ]
+
 @transaction.atomic
-def update_from_rezdy(start_date, end_date, dry_run=False):
+def update_from_rezdy(start_date, end_date, dry_run=False, concurrency=None, full=False):
     """
     Fetches & accumulates tour/session data by querying Rezdy manifest for each day in the specified date range.
+    Manifests are fetched using `concurrency` threads at once (default from the auto update settings).
+    Days whose manifest is identical to the last successful scan are skipped entirely, unless full=True.
     Then updates all rows in the DB based on matching "Order Number + Order Item ID" with source_row_id
     Note that earlier tours were imported solely based on Order Number - need to also check and update these rows
     with the order item ID where possible.
@@ -193,17 +273,32 @@ def update_from_rezdy(start_date, end_date, dry_run=False):
 
     num_days = (end_date - start_date).days + 1
     num_days_ok = 0
-    last_time = datetime.now()
-    for day in range(num_days):
-        day_date = add_days(start_date, day)
-        manifest_resp = scraper.fetch_manifest_data(day_date)
-        now = datetime.now()
-
+    num_days_failed = 0
+    last_fingerprints = {} if full else (get_setting(REZDY_FINGERPRINTS_SETTING) or {})
+    day_fingerprints = {} # fingerprints of days to be merged
+    changed_dates = []
+    if concurrency is None:
+        concurrency = get_rezdy_fetch_concurrency()
+    day_dates = [add_days(start_date, day) for day in range(num_days)]
+    manifests = fetch_manifests(scraper, day_dates, concurrency)
+
+    for day_date, manifest_resp, fetch_secs, error in manifests:
         if not manifest_resp:
-            log_msg = 'Rezdy manifest %s: scraper error: %s' % (day_date.isoformat(), scraper.get_last_error())
+            log_msg = 'Rezdy manifest %s: scraper error: %s' % (day_date.isoformat(), error)
             logger.error(log_msg)
             log += log_msg + '\n'
-            return False, log
+            num_days_failed += 1
+            continue
+
+        fingerprint = get_manifest_fingerprint(manifest_resp)
+        if last_fingerprints.get(day_date.isoformat()) == fingerprint:
+            log_msg = '%s: manifest unchanged in %0.1fs, skipping' % (day_date.isoformat(), fetch_secs)
+            log += '%s\n' % log_msg
+            logger.debug(log_msg)
+            num_days_ok += 1
+            if num_days_ok == 1:
+                rezdy_save_cookies(scraper)
+            continue
 
         try:
             # convert manifest JSON data into Tour and Session instances
@@ -214,8 +309,10 @@ def update_from_rezdy(start_date, end_date, dry_run=False):
             sessions = parse_manifest_sessions(manifest_resp)
             rezdy_tours.update(tours)
             rezdy_sessions.update(sessions)
+            changed_dates.append(day_date)
+            day_fingerprints[day_date.isoformat()] = fingerprint
             log_msg = '%s: got %d tours, %d sessions in %0.1fs' % (
-                day_date.isoformat(), len(tours), len(sessions), (now - last_time).total_seconds()
+                day_date.isoformat(), len(tours), len(sessions), fetch_secs
             )
             log += '%s\n' % log_msg
             logger.debug(log_msg)
@@ -224,26 +321,40 @@ def update_from_rezdy(start_date, end_date, dry_run=False):
             errormsg = 'Rezdy tour manifest for date %s returned error: %s' % (day_date.isoformat(), e)
             logger.error(errormsg)
             log += '%s\n' % errormsg
-        last_time = now
 
         if num_days_ok == 1:
             rezdy_save_cookies(scraper)
 
+    if num_days_failed or len(manifests) < num_days:
+        # don't merge partial data: missing days would look like cancelled tours
+        log_msg = 'Rezdy scan aborted: fetched %d/%d days' % (len(manifests) - num_days_failed, num_days)
+        logger.error(log_msg)
+        log += log_msg + '\n'
+        scraper.close()
+        return False, log
+
+    now = datetime.now()
 
-    log_msg = "[%s : %s] Fetched %d tours, %d sessions for %d/%d days in %0.1fs" % (
+    log_msg = "[%s : %s] Fetched %d tours, %d sessions for %d/%d days (%d changed) in %0.1fs" % (
         start_date.isoformat(), end_date.isoformat(), len(rezdy_tours),
-        len(rezdy_sessions), num_days_ok, num_days, (datetime.now() - time_start).total_seconds()
+        len(rezdy_sessions), num_days_ok, num_days, len(changed_dates), (datetime.now() - time_start).total_seconds()
     )
     logger.info(log_msg)
     log += '%s: %s\n' % (now.isoformat(), log_msg)
     scraper.close()
 
-    date_filter = get_date_filter(start_date, end_date, 'time_start')
+    if not changed_dates:
+        return True, log
+
+    # only merge the days which changed: unchanged days are left as they are in the DB
+    dates_q = get_dates_q(changed_dates, 'time_start')
 
     # Tours and sessions: match rows from Rezdy with rows in DB
     db_sessions = {} # keyed by Rezdy session ID
     db_sessions_legacy = {} # keyed by legacy session key
-    for s in Session.objects.filter(source='rezdy', **date_filter):
+    sessions_merge = MergeSet(Session)
+    for s in Session.objects.filter(dates_q, source='rezdy'):
+        sessions_merge.track(s)
         if ':' in s.source_row_id:
             # session key format: will be updated if possible
             db_sessions_legacy[s.source_row_id] = s
@@ -279,39 +390,21 @@ def update_from_rezdy(start_date, end_date, dry_run=False):
     logger.info(log_msg)
 
     sessions_db = {} # keyed by Rezdy session-id not DB row ID!
-    sessions_to_update = []
-    changelogs = []
     for srid, dst_sess in rezdy_sessions_matched.items():
-        src_sess = rezdy_sessions[srid]
-        if (chglog := dst_sess.update_from_instance(src_sess)) is not None:
-            changelogs.append(chglog)
-            sessions_to_update.append(dst_sess)
+        sessions_merge.update(dst_sess, rezdy_sessions[srid])
         sessions_db[dst_sess.source_row_id] = dst_sess
     
     for sess in db_sessions_to_delete:
-        if (chglog := sess.mark_source_deleted()):
-            changelogs.append(chglog)
-        sessions_to_update.append(sess)
+        sessions_merge.delete(sess)
     
-    if not dry_run:
-        sessions_updated = Session.objects.bulk_update(sessions_to_update,
-            fields=[f.name for f in Session._meta.fields if not f.name == 'id'])
-        sessions_unchanged = len(sessions_db) - sessions_updated
-        sessions_created = Session.objects.bulk_create(rezdy_sessions_added.values())
-        for new_sess in sessions_created:
-            sessions_db[new_sess.source_row_id] = new_sess
-            if (chglog := new_sess.mark_source_added()):
-                changelogs.append(chglog)
-        log_msg = "save sessions: added=%d, updated/cancelled=%d, cancelled=%d, unchanged=%d" % (
-            len(sessions_created), sessions_updated, len(db_sessions_to_delete), sessions_unchanged
-        )
-    else:
-        for new_sess in rezdy_sessions_added:
-            sessions_db[new_sess.source_row_id] = new_sess
-        log_msg = "dry run: no DB changes! sessions: added=%d, updated/cancelled=%d, cancelled=%d, unchanged=%d" % (
-            len(rezdy_sessions_added), len(sessions_to_update), len(db_sessions_to_delete),
-            len(sessions_db) - len(sessions_to_update)
-        )
+    for new_sess in rezdy_sessions_added.values():
+        sessions_merge.add(new_sess)
+        sessions_db[new_sess.source_row_id] = new_sess
+
+    sessions_stats = sessions_merge.save(dry_run=dry_run)
+    log_msg = format_merge_stats('sessions', sessions_stats)
+    if dry_run:
+        log_msg = "dry run: no DB changes! %s" % log_msg
     log += '%s: %s\n' % (datetime.now().isoformat(), log_msg)
     logger.info(log_msg)    
     
@@ -327,9 +420,11 @@ def update_from_rezdy(start_date, end_date, dry_run=False):
     db_tours_duplicate = []
     db_tours = {} # Tour rows with source_row_id='{order-number}:{order-item-id}'
     db_tours_legacy = {} # for legacy Tour rows with only order number
+    tours_merge = MergeSet(Tour)
     for tour in Tour.objects.select_related('session').order_by('time_start').filter(
-            Q(source='rezdy', **date_filter) | 
+            Q(dates_q, source='rezdy') | 
             Q(source='rezdy', source_row_id__in=rezdy_tours_all_possible_srids.keys())):
+        tours_merge.track(tour)
         # try to find duplicate tours here: keep only the LATEST copy
         if tour.source_row_id in db_tours_legacy:
             db_tours_duplicate.append(db_tours_legacy.pop(tour.source_row_id))
@@ -363,8 +458,7 @@ def update_from_rezdy(start_date, end_date, dry_run=False):
             add_or_update_tour = rezdy_tours_added[srid] = t
 
         # check for source_row_state changes for all tours matched in the DB - we can track any data glitches easily
-        if (chglog := add_or_update_tour.mark_source_added()):
-            changelogs.append(chglog)
+        tours_merge.mark_added(add_or_update_tour)
         
         t.session = sessions_db[t.rezdy_session_id]
 
@@ -378,38 +472,31 @@ def update_from_rezdy(start_date, end_date, dry_run=False):
     log += '%s: %s\n' % (datetime.now().isoformat(), log_msg)
     logger.info(log_msg)
 
-    tours_to_update = []
+    summary_dates = set() # dates of all tours added/changed/deleted, before and after the changes
     for srid, dst_tour in rezdy_tours_matched.items():
-        src_tour = rezdy_tours[srid]
+        tour_date = localdate(dst_tour.time_start)
         # update_from_instance should always make source_row_state=live
-        if (chglog := dst_tour.update_from_instance(src_tour)) is not None:
-            tours_to_update.append(dst_tour)
-            changelogs.append(chglog)
+        if tours_merge.update(dst_tour, rezdy_tours[srid]) is not None:
+            summary_dates.add(tour_date)
             
     for tour in db_tours_to_delete:
-        if (chglog := tour.mark_source_deleted()):
-            changelogs.append(chglog)
-        tours_to_update.append(tour)
+        tours_merge.delete(tour)
+
+    for tour in rezdy_tours_added.values():
+        tours_merge.add(tour)
 
+    tours_stats = tours_merge.save(dry_run=dry_run)
+    changelogs = sessions_merge.changelogs + tours_merge.changelogs
+    log_msg = format_merge_stats('tours', tours_stats)
     if not dry_run:
-        num_updated = Tour.objects.bulk_update(tours_to_update,
-            fields=[f.name for f in Tour._meta.fields if not f.name == 'id'])
-        num_unchanged = len(db_tours) + num_legacy_orig - num_updated
-        tours_created = Tour.objects.bulk_create(rezdy_tours_added.values())
-        for tour in tours_created:
-            if (chglog := tour.mark_source_added()):
-                changelogs.append(chglog)
         new_changelogs = ChangeLog.objects.bulk_create(changelogs)
         save_areas_locations()
-
-        log_msg = "save tours: added=%d, updated/cancelled=%d, cancelled=%d, unchanged=%d. Saved %d changelogs" % (
-            len(tours_created), num_updated, len(db_tours_to_delete), num_unchanged, len(new_changelogs)
-        )
+        rezdy_save_fingerprints(day_fingerprints)
+        on_schedule_changed(summary_dates | set(
+            localdate(t.time_start) for t in tours_merge.changed + tours_merge.created))
+        log_msg += ". Saved %d changelogs" % len(new_changelogs)
     else:
-        log_msg = "dry run: no DB changes! tours: added=%d, updated/cancelled=%d, cancelled=%d, unchanged=%d, changelogs=%d" % (
-            len(rezdy_tours_added), len(tours_to_update), len(db_tours_to_delete), 
-            len(db_tours) + num_legacy_orig - len(tours_to_update), len(changelogs)
-        )
+        log_msg = "dry run: no DB changes! %s, changelogs=%d" % (log_msg, len(changelogs))
     log += '%s: %s\n' % (datetime.now().isoformat(), log_msg)
     logger.info(log_msg)
 
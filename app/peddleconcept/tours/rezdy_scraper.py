@@ -1,6 +1,7 @@
 # Scrape rezdy manifest data from Rezdy website
 
 import requests
+from requests.utils import dict_from_cookiejar
 from urllib.parse import urlparse, parse_qs
 import os
 import json
@@ -24,9 +25,11 @@ class RezdyScraper:
     def __init__(self, username, password, cookies=None, proxy=REZDY_PROXY, cookies_domain=COOKIES_DOMAIN):
         self.login_error = ''
         self.last_error = ''
+        self.login_required = False
         self.profile = None
         self.username = username
         self.password = password
+        self.proxy = proxy
         
         self.session = requests.Session()
         if proxy:
@@ -43,7 +46,14 @@ class RezdyScraper:
         redirect_url = urlparse(response.url)
         return redirect_url.hostname != 'app.rezdy.com'
     
-    def try_request_url(self, url, data=None):
+    def clone(self):
+        """ return a new scraper with its own HTTP session, sharing the cookies (ie. login) of this one """
+        return RezdyScraper(
+            username=self.username, password=self.password, proxy=self.proxy,
+            cookies=dict_from_cookiejar(self.session.cookies),
+        )
+
+    def try_request_url(self, url, data=None, allow_login=True):
         """ try to get the given URL and return correct data, detect if login required """
         try:
             for i in range(3):
@@ -54,6 +64,11 @@ class RezdyScraper:
                 log_response(resp, logger=logger)
                 
                 if self.is_login_required(resp):
+                    if not allow_login:
+                        # leave the login to the caller, eg. when sharing cookies between several scrapers
+                        self.login_required = True
+                        self.last_error = "Login required to fetch url: %s" % url
+                        return None
                     login_ok = self.login_to_rezdy()
                     if not login_ok:
                         return None
@@ -207,7 +222,7 @@ class RezdyScraper:
         self.log_login_error("Login failed: Reached maximum login retries")
         return False
 
-    def fetch_manifest_data(self, manifest_date=None):
+    def fetch_manifest_data(self, manifest_date=None, allow_login=True):
         url = 'https://app.rezdy.com/calendar/generateManifestDataAjax'
         manifest_date = date.today() if not manifest_date else manifest_date
         manifest_opts = {
@@ -223,7 +238,7 @@ class RezdyScraper:
             "GridSetting[columnSizes]": "{\"product\":140,\"session\":72,\"session-end\":115,\"customer-full-name\":119,\"customer-phone\":104,\"participants-list\":140,\"quantities\":140,\"order-special-requirements\":190,\"pick-up-location\":100,\"extras\":140,\"order-internal-notes\":140,\"pick-up-time\":69,\"order-number\":140}",
             "GridSetting[sorting]": "{}",
         }
-        resp = self.try_request_url(url, data=manifest_opts)
+        resp = self.try_request_url(url, data=manifest_opts, allow_login=allow_login)
         if not resp:
             return None
 
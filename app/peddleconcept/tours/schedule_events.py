@@ -0,0 +1,115 @@
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from datetime import timedelta
+import asyncio
+import json
+import time
+from peddleconcept.models import ScheduleChange
+
+# how often each open event stream checks the DB for new schedule changes
+SCHEDULE_EVENTS_POLL_SECONDS = 2
+# send a comment line at least this often so proxies don't close idle connections
+SCHEDULE_EVENTS_KEEPALIVE_SECONDS = 15
+# streams are closed after this long, then the browser reconnects automatically and resumes from the last event ID
+SCHEDULE_EVENTS_MAX_SECONDS = 300
+SCHEDULE_EVENTS_RETRY_MS = 3000
+# under WSGI the stream only sends the changes so far then closes, and the browser polls again after this long
+SCHEDULE_EVENTS_WSGI_RETRY_MS = 30000
+# changes older than this are deleted, so a client which was disconnected for longer should reload everything
+SCHEDULE_CHANGES_MAX_AGE = timedelta(hours=1)
+
+def record_schedule_changes(keys):
+    """
+    Record a ScheduleChange for each (date, area ID) in keys, once the current transaction (if any) commits.
+    Called from schedules.on_schedule_changed() after every change to tours or tour riders.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+
+    def on_commit():
+        ScheduleChange.objects.bulk_create(
+            ScheduleChange(tour_date=tour_date, tour_area_id=area_id) for tour_date, area_id in keys
+        )
+        ScheduleChange.objects.filter(created__lt=timezone.now() - SCHEDULE_CHANGES_MAX_AGE).delete()
+
+    transaction.on_commit(on_commit)
+
+def get_schedule_changes_qs(last_id, tour_area_id=None, start_date=None, end_date=None):
+    """ returns a queryset of the changes after last_id which match the given area and/or date range """
+    qs = ScheduleChange.objects.filter(id__gt=last_id).order_by('id')
+    if tour_area_id is not None:
+        qs = qs.filter(tour_area_id=tour_area_id)
+    if start_date is not None:
+        qs = qs.filter(tour_date__gte=start_date)
+    if end_date is not None:
+        qs = qs.filter(tour_date__lte=end_date)
+    return qs
+
+def format_event(change):
+    """ returns a Server-Sent Event for a ScheduleChange, with the event ID used to resume the stream """
+    return "id: %d\ndata: %s\n\n" % (change.id, json.dumps(change.to_json()))
+
+def format_stream_start(last_id, retry_ms):
+    # the browser sends back the last event ID when reconnecting, even if no changes were sent yet
+    return "retry: %d\nid: %d\n\n" % (retry_ms, last_id)
+
+def format_reload(last_id, retry_ms):
+    """ tells the client to reload all its data, then resume the stream from last_id """
+    return "retry: %d\nevent: reload\nid: %d\ndata: {}\n\n" % (retry_ms, last_id)
+
+def format_keepalive():
+    return ": keepalive\n\n"
+
+def start_stream(last_id, change_ids, retry_ms):
+    """
+    Returns the ID to send the changes after and the first lines of the stream, from the Min/Max aggregate of the
+    ScheduleChange IDs. If changes after last_id could have been pruned already, a "reload" event tells the
+    client to reload everything instead, and the stream resumes from the latest change.
+    """
+    first_id, max_id = change_ids['first_id'], change_ids['last_id'] or 0
+    if last_id is None:
+        return max_id, format_stream_start(max_id, retry_ms)
+    if first_id is not None and last_id < first_id - 1:
+        return max_id, format_reload(max_id, retry_ms)
+    return last_id, format_stream_start(last_id, retry_ms)
+
+def sync_schedule_event_stream(last_id, **filters):
+    """
+    Generator of Server-Sent Events for the schedule changes after last_id (None for only new changes), used when
+    not running under ASGI. Rather than keeping a worker thread busy, it only sends the changes so far then ends,
+    and the browser reconnects after SCHEDULE_EVENTS_WSGI_RETRY_MS: the data views answer the reloads with a
+    304 Not Modified when the ETag still matches.
+    """
+    change_ids = ScheduleChange.objects.aggregate(first_id=Min('id'), last_id=Max('id'))
+    last_id, start = start_stream(last_id, change_ids, SCHEDULE_EVENTS_WSGI_RETRY_MS)
+    yield start
+    for change in get_schedule_changes_qs(last_id, **filters):
+        last_id = change.id
+        yield format_event(change)
+
+    # resume after the changes which didn't match the filters too, so an idle client doesn't fall behind the prune
+    if (change_ids['last_id'] or 0) > last_id:
+        yield format_stream_start(change_ids['last_id'], SCHEDULE_EVENTS_WSGI_RETRY_MS)
+
+async def schedule_event_stream(last_id, **filters):
+    """
+    Same as sync_schedule_event_stream() but as an async generator which stays open, checking for new changes
+    every SCHEDULE_EVENTS_POLL_SECONDS while keeping no thread busy
+    """
+    last_id, start = start_stream(last_id,
+        await ScheduleChange.objects.aaggregate(first_id=Min('id'), last_id=Max('id')), SCHEDULE_EVENTS_RETRY_MS)
+    yield start
+
+    time_start = last_sent = time.monotonic()
+    while time.monotonic() - time_start < SCHEDULE_EVENTS_MAX_SECONDS:
+        async for change in get_schedule_changes_qs(last_id, **filters):
+            last_id = change.id
+            last_sent = time.monotonic()
+            yield format_event(change)
+
+        if time.monotonic() - last_sent >= SCHEDULE_EVENTS_KEEPALIVE_SECONDS:
+            last_sent = time.monotonic()
+            yield format_keepalive()
+        await asyncio.sleep(SCHEDULE_EVENTS_POLL_SECONDS)
@@ -1,12 +1,20 @@
-from django.db import transaction
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q
+import hashlib
+import json
 import logging
 import math
 from peddleconcept.models import *
 from peddleconcept.util import *
 from peddleconcept.settings import *
-from peddleconcept.deputy_api import DeputyAPI
+from peddleconcept.deputy import get_deputy_time_off, is_deputy_time_off_stale, sync_deputy_rosters_range
+from peddleconcept.pay_reports import mark_pay_slots_dirty
+from .schedule_events import record_schedule_changes
+from django.utils import timezone
 from django.utils.timezone import localdate, localtime
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
@@ -135,28 +143,160 @@ def get_venues_summary(tour):
     vsum.append("%s - Tour finish" % format_time(tv.time_depart))
     return '\n'.join(vsum)
 
+def get_schedule_settings_version():
+    """
+    Digest of the bike types, venue presets and venues included with the schedule data, cached along with the
+    settings so it is only recalculated when they change.
+    """
+    return get_cached_data(SCHEDULE_SETTINGS_CACHE_NAME, lambda: hashlib.md5(json.dumps(
+        [get_bikes_setting(), get_venues_presets(), get_venues_json()], sort_keys=True, cls=DjangoJSONEncoder,
+    ).encode()).hexdigest())
+
+def get_tours_version(tours_qs, schedule_only=False):
+    """
+    Returns a version token for the schedule data of the given tours, which changes whenever any of the tours or
+    their riders (including the riders' names and phone numbers), venues or sessions are added, changed or removed,
+    or the bike types, venue presets or venues change. Needs only a single aggregate query.
+    With schedule_only=True, only the schedule rows themselves are covered (tours, riders, venues and sessions).
+    """
+    aggregates = dict(
+        num_tours=Count('id', distinct=True),
+        tours_updated=Max('updated'),
+        num_riders=Count('riders', distinct=True),
+        riders_updated=Max('riders__updated'),
+        num_venues=Count('venues', distinct=True),
+        venues_updated=Max('venues__updated'),
+        num_sessions=Count('session', distinct=True),
+        sessions_updated=Max('session__updated'),
+    )
+    if schedule_only:
+        return tours_qs.order_by().aggregate(**aggregates)
+
+    version = tours_qs.order_by().aggregate(people_updated=Max('riders__person__updated'), **aggregates)
+    version['settings'] = get_schedule_settings_version()
+    return version
+
+def get_rider_schedule_version(start_date, end_date, person):
+    """ returns a version token for the data returned by get_rider_schedule """
+    tr_filter = get_date_filter(start_date, end_date, 'time_start')
+    version = get_tours_version(Tour.objects.filter(
+        id__in=TourRider.objects.filter(person=person).values('tour_id'),
+        **tr_filter,
+    ))
+    # the rider schedule also has the names of all the riders, and the areas
+    version.update(Person.objects.filter(rider_class__isnull=False).aggregate(
+        num_people=Count('id'),
+        all_people_updated=Max('updated'),
+    ))
+    version.update(Area.objects.filter(active=True).aggregate(
+        num_areas=Count('id'),
+        areas_updated=Max('updated'),
+    ))
+    return version
+
+def get_tour_schedule_version(tour_area, tours_date, schedule_only=False):
+    """ returns a version token for the data returned by get_tour_schedule_data, see get_tours_version() """
+    date_filter = get_date_filter(tours_date, tours_date, 'time_start')
+    return get_tours_version(Tour.objects.filter(tour_area=tour_area, **date_filter), schedule_only=schedule_only)
+
+def get_tour_schedule_cache_key(tour_area_id, tours_date):
+    return 'tour_schedule:%d:%s' % (tour_area_id, tours_date.isoformat())
+
+def get_cached_tour_schedule_data(tour_area, tours_date, version):
+    """
+    get_tour_schedule_data() for the viewer, shared by everyone viewing the same area and date.
+    version is from get_tour_schedule_version(), the cached data is rebuilt whenever it doesn't match.
+    """
+    cache = caches[SCHEDULE_CACHE_NAME]
+    key = get_tour_schedule_cache_key(tour_area.id, tours_date)
+    cached = cache.get(key)
+    if cached is not None and cached['version'] == version:
+        return cached['data']
+
+    data = get_tour_schedule_data(tour_area, tours_date, in_editor=False)
+    # don't cache data which might be rolled back later
+    if not connection.in_atomic_block:
+        cache.set(key, {'version': version, 'data': data})
+    return data
+
+def invalidate_tour_schedule_cache(keys):
+    """
+    Remove the cached schedule data for each (date, area ID) in keys, once the current transaction (if any) commits.
+    Only clears the cache of this process when using the local memory cache, others still check the version.
+    """
+    keys = [get_tour_schedule_cache_key(area_id, tour_date) for tour_date, area_id in keys]
+    if keys:
+        transaction.on_commit(lambda: caches[SCHEDULE_CACHE_NAME].delete_many(keys))
+
+def get_tour_summary_version(start_date, end_date):
+    """ returns a version token for the data returned by get_tour_summary """
+    return TourSummary.objects.filter(
+        tour_date__gte=start_date, tour_date__lte=end_date,
+    ).aggregate(
+        num_summaries=Count('id'),
+        summaries_updated=Max('updated'),
+    )
+
+def get_venues_json():
+    """ returns JSON data for all venues, cached per process until the venues or settings are changed """
+    return get_cached_data(VENUES_CACHE_NAME, lambda: {
+        v.id: v.to_json() for v in Venue.objects.all()
+    })
+
+def get_tours_json(tours_qs, in_editor=False):
+    """
+    Returns JSON data for the tours in tours_qs, same as Tour.to_json(with_related_data=True), plus the JSON data
+    of their sessions, both as dicts keyed by ID in the order of tours_qs.
+    Uses 3 queries in total and builds the data from .values() without creating any model instances.
+    """
+    session_fields = ['session__%s' % field for field in Session.JSON_FIELDS]
+    tours_values = {} # keyed by tour ID
+    tours_json = {}
+    sessions_json = {}
+    for values in tours_qs.values(*Tour.JSON_FIELDS, *session_fields):
+        tours_values[values['id']] = values
+        t_json = tours_json[values['id']] = Tour.values_to_json(values, in_editor=in_editor)
+        t_json['riders'] = []
+        t_json['venues'] = []
+        if values['session_id'] is not None and not values['session_id'] in sessions_json:
+            sessions_json[values['session_id']] = Session.values_to_json({
+                field: values['session__%s' % field] for field in Session.JSON_FIELDS
+            })
+
+    tour_ids = list(tours_json.keys())
+    tour_riders = TourRider.objects.filter(tour_id__in=tour_ids).order_by('id').values(*TourRider.JSON_FIELDS)
+    for tr in sorted(tour_riders, key=lambda tr: tr['rider_role'], reverse=True):
+        tours_json[tr['tour_id']]['riders'].append(TourRider.values_to_json(tr, tours_values[tr['tour_id']]))
+
+    tour_venues = TourVenue.objects.filter(tour_id__in=tour_ids).order_by('id').values(*TourVenue.JSON_FIELDS)
+    for tv in sorted(tour_venues, key=lambda tv: tv['time_arrive']):
+        tours_json[tv['tour_id']]['venues'].append(TourVenue.values_to_json(tv, in_editor=in_editor))
+
+    return tours_json, sessions_json
+
 def get_rider_schedule(start_date, end_date, person):
     """ prepare data for RiderTourSchedule """
     # get data for 2 days prior up to 2 weeks after
 
-    tr_filter = get_date_filter(start_date, end_date, 'tour__time_start')
-    tour_rider_qs = TourRider.objects.select_related(
-        'tour', 'tour__session', 'person'
-    ).prefetch_related(
-        'tour__riders', 'tour__venues'
-    ).filter(
-        person=person, **tr_filter
-    ).order_by('tour__time_start')
+    tr_filter = get_date_filter(start_date, end_date, 'time_start')
+    tours_qs = Tour.objects.filter(
+        id__in=TourRider.objects.filter(person=person).values('tour_id'),
+        **tr_filter,
+    ).order_by('time_start')
+    tours_json, sessions_json = get_tours_json(tours_qs, in_editor=False)
 
     trs_by_date = {}
-    for tr in tour_rider_qs:
-        key_date = json_datetime(localdate(tr.tour.time_start))
-        trs_for_date = trs_by_date.setdefault(key_date, [])
-        trs_for_date.append({
-            'tour': tr.tour.to_json(with_related_data=True, in_editor=False),
-            'session': tr.tour.session.to_json(in_editor=False),
-            'tourRider': tr.to_json(),
-        })
+    for t_json in tours_json.values():
+        tour_date = localdate(datetime.fromtimestamp(t_json['time_start'] / 1000, timezone.get_current_timezone()))
+        trs_for_date = trs_by_date.setdefault(json_datetime(tour_date), [])
+        for tr_json in t_json['riders']:
+            if tr_json['rider_id'] != person.id:
+                continue
+            trs_for_date.append({
+                'tour': t_json,
+                'session': sessions_json.get(t_json['session_id']),
+                'tourRider': tr_json,
+            })
 
     return {
         'tour_dates': trs_by_date,
@@ -167,7 +307,7 @@ def get_rider_schedule(start_date, end_date, person):
             r.id: r.display_name or r.name for r in Person.objects.filter(rider_class__isnull=False)
         },
         'bikeTypes': get_bikes_setting(),
-        'venues': { v.id: v.to_json() for v in Venue.objects.all() },
+        'venues': get_venues_json(),
         'startDate': json_datetime(start_date),
         'endDate': json_datetime(end_date),
     }
@@ -180,47 +320,43 @@ def get_tour_schedule_data(tour_area, tours_date, in_editor=False):
         **date_filter
     ).order_by(
         'time_start', 'tour_type', 'customer_name'
-    ).prefetch_related('riders', 'venues').select_related('session')
+    )
+    tours_json, sessions_json = get_tours_json(tours_qs, in_editor=in_editor)
 
-    all_people = Person.objects.in_bulk()
     # include only riders ON schedule ( + active riders not on schedule - for editor only)
     sched_riders = set() 
 
-    # accumulate only sessions which have tours & tours json at the same time
+    # accumulate only sessions which have tours
     session_order = [] # list of session IDs in order
     sessions_with_tours_json = {} # dict of session ID to session data
-    tours_json = {} # dict of tour ID to tour data
 
-    for t in tours_qs:
-        tours_json[t.id] = t.to_json(with_related_data=True, in_editor=in_editor)
-        if not t.session_id in sessions_with_tours_json:
-            session_order.append(t.session_id)
-            sess_json = sessions_with_tours_json[t.session_id] = t.session.to_json()
+    for t_id, t_json in tours_json.items():
+        sess_id = t_json['session_id']
+        if not sess_id in sessions_with_tours_json:
+            session_order.append(sess_id)
+            sess_json = sessions_with_tours_json[sess_id] = sessions_json[sess_id]
             sess_json['tour_ids'] = []
         else:
-            sess_json = sessions_with_tours_json[t.session_id]
+            sess_json = sessions_with_tours_json[sess_id]
         # build a list of tour IDs for each session, preserving ordering
-        sess_json['tour_ids'].append(t.id)
-        for tr in t.riders.all():
-            sched_riders.add(tr.person_id)
+        sess_json['tour_ids'].append(t_id)
+        for tr_json in t_json['riders']:
+            sched_riders.add(tr_json['rider_id'])
     
+    riders_q = Q(id__in=sched_riders)
     if in_editor:
         # add any active riders not on schedule
-        for r_id, r in all_people.items():
-            if r.active and r.rider_class:
-                sched_riders.add(r_id)
+        riders_q |= Q(active=True, rider_class__isnull=False) & ~Q(rider_class='')
 
     data = {
         'sessions': sessions_with_tours_json,
         'tours': tours_json,
         'session_order': session_order,
         'riders': {
-            r_id: all_people[r_id].to_json(in_editor=in_editor)
-            for r_id in sched_riders
-        },
-        'venues': {
-            v.id: v.to_json() for v in Venue.objects.all()
+            r.id: r.to_json(in_editor=in_editor)
+            for r in Person.objects.filter(riders_q)
         },
+        'venues': get_venues_json(),
         'venue_presets': get_venues_presets(),
         'bike_types': get_bikes_setting(),
         'tours_date': json_datetime(tours_date),
@@ -229,8 +365,12 @@ def get_tour_schedule_data(tour_area, tours_date, in_editor=False):
 
     return data
 
-def get_rider_time_off_json(tours_date):
-    rider_times_off = get_rider_unavailability(tours_date)
+def get_rider_time_off_json(tours_date, refresh=False):
+    """
+    Rider unavailability data for the Tour Schedule Editor, including when the Deputy data was last updated and
+    whether it is stale. Deputy is only queried if refresh=True.
+    """
+    rider_times_off, time_off_row = get_rider_unavailability(tours_date, refresh=refresh)
     unavail_json = {}
     for r_id, times_off in rider_times_off.items():
         t_json = unavail_json[r_id] = []
@@ -242,62 +382,73 @@ def get_rider_time_off_json(tours_date):
                 'tour_id': ts[3] if len(ts) == 4 else None,
             })
 
-    return unavail_json
+    return {
+        'rider_time_off': unavail_json,
+        'rider_time_off_updated': json_datetime(time_off_row.updated) if time_off_row else None,
+        'rider_time_off_stale': is_deputy_time_off_stale(time_off_row),
+    }
 
-def get_tour_summary(start_date, end_date):
-    """ returns a list of tours with type, quantity/pax, bikes, num. riders needed/allocated """
-    date_filter = get_date_filter(start_date, end_date, 'time_start')
-    tours_qs = Tour.objects.prefetch_related('riders').select_related('tour_area').filter(
-        **date_filter,
-    ).order_by('tour_area__sort_order', 'time_start', 'tour_type')
+def on_schedule_changed(dates, pay_dirty_keys=None):
+    """
+    Call this after any changes to Tours or TourRiders, with the dates before and after the change.
+    Recalculates the Tour Dashboard summaries for the dates, notifies any open schedule event streams of the changes
+    in each area on those dates and clears the cached schedule data for them.
+    The pay slots of all the riders on the dates are marked for recalculation, unless the (date, person ID) keys
+    whose pay could have changed are given in pay_dirty_keys.
+    """
+    dates = set(dates)
+    if not dates:
+        return
 
-    tours_by_date = {} # dict of iso dates with data on tours
-    tours_ordered = [] # same dict instances added to a list in order
+    with transaction.atomic():
+        changed_keys = refresh_tour_summaries(dates)
+        record_schedule_changes(changed_keys)
+        invalidate_tour_schedule_cache(changed_keys)
+        mark_pay_slots_dirty(pay_dirty_keys if pay_dirty_keys is not None else (
+            (tour_date, None) for tour_date in dates
+        ))
+
+def refresh_tour_summaries(dates):
+    """
+    Recalculate the precomputed Tour Dashboard summaries (TourSummary rows) for each of the given dates.
+    Returns the (date, area ID) keys of the summaries before and after, ie. the areas with changes on each date.
+    """
+    dates = set(dates)
+    if not dates:
+        return set()
 
-    bike_types = get_bikes_setting()
+    # areas which had tours before the change
+    changed_keys = set(TourSummary.objects.filter(tour_date__in=dates).values_list('tour_date', 'tour_area_id'))
 
+    tours_qs = Tour.objects.filter(
+        get_dates_q(dates, 'time_start'),
+    ).annotate(
+        num_riders=Count('riders'),
+    ).order_by('time_start', 'tour_type')
+
+    summaries = {} # keyed by (date, area ID)
     for t in tours_qs:
-        date = t.time_start.date().isoformat()
-        if not date in tours_by_date:
-            today = tours_by_date[date] = {
-                'areas': {},
-                'date': json_datetime(t.time_start.date()),
-                'isodate': date,
-                'updated': 0,
-            }
-            tours_ordered.append(today)
-        else:
-            today = tours_by_date[date]
-        
-        # count tour info by area within each day
-        if not t.tour_area_id in today['areas']:
-            today_area = today['areas'][t.tour_area_id] = { # areaInfo in TourDashboard.jsx
-                'cancelled': 0,
-                'needs_riders': 0,
-                'filled': 0,
-                'tours': [],
-                'area_id': t.tour_area_id,
-            }
-        else:
-            today_area = today['areas'][t.tour_area_id]
+        tour_date = localdate(t.time_start)
+        if not (summ := summaries.get((tour_date, t.tour_area_id))):
+            summ = summaries[(tour_date, t.tour_area_id)] = TourSummary(
+                tour_date=tour_date, tour_area_id=t.tour_area_id, tours=[],
+            )
 
-        num_riders = len(t.riders.all())
         num_bikes = get_num_bikes(t.bikes)
         canned = t.is_cancelled()
         if canned:
-            today_area['cancelled'] += 1
-        elif num_riders < num_bikes:
-            today_area['needs_riders'] += 1
+            summ.cancelled += 1
+        elif t.num_riders < num_bikes:
+            summ.needs_riders += 1
         else:
-            today_area['filled'] += 1
+            summ.filled += 1
 
-        tour_updated = json_datetime(t.updated)
-        if tour_updated > today['updated']:
-            today['updated'] = tour_updated
+        if summ.tours_updated is None or t.updated > summ.tours_updated:
+            summ.tours_updated = t.updated
 
-        today_area['tours'].append({
+        summ.tours.append({
             'id': t.id,
-            'num_riders': num_riders,
+            'num_riders': t.num_riders,
             'num_bikes': num_bikes,
             'time_start': json_datetime(t.time_start),
             'time_end': json_datetime(t.time_end),
@@ -306,6 +457,59 @@ def get_tour_summary(start_date, end_date):
             'cancelled': canned,
         })
 
+    with transaction.atomic():
+        TourSummary.objects.filter(tour_date__in=dates).delete()
+        TourSummary.objects.bulk_create(summaries.values())
+    return changed_keys | set(summaries.keys())
+
+def fill_missing_tour_summaries(start_date, end_date):
+    """
+    Calculate the TourSummary rows for any dates between start_date and end_date which have tours but no summaries,
+    eg. tours from before the summaries were added. Returns the set of dates which were filled in.
+    """
+    summary_dates = set(TourSummary.objects.filter(
+        tour_date__gte=start_date, tour_date__lte=end_date,
+    ).values_list('tour_date', flat=True).distinct())
+    tour_dates = set(
+        day.date() for day in Tour.objects.filter(**get_date_filter(start_date, end_date, 'time_start')).datetimes(
+            'time_start', 'day')
+    )
+
+    missing_dates = tour_dates - summary_dates
+    if missing_dates:
+        logger.info('Filling in tour summaries for %d dates from %s' % (len(missing_dates), min(missing_dates)))
+        refresh_tour_summaries(missing_dates)
+    return missing_dates
+
+def get_tour_summary(start_date, end_date):
+    """ returns a list of tours with type, quantity/pax, bikes, num. riders needed/allocated """
+    summaries = TourSummary.objects.filter(
+        tour_date__gte=start_date, tour_date__lte=end_date,
+    ).order_by('tour_date', 'tour_area__sort_order')
+
+    tours_by_date = {} # dict of iso dates with data on tours
+    tours_ordered = [] # same dict instances added to a list in order
+
+    for summ in summaries:
+        date = summ.tour_date.isoformat()
+        if not date in tours_by_date:
+            today = tours_by_date[date] = {
+                'areas': {},
+                'date': json_datetime(summ.tour_date),
+                'isodate': date,
+                'updated': 0,
+            }
+            tours_ordered.append(today)
+        else:
+            today = tours_by_date[date]
+
+        # count tour info by area within each day
+        today['areas'][summ.tour_area_id] = summ.to_json()
+
+        tours_updated = json_datetime(summ.tours_updated) or 0
+        if tours_updated > today['updated']:
+            today['updated'] = tours_updated
+
     return tours_ordered
 
 def get_tour_rosters(tours_date, area):
@@ -399,111 +603,178 @@ def get_tour_rosters(tours_date, area):
     ))
     return rosters
 
+def sync_tour_rosters_range(start_date, num_days=7, areas=None, publish=False, dry_run=False):
+    """
+    Sync the rosters for the tour schedules of every active Deputy sync enabled area (or just the given ones) over
+    num_days from start_date with Deputy, in one batch. If publish is set, all the rosters are published,
+    otherwise they keep their published status in Deputy. Returns the same as deputy.sync_deputy_rosters().
+    """
+    if areas is None:
+        areas = Area.objects.filter(active=True, deputy_sync_enabled=True)
+    areas = [area for area in areas if area.active and area.deputy_sync_enabled and area.source_row_id]
+    if not areas:
+        return [], []
+
+    end_date = add_days(start_date, num_days - 1)
+    tour_rosters_list = [
+        roster
+        for day in range(num_days)
+        for area in areas
+        for roster in get_tour_rosters(add_days(start_date, day), area)
+    ]
+    return sync_deputy_rosters_range(start_date, end_date, areas, tour_rosters_list,
+        publish_keys=set(r.cmp_key() for r in tour_rosters_list) if publish else None, dry_run=dry_run)
+
 
 def save_tour_schedule(tours_date, schedule_data):
+    """
+    Save the tours and sessions data from the Tour Schedule Editor. Changes are written with a few bulk queries
+    per model, rather than a query per TourRider, TourVenue, Tour and Session.
+    schedule_data may be a patch with only the changed tours and sessions, and only the changed fields of each tour
+    (where riders and venues are complete lists if included).
+    """
     # get the tours and sessions in a dict keyed by id
     date_filter = get_date_filter(tours_date, tours_date, 'time_start')
     tours = Tour.objects.filter(**date_filter).prefetch_related('venues', 'riders').in_bulk()
     sessions = Session.objects.filter(**date_filter).in_bulk()
-    riders = Person.objects.in_bulk()
-    venues = Venue.objects.in_bulk()
-
-    related_date_filter = get_date_filter(tours_date, tours_date, 'tour__time_start')
-
-    #print(tours)
-    #print(schedule_data)
-    with transaction.atomic():
-        for tour_id, t in schedule_data.get('tours', {}).items():
-            tour = tours.get(int(tour_id))
-            if not tour:
-                continue
+    riders = Person.objects.in_bulk(set(
+        int(tr_json.get('rider_id'))
+        for t in schedule_data.get('tours', {}).values()
+        for tr_json in t.get('riders', [])
+    ))
+    now = timezone.now()
+
+    tours_to_update = []
+    pay_dirty_keys = set() # (date, person ID) of riders added, removed or with a different role
+    tour_riders_to_add = []
+    tour_riders_to_update = {} # keyed by TourRider ID
+    tour_rider_ids_to_delete = []
+    tour_venues_to_add = []
+    tour_venues_to_update = {} # keyed by TourVenue ID
+    tour_venue_ids_to_delete = []
+
+    for tour_id, t in schedule_data.get('tours', {}).items():
+        tour = tours.get(int(tour_id))
+        if not tour:
+            continue
 
+        # riders and venues are only sent if they were changed
+        if 'riders' in t:
             # group by Rider (enforce unique TourRider per tour)
             my_riders = {
-                tr.person.id: tr for tr in tour.riders.all()
+                tr.person_id: tr for tr in tour.riders.all()
             }
-            tour_riders_updated_ids = set() # by TourRider ID
-            tour_riders_existing_ids = set((tr.person.id for tr in tour.riders.all()))
-        
-            for tr_json in t.get('riders', []):
+            tour_riders_updated_ids = set() # by Person ID
+            tour_riders_existing_ids = set(my_riders.keys())
+
+            for tr_json in t['riders']:
                 rider = riders.get(int(tr_json.get('rider_id')))
                 if not rider:
                     continue
                 elif rider.id in my_riders:
                     # update existing row, based on existing rider ID (can't have duplicate TourRiders per rider per tour)
                     tr = my_riders[rider.id]
+                    if tr.rider_role != (tr_json.get('rider_role') or ''):
+                        pay_dirty_keys.add((tours_date, rider.id))
+                    tr.rider_role = tr_json.get('rider_role') or ''
+                    if tr.pk is not None:
+                        tr.updated = now
+                        tour_riders_to_update[tr.pk] = tr
+                        tour_riders_updated_ids.add(rider.id)
                 else:
-                    # No existing tour rider
-                    tr = None
-
-                if not tr:
                     # create new TourRider
                     tr = TourRider(
                         person = rider,
                         tour = tour,
                         rider_role = tr_json.get('rider_role') or '',
                     )
-                    tr.save()
-                else:
-                    # update existing TourRider
-                    tr.rider_role = tr_json.get('rider_role') or ''
-                    tr.save()
-                    tour_riders_updated_ids.add(tr.person.id)
+                    tour_riders_to_add.append(tr)
+                    pay_dirty_keys.add((tours_date, rider.id))
                 my_riders[rider.id] = tr
 
-            tr_ids_deleted = tour_riders_existing_ids - tour_riders_updated_ids
-            for tr_id in tr_ids_deleted:
-                my_riders[tr_id].delete()
+            for person_id in tour_riders_existing_ids - tour_riders_updated_ids:
+                tour_rider_ids_to_delete.append(my_riders[person_id].pk)
+                pay_dirty_keys.add((tours_date, person_id))
 
+        if 'venues' in t:
             my_venues = {
                 tv.id: tv for tv in tour.venues.all()
             }
-            my_tourvenues_existing = set(my_venues.keys())
             my_tourvenues_now = set()
             time_arrive = tour.time_start
-            for tv_json in t.get('venues', []):
+            for tv_json in t['venues']:
                 tvid = tv_json.get('id')
                 tv = my_venues.get(int(tvid)) if tvid is not None else None
                 venue_id = tv_json.get('venue_id')
-                
+
                 if not tv:
                     # create new TourVenue
                     tv = TourVenue(
                         tour_id = tour.id,
                     )
-                
+                    tour_venues_to_add.append(tv)
+                else:
+                    tv.updated = now
+                    tour_venues_to_update[tv.id] = tv
+                    my_tourvenues_now.add(tv.id)
+
                 tv.activity = tv_json.get('activity')
                 tv.time_arrive = time_arrive
                 tv.time_depart = time_arrive + timedelta(minutes=int(tv_json.get('duration')))
                 tv.notes = tv_json.get('notes')
                 tv.venue_id = int(venue_id) if venue_id else None
-                tv.save()
 
-                my_tourvenues_now.add(tv.id)
-                
                 time_arrive = tv.time_depart
 
             # delete leftover TourVenues
-            tvs_deleted = my_tourvenues_existing - my_tourvenues_now
-            for tv_id in tvs_deleted:
-                my_venues[tv_id].delete()
-        
-            # update tour itself
-            for field in ('customer_name', 'customer_contact', 'quantity', 'pickup_location', 'bikes', 'notes'):
-                tour.update_field(field, t.get(field), 'user')
-            tour.save()
-
-        for sess_id, sess_json in schedule_data.get('sessions', {}).items():
-            sess = sessions.get(int(sess_id))
-            if not sess:
+            tour_venue_ids_to_delete.extend(set(my_venues.keys()) - my_tourvenues_now)
+
+        # update tour itself
+        for field in ('customer_name', 'customer_contact', 'quantity', 'pickup_location', 'bikes', 'notes'):
+            if field in t:
+                tour.update_field(field, t[field], 'user')
+        tour.updated = now
+        tours_to_update.append(tour)
+
+    sessions_json = {} # keyed by Session ID
+    for sess_id, sess_json in schedule_data.get('sessions', {}).items():
+        if int(sess_id) in sessions:
+            sessions_json[int(sess_id)] = sess_json
+
+    with transaction.atomic():
+        TourRider.objects.filter(id__in=tour_rider_ids_to_delete).delete()
+        TourRider.objects.bulk_create(tour_riders_to_add)
+        TourRider.objects.bulk_update(tour_riders_to_update.values(), ['rider_role', 'updated'])
+
+        TourVenue.objects.filter(id__in=tour_venue_ids_to_delete).delete()
+        TourVenue.objects.bulk_create(tour_venues_to_add)
+        TourVenue.objects.bulk_update(tour_venues_to_update.values(),
+            ['activity', 'time_arrive', 'time_depart', 'notes', 'venue_id', 'updated'])
+
+        Tour.objects.bulk_update(tours_to_update, [
+            'customer_name', 'customer_contact', 'quantity', 'pickup_location', 'bikes', 'notes',
+            'field_auto_values', 'updated',
+        ])
+
+        # delete empty sessions on save
+        empty_session_ids = set(Session.objects.filter(
+            id__in=sessions_json.keys(),
+        ).annotate(
+            num_tours=Count('tours'),
+        ).filter(num_tours=0).values_list('id', flat=True))
+        Session.objects.filter(id__in=empty_session_ids).delete()
+
+        sessions_to_update = []
+        for sess_id, sess_json in sessions_json.items():
+            if sess_id in empty_session_ids:
                 continue
+            sess = sessions[sess_id]
+            sess.title = sess_json['title']
+            sess.updated = now
+            sessions_to_update.append(sess)
+        Session.objects.bulk_update(sessions_to_update, ['title', 'updated'])
 
-            if sess.tours.count() == 0:
-                # delete empty sessions on save
-                sess.delete()
-            else:
-                sess.title = sess_json['title']
-                sess.save()
+        on_schedule_changed([tours_date], pay_dirty_keys=pay_dirty_keys)
 
 def get_venues_report(start_date, end_date):
     """
@@ -560,10 +831,12 @@ def get_venues_report(start_date, end_date):
 
     return venues
 
-def get_rider_unavailability(tours_date):
-    """ query Deputy API and tour schedules to determine rider availability on the given date """
-    api = DeputyAPI()
-
+def get_rider_unavailability(tours_date, refresh=False):
+    """
+    use the cached Deputy leave/unavailability and tour schedules to determine rider availability on the given date
+    returns the unavailability by rider ID, and the DeputyTimeOff row (or None if the date isn't cached, or Deputy
+    couldn't be queried)
+    """
     deputy_riders = {
         r.source_row_id: r
         for r in Person.objects.filter(
@@ -576,8 +849,9 @@ def get_rider_unavailability(tours_date):
         **get_date_filter(tours_date, tours_date, 'tour__time_start')
     )
 
+    time_off_row = None
     try:
-        dpt_employee_time_off = api.query_leave_unavailability(tours_date)
+        dpt_employee_time_off, time_off_row = get_deputy_time_off(tours_date, refresh=refresh)
         rider_unavail = {}
         for emp_id, emp_time in dpt_employee_time_off.items():
             if not emp_id in deputy_riders:
@@ -594,4 +868,4 @@ def get_rider_unavailability(tours_date):
             ( tr.tour.time_start, tr.tour.time_end, 'already on tours', tr.tour.id )
         )
     
-    return rider_unavail
+    return rider_unavail, time_off_row
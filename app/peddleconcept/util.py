@@ -266,6 +266,13 @@ def get_date_filter(start_date, end_date, field):
         '%s__lte' % field: dt_end,
     }
 
+def get_dates_q(dates, field):
+    """ like get_date_filter() but as a Q object matching any of the given days """
+    q = models.Q(pk__in=[])
+    for day_date in dates:
+        q |= models.Q(**get_date_filter(day_date, day_date, field))
+    return q
+
 def today():
     return localdate(now())
 
@@ -18,6 +18,7 @@ from .tours import (
     rider_schedules_view,
     rider_tours_data_view,
     tours_data_view,
+    schedule_events_view,
 )
 
 from .riders import (
@@ -36,6 +37,7 @@ from .riders import (
 from .payroll import (
     tour_pays_view,
     tour_pays_data_view,
+    tour_pays_export_view,
 )
 
 from .auth import (
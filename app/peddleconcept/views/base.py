@@ -1,4 +1,6 @@
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, HttpResponseNotModified, JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.http import parse_etags, quote_etag
 from django.urls import reverse
 from django.shortcuts import render
 from django.utils.safestring import mark_safe
@@ -6,6 +8,7 @@ from django.conf import settings
 from .decorators import require_person_or_user
 
 import json
+import hashlib
 from peddleconcept.models import Area
 
 @require_person_or_user()
@@ -30,3 +33,22 @@ def base_context(page_name, react, extra_context, jsvars):
 def render_base(request, page_name, react=False, context=None, jsvars={}, template=None):
     ctx = base_context(page_name, react, context, jsvars)
     return render(request, ('%s.html' % page_name) if template is None else template, context=ctx)
+
+def get_etag(*version_data):
+    """ returns a quoted ETag for any JSON-serialisable version data (eg. including the request parameters) """
+    data = json.dumps(version_data, sort_keys=True, cls=DjangoJSONEncoder)
+    return quote_etag(hashlib.md5(data.encode()).hexdigest())
+
+def conditional_json_response(request, etag, get_data):
+    """
+    JsonResponse for AJAX data views which supports If-None-Match, including for POST requests.
+    get_data() is only called to build the response if the client doesn't already have the current data.
+    """
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        resp = HttpResponseNotModified()
+    else:
+        resp = JsonResponse(get_data())
+    resp['ETag'] = etag
+    # clients must always check for changes, and the data is specific to the user
+    resp['Cache-Control'] = 'private, no-cache'
+    return resp
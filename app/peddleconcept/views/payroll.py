@@ -2,18 +2,21 @@ import json, logging
 from datetime import timedelta, date
 
 from django.utils import timezone
+from django.utils.timezone import localdate
 from django.urls import reverse
-from django.http import HttpResponseBadRequest, JsonResponse
+from django.contrib.auth.decorators import user_passes_test
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 
 from peddleconcept.util import (
     start_of_week, add_days, json_datetime, from_json_date, get_iso_date
 )
 from peddleconcept.pay_reports import (
-    save_tour_pay_config, update_payslots, load_tour_pay_report
+    save_tour_pay_config, update_payslots, load_tour_pay_report, PAY_RECALCULATE_DAYS
 )
+from peddleconcept.pay_export import get_pay_export, get_pay_export_filename
 from .base import render_base
-from .decorators import require_person_or_user
+from .decorators import require_person_or_user, staff_required
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +43,7 @@ def tour_pays_view(request, year_num=None, week_num=None, week_start=None):
     jsvars = {
         'urls': {
             'tour_report_data': reverse('tour_pays_data'),
+            'tour_pays_export_aba': reverse('tour_pays_export', args=[week_start.isoformat(), 'aba']),
         },
         'start_date': json_datetime(week_start),
         'end_date': json_datetime(week_end),
@@ -60,23 +64,45 @@ def tour_pays_data_view(request):
         if 'tour_pay_config' in reqdata:
             save_tour_pay_config(reqdata['tour_pay_config'])
     
+        payslot_results = []
         if 'payslots' in reqdata:
             logger.info("updating %d payslots" % len(reqdata['payslots']))
-            update_payslots(reqdata['payslots'])
+            payslot_results = update_payslots(reqdata['payslots'])
 
         reset = False
         if 'action' in reqdata:
             if reqdata['action'] == 'reset':
                 reset = True
 
-        today = date.today()
-        if (today - start_date).days >= 14:
-            recalculate = False
-        else:
-            recalculate = True
+        recalculate = (localdate() - start_date).days < PAY_RECALCULATE_DAYS
 
         data = load_tour_pay_report(start_date, end_date, recalculate=recalculate, reset=reset)
+        # only the changed payslots, so the editor can show which ones were saved and which ones were not
+        data['payslot_results'] = [res for res in payslot_results if res['result'] != 'unchanged']
     else:
         data = {}
 
-    return JsonResponse(data)
\ No newline at end of file
+    return JsonResponse(data)
+
+@user_passes_test(staff_required)
+@require_http_methods(['GET'])
+def tour_pays_export_view(request, week_start, export_format):
+    """
+    Streams the Weekly Tour Pays totals as a CSV summary or an ABA bank file, from the stored pay slots:
+    they are recalculated when the report is loaded, not by the export
+    """
+    if not (week_start := get_iso_date(week_start)):
+        return HttpResponseBadRequest("Bad date format in URL (expecting YYYY-MM-DD)")
+
+    week_start = start_of_week(week_start)
+    week_end = week_start + timedelta(days=6)
+
+    try:
+        lines = get_pay_export(week_start, week_end, export_format, recalculate=False)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    response = StreamingHttpResponse(lines, content_type='text/csv' if export_format == 'csv' else 'text/plain')
+    response['Content-Disposition'] = 'attachment; filename=%s' % get_pay_export_filename(
+        week_start, week_end, export_format)
+    return response
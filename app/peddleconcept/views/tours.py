@@ -1,6 +1,7 @@
 import json
 
-from django.http import HttpResponseRedirect, HttpResponseBadRequest, JsonResponse, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_http_methods
 from django.shortcuts import render
@@ -11,11 +12,12 @@ from peddleconcept.util import (
     json_datetime, get_iso_date, from_json_date, today
 )
 from peddleconcept.tours.schedules import (
-    get_tour_schedule_data, get_rider_schedule, save_tour_schedule,
-    get_rider_time_off_json,
+    get_cached_tour_schedule_data, get_rider_schedule, save_tour_schedule,
+    get_rider_time_off_json, get_rider_schedule_version, get_tour_schedule_version,
 )
+from peddleconcept.tours.schedule_events import schedule_event_stream, sync_schedule_event_stream
 
-from .base import render_base
+from .base import render_base, get_etag, conditional_json_response
 from .decorators import require_person_or_user
 
 def get_schedule_or_redirect(tour_area_id, tours_date):
@@ -51,6 +53,7 @@ def schedules_view(request, tours_date=None, tour_area_id=None):
         tours_date, tour_area = res
 
     jsvars = {
+        'events_url': reverse('tour_sched_events'),
         'data_url': reverse('tour_sched_data'),
         'update_url': reverse('update_tours'),
         'tour_area_id': tour_area.id,
@@ -93,7 +96,12 @@ def rider_tours_data_view(request):
     start_date = from_json_date(reqdata['startDate'])
     end_date = from_json_date(reqdata['endDate'])
 
-    return JsonResponse(get_rider_schedule(start_date, end_date, request.person))
+    etag = get_etag(
+        'rider_schedule', reqdata['startDate'], reqdata['endDate'], request.person.id,
+        get_rider_schedule_version(start_date, end_date, request.person),
+    )
+    return conditional_json_response(
+        request, etag, lambda: get_rider_schedule(start_date, end_date, request.person))
 
 @require_person_or_user()
 @require_http_methods(['POST'])
@@ -108,5 +116,37 @@ def tours_data_view(request):
     except (ValueError, Area.DoesNotExist):
         return HttpResponseBadRequest('Invalid tour_area_id')
     
-    return JsonResponse(get_tour_schedule_data(tour_area, tours_date, in_editor=False))
+    version = get_tour_schedule_version(tour_area, tours_date)
+    etag = get_etag('tour_schedule', reqdata['tours_date'], tour_area.id, version)
+    return conditional_json_response(
+        request, etag, lambda: get_cached_tour_schedule_data(tour_area, tours_date, version))
 
+@require_person_or_user()
+@require_http_methods(['GET'])
+def schedule_events_view(request):
+    """
+    Server-Sent Events stream of schedule changes for TourScheduleViewer and TourDashboard, so they only reload
+    their data when something has changed. Filtered by tour_area_id and tours_date, or start_date and end_date.
+    """
+    try:
+        tour_area_id = int(request.GET['tour_area_id']) if 'tour_area_id' in request.GET else None
+        filters = {
+            'tour_area_id': tour_area_id,
+            'start_date': from_json_date(request.GET.get('tours_date') or request.GET['start_date']),
+            'end_date': from_json_date(request.GET.get('tours_date') or request.GET['end_date']),
+        }
+        # set by the browser when reconnecting
+        last_id = int(request.headers['Last-Event-ID']) if request.headers.get('Last-Event-ID') else None
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest('Invalid tour_area_id, tours_date, start_date or end_date')
+
+    if isinstance(request, ASGIRequest):
+        stream = schedule_event_stream(last_id, **filters)
+    else:
+        stream = sync_schedule_event_stream(last_id, **filters)
+
+    resp = StreamingHttpResponse(stream, content_type='text/event-stream')
+    resp['Cache-Control'] = 'no-cache'
+    # stop nginx from buffering the events
+    resp['X-Accel-Buffering'] = 'no'
+    return resp
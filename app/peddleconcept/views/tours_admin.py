@@ -1,11 +1,13 @@
 import json
 from datetime import timedelta
+from functools import partial
 from django.contrib.auth.decorators import user_passes_test
 from django.views.decorators.http import require_http_methods
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils import timezone
 from django.http import HttpResponseRedirect, HttpResponseBadRequest, JsonResponse, HttpResponse
+from django.db import transaction
 
 from peddleconcept.util import (
     get_date_filter, get_iso_date, json_datetime, from_json_date, from_json_date,
@@ -14,14 +16,15 @@ from peddleconcept.util import (
 from peddleconcept.tours.schedules import (
     get_autoscan_status, get_tour_summary, get_venues_report,
     get_rider_unavailability, get_tour_schedule_data,
-    get_rider_time_off_json, save_tour_schedule, get_tour_rosters,
+    get_rider_time_off_json, save_tour_schedule, get_tour_rosters, get_tour_summary_version,
+    get_tour_schedule_version, fill_missing_tour_summaries,
 )
 from peddleconcept.tours.rezdy import update_from_rezdy
 from peddleconcept.tours.fringe import update_from_fringe
 from peddleconcept.models import Area
 from peddleconcept.deputy import sync_deputy_rosters
 
-from .base import render_base
+from .base import render_base, get_etag, conditional_json_response
 from .decorators import staff_required
 from .tours import get_schedule_or_redirect
 
@@ -68,6 +71,14 @@ def roster_admin_view(request, tour_area_id=None, tours_date=None):
     jsvars = get_tour_admin_jsvars(request, tour_area, tours_date)
     return render_base(request, 'roster_admin', react=True, jsvars=jsvars)
 
+def get_editor_version(tour_area, tours_date):
+    """
+    version of the schedule data in the editor, which must match the base_version of any saved changes.
+    Only changes to the schedule rows conflict with the editor's changes, not eg. settings or rider profile changes
+    """
+    return get_etag('tour_schedule', tour_area.id,
+        get_tour_schedule_version(tour_area, tours_date, schedule_only=True))
+
 @user_passes_test(staff_required)
 @require_http_methods(['POST'])
 def schedule_admin_data_view(request):
@@ -85,12 +96,24 @@ def schedule_admin_data_view(request):
     if not tour_area or not tours_date:
         return HttpResponseBadRequest('Invalid tour_area_id or tours_date')
     
-    if 'tours' in reqdata:
+    patch = reqdata.get('patch') or {}
+    if patch.get('tours') or patch.get('sessions'):
+        # only the changes made in the editor since the data with base_version was loaded
+        with transaction.atomic():
+            # lock the area so concurrent saves are checked against each other's changes
+            Area.objects.select_for_update().get(id=tour_area.id)
+            if patch.get('base_version') != get_editor_version(tour_area, tours_date):
+                return HttpResponse(
+                    'The schedule was changed by someone else after you opened it. '
+                    'Your changes were not saved: reload the page to see the latest schedule.',
+                    status=409, content_type='text/plain')
+            save_tour_schedule(tours_date, patch)
+    elif 'tours' in reqdata:
         save_tour_schedule(tours_date, reqdata)
 
     data = {}
-    if action == 'open':
-        data['rider_time_off'] = get_rider_time_off_json(tours_date)
+    if action in ['open', 'refresh_time_off']:
+        data.update(get_rider_time_off_json(tours_date, refresh=(action == 'refresh_time_off')))
     
     if action == 'close':
         pass # empty success response on editor save & close
@@ -107,6 +130,7 @@ def schedule_admin_data_view(request):
         })
     else:
         data.update(get_tour_schedule_data(tour_area, tours_date, in_editor=True))
+        data['version'] = get_editor_version(tour_area, tours_date)
     
     return JsonResponse(data)
 
@@ -122,6 +146,7 @@ def schedules_dashboard_view(request, tours_date=None):
 
     jsvars = {
         'date': json_datetime(today),
+        'events_url': reverse('tour_sched_events'),
         'data_url': reverse('tour_dashboard_data'),
         'tour_areas': { area.id: area.to_json() for area in Area.objects.filter(active=True) },
         'report_url': reverse('tour_pays', kwargs={'week_start': 'DATE'}),
@@ -151,10 +176,11 @@ def schedules_dashboard_data_view(request):
     if not start_date or not end_date:
         return HttpResponseBadRequest()
 
-    data = {
+    fill_missing_tour_summaries(start_date, end_date)
+    etag = get_etag('tour_summary', start_date, end_date, get_tour_summary_version(start_date, end_date))
+    return conditional_json_response(request, etag, lambda: {
         'tours': get_tour_summary(start_date, end_date),
-    }
-    return JsonResponse(data)
+    })
 
 @user_passes_test(staff_required)
 @require_http_methods(['POST'])
@@ -169,7 +195,8 @@ def update_tours_data(request):
         return HttpResponseBadRequest()
 
     updates = (
-        (update_rezdy, update_from_rezdy),
+        # manual updates always re-merge the whole day, even if the Rezdy manifest is unchanged
+        (update_rezdy, partial(update_from_rezdy, full=True)),
         (update_fringe, update_from_fringe),
     )
 
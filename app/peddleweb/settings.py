@@ -92,6 +92,27 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# The 'schedules' cache holds the rendered tour schedule data (see peddleconcept.tours.schedules).
+# It is local to each process by default, set SCHEDULE_CACHE_DIR to share it between processes on the same server.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'schedules': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('SCHEDULE_CACHE_DIR'),
+        'TIMEOUT': 3600*24,
+    } if os.environ.get('SCHEDULE_CACHE_DIR') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'schedules',
+        'TIMEOUT': 3600*24,
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -44,7 +44,9 @@ class AjaxDataComponent extends Component {
             ...this.props.getPostData(this.state.data, verb),
             action: verb,
         };
-        post_data(this.props.postUrl, postData, (ok, responseOrig) => {
+        post_data(this.props.postUrl, postData, (ok, responseOrig, jqXHR) => {
+            // save rejected because the data changed on the server: show the reason
+            if (!ok && jqXHR && jqXHR.status === 409) responseOrig = jqXHR.responseText;
             let response = responseOrig;
             if (onComplete) {
                 response = onComplete(ok, response, verb);
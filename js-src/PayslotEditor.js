@@ -36,14 +36,19 @@ class PayslotEditor extends Component {
 
     render() {
         const payslot = this.props.payslot;
+        const conflict = this.props.conflict;
     
-        return createElement(ListGroup.Item, { className: 'RiderPaySlot ps-' + payslot.slot_type }, 
+        return createElement(ListGroup.Item, {
+                className: 'RiderPaySlot ps-' + payslot.slot_type + (conflict ? ' ps-conflict' : ''),
+            },
             createElement(Row, {},
                 createElement(Col, { className: 'rider-tour-info', xs: 9 }, 
                     createElement('div', { className: 'rider-tour-times' }, 
                         `${format_time_12h(payslot.time_start)}\u2012${format_time_12h(payslot.time_end)} `),
                     this.getField('description', 'rider-tour-type'),
                     this.getField('pay_reason', 'rider-tour-type'),
+                    conflict ? createElement('div', { className: 'hints ps-conflict-hint' },
+                        `Not saved: ${conflict.fields.join(', ')} changed by someone else`) : null,
                 ),
                 createElement(Col, { className: 'rider-tour-pay-info', xs: 3 },
                     createElement(Stack, { direction: 'vertical' },
@@ -2,6 +2,7 @@ const { useState, useMemo, useEffect } = require("react");
 const { Badge, Col, Row, Button, ButtonGroup } = require("react-bootstrap");
 const { CalendarNav, getDateRange } = require("./CalendarNav");
 const { CheckButton } = require("./components");
+const { useScheduleEvents } = require("./hooks");
 const { post_data, WEEKDAYS, firstDayOfWeek, addDays, format_time_12h, format_iso_date, format_date, plural, format_datetime, format_short_date, format_datetime_short, format_timedelta } = require("./utils");
 
 function areaSort(tourAreas) {
@@ -194,13 +195,14 @@ function WeeklyTourSummary({ summaryData, weekStart, tourAreas }) {
     </div>;
 }
 
-function TourDashboard({ date_today, data_url, last_scan_begin, last_scan, scan_interval, scan_ok, tourAreas }) {
+function TourDashboard({ date_today, data_url, events_url, last_scan_begin, last_scan, scan_interval, scan_ok, tourAreas }) {
     const [summaryData, setSummaryData] = useState(null);
     const [selected, setSelected] = useState(date_today);
     const badges = useMemo(() => getBadges(summaryData, tourAreas), [summaryData]);
     
-    useEffect(() => {
-        let dateRange = getDateRange(date_today, 1, 1);
+    const dateRange = getDateRange(date_today, 1, 1);
+
+    function loadSummary() {
         post_data(data_url, {
             start_date: dateRange[0].getTime(),
             end_date: dateRange[1].getTime(),
@@ -208,7 +210,14 @@ function TourDashboard({ date_today, data_url, last_scan_begin, last_scan, scan_
             if (ok) setSummaryData(data);
             else console.log('TourDashboard fetch error:', data);
         });
-    }, [date_today]);
+    }
+
+    useEffect(loadSummary, [date_today]);
+    // reload whenever tours change within the date range
+    useScheduleEvents(events_url, {
+        start_date: dateRange[0].getTime(),
+        end_date: dateRange[1].getTime(),
+    }, loadSummary);
 
     const weekStart = new Date(selected);
     firstDayOfWeek(weekStart);
@@ -1,5 +1,5 @@
 const { createElement, Component } = require('react');
-const { Table, Row, Col, Card, ListGroup, Button, Stack, Container } = require('react-bootstrap');
+const { Table, Row, Col, Card, ListGroup, Button, Stack, Container, Badge } = require('react-bootstrap');
 const PayslotEditor = require('./PayslotEditor.js');
 const FormattedInput = require('./FormattedInput.js');
 const TourPayConfigurator = require('./TourPayConfigurator.js');
@@ -67,6 +67,7 @@ class RiderTourDay extends Component {
                             // yay for prop drilling!
                             payslot: payslot,
                             key: payslot.id,
+                            conflict: this.props.conflicts[payslot.id],
                             onChange: this.onPayslotChanged,
                         })
                 ),
@@ -138,6 +139,12 @@ class TourPayReportV2 extends React.Component {
     }
 
     render() {
+        // payslots which were changed by someone else, so the last save did not update them
+        const conflicts = Object.fromEntries((this.props.payslot_results || [])
+            .filter(res => res.result === 'conflict')
+            .map(res => [res.id, res]));
+        const numConflicts = Object.keys(conflicts).length;
+
         return <div className='TourPayReport'>
             <Stack direction='horizontal' className='Toolbar m-1'>
                 <Button variant='primary' className='mx-1' key={1}
@@ -153,7 +160,14 @@ class TourPayReportV2 extends React.Component {
                     onClick={this.exportCSV}>
                     Export CSV
                 </Button>
+                <Button variant="secondary" className="mx-1" key={5}
+                    href={window.jsvars.urls.tour_pays_export_aba}>
+                    Download ABA File
+                </Button>
                 { this.props.ajaxToolbar }
+                { numConflicts > 0 ? <Badge bg="warning" text="dark" className="mx-1" key={4}>
+                    { numConflicts } pay slot(s) not saved: changed by someone else
+                </Badge> : null }
             </Stack>
             {
                 this.state.showConfig ? <TourPayConfigurator
@@ -179,6 +193,7 @@ class TourPayReportV2 extends React.Component {
                                 date: daystr,
                                 riderId: riderPay.id,
                                 payslots: riderPay.pay_days[isodate],
+                                conflicts: conflicts,
                                 onPayslotChanged: this.onPayslotChanged,
                             }) : createElement(EmptyRiderTourDay, { key: isodate }))
                     ))
@@ -372,6 +372,8 @@ class TourScheduleEditor extends React.Component {
                                     return {
                                         ...response,
                                         rider_time_off: this.props.rider_time_off,
+                                        rider_time_off_updated: this.props.rider_time_off_updated,
+                                        rider_time_off_stale: this.props.rider_time_off_stale,
                                     };
                                 } else {
                                     return { ... this.props }; // keep existing data but show save error
@@ -385,6 +387,24 @@ class TourScheduleEditor extends React.Component {
                     { this.props.errorMsg ? <Badge bg="danger" className="me-1" key={44}>{ this.props.errorMsg }</Badge> : null }
                     <CheckButton checked={this.state.availability} variant="secondary" className="me-1"
                         onChange={(val) => this.setState({availability: val})} text="Show Available Riders" />
+                    <Badge bg={ this.props.rider_time_off_stale ? 'warning' : 'light' } text="dark" className="me-1" key={5}
+                        title="Rider leave and unavailability is cached from Deputy">
+                        { this.props.rider_time_off_updated ?
+                            `Deputy availability: ${new Date(this.props.rider_time_off_updated).toLocaleTimeString()}`
+                            : 'Deputy availability not loaded' }
+                    </Badge>
+                    <Button key={6} variant="outline-secondary" size="sm" className="me-1"
+                        title="Save and reload rider leave and unavailability from Deputy"
+                        onClick={() => {
+                            this.props.onSave('refresh_time_off', (ok, response) => {
+                                this.setState({ loading: false });
+                                return ok ? response : { ...this.props };
+                            });
+                            this.setState({ loading: 'refresh-time-off' });
+                        }}>
+                        { this.state.loading == 'refresh-time-off' ? <Spinner animation="border" className="me-1" size="sm"/>
+                            : <i className="bi-arrow-clockwise"/> }
+                    </Button>
                 </Stack>
                 <div key={0}>
                     <ul className="tips">
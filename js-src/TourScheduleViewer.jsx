@@ -2,7 +2,7 @@ const { useState, useEffect } = require("react");
 const { Row, Col, Badge, Pagination, Alert, Spinner, Dropdown, Stack, ButtonGroup, Button } = require("react-bootstrap");
 const { TSBikesInfo, count_bikes, join_bikes, TSRiderInfo } = require("./BikesWidget");
 const { CheckButton } = require("./components");
-const { useAjaxData } = require("./hooks");
+const { useAjaxData, useScheduleEvents } = require("./hooks");
 const { get_venues_summary } = require("./TourVenuesEditor");
 const { format_short_date, htmlLines, plural, firstDayOfWeek, addDays, post_data, format_iso_date, today } = require("./utils");
 
@@ -205,6 +205,12 @@ function TourScheduleViewer({ tourAreas, initialAreaId, initialDate, isAdmin, my
                 }
             }, null, () => ({ toursDate: new Date(initialDate), tourAreaId: initialAreaId }));
 
+    // reload only when the tours shown have changed
+    useScheduleEvents(window.jsvars.events_url, {
+        tour_area_id: tourAreaId,
+        tours_date: toursDate.valueOf(),
+    }, () => reloadData());
+
     // override the nav button behaviour to avoid rebooting the tour schedule viewer
     useEffect(() => {
         function onAreaNavClick(e) {
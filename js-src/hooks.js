@@ -1,5 +1,5 @@
 const $ = require('jquery');
-const { useState, useEffect } = require("react");
+const { useState, useEffect, useRef } = require("react");
 const { post_data, format_num } = require("./utils");
 
 // from https://stackoverflow.com/questions/46240647/react-how-to-force-a-function-component-to-render
@@ -19,21 +19,29 @@ function useAjaxData(
 
     const [error, setError] = useState(null); // error message from failed XHR
     const [data, setData] = useState(null); // data response from last successful XHR
+    const etag = useRef(null); // ETag of the data from the last successful XHR
 
     function sendRequest(dataParams) {
         var handleError = true, xhrComplete = false;
-        var xhr = post_data(url, f_getRequestData(data, dataParams), (ok, respData) => {
+        var headers = etag.current ? { "If-None-Match": etag.current } : {};
+        var xhr = post_data(url, f_getRequestData(data, dataParams), (ok, respData, jqXHR) => {
             xhrComplete = true;
             // the XHR triggering this event was aborted intentionally, simply return and don't touch state
             if (!handleError) return;
+            if (ok && jqXHR.status === 304) {
+                // data unchanged since the last request
+                setError(null);
+                return;
+            }
             if (f_handleResponse) f_handleResponse(ok, respData);
             if (ok) {
+                etag.current = jqXHR.getResponseHeader('ETag');
                 setData(respData);
                 setError(null);
             } else {
                 setError('Error loading data: ' + respData);
             }
-        });
+        }, headers);
 
         return {
             silentlyAbort: () => {
@@ -61,6 +69,23 @@ function useAjaxData(
     return [data, isLoading, error, dataParams, reloadData];
 }
 
+// Subscribe to the schedule changes stream (Server-Sent Events) filtered by the given query params,
+// calling onChange(change) for each change, or onChange(null) when the changes since the last event are no longer
+// known and everything should be reloaded. The browser reconnects automatically if the stream is closed.
+function useScheduleEvents(url, params, onChange) {
+    const callback = useRef(onChange);
+    callback.current = onChange; // always call the latest onChange, without reconnecting
+    const query = $.param(params);
+
+    useEffect(() => {
+        if (!url || !window.EventSource) return;
+        const source = new EventSource(url + '?' + query);
+        source.onmessage = (event) => callback.current(JSON.parse(event.data));
+        source.addEventListener('reload', () => callback.current(null));
+        return () => source.close();
+    }, [url, query]);
+}
+
 const LOCK_POLL_INTERVAL = 30*1000; // every 30seconds
 
 function useEditableAjaxData(
@@ -361,4 +386,4 @@ function useTimeout(
         resetTimer, stopTimer];
 }
 
-module.exports = {useAjaxData, useTimeout, useForceUpdate, useEditableAjaxData};
\ No newline at end of file
+module.exports = {useAjaxData, useTimeout, useForceUpdate, useEditableAjaxData, useScheduleEvents};
\ No newline at end of file
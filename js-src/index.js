@@ -13,12 +13,13 @@ const { createElement, useState, useRef } = require('react');
 const TourScheduleEditor = require('./TourScheduleEditor.js');
 const AjaxDataComponent = require('./AjaxDataComponent.js');
 const TourPayReport = require('./TourPayReport.js');
-const { parse_datetime, post_data } = require('./utils');
+const { parse_datetime, post_data, get_schedule_patch } = require('./utils');
 
 // for tour schedule editor and rosters approval view
 function ScheduleAdminApp({ initialPage }) {
     const [page, setPage] = useState(initialPage);
     const dataRef = useRef(null);
+    const baseDataRef = useRef(null); // copy of the schedule as last loaded from the server, to find the edits
 
     if (page == 'schedules_editor') {
         return <AjaxDataComponent
@@ -32,9 +33,10 @@ function ScheduleAdminApp({ initialPage }) {
             postUrl={window.jsvars.urls.tour_sched_data}
             dataRef={ (data) => {
                 dataRef.current = window.tourData = data;
+                if (data.tours) baseDataRef.current = JSON.parse(JSON.stringify(data));
             }}
             getPostData={ ({ tours, sessions }, action) => ({
-                tours, sessions, action,
+                patch: get_schedule_patch(baseDataRef.current, tours, sessions), action,
             })}
             dataConsumerProps={{
                 setPage,
@@ -123,6 +125,7 @@ function load_tour_dashboard(selected) {
         createElement(TourDashboard, {
             date_today: parse_datetime(window.jsvars.date),
             data_url: window.jsvars.data_url,
+            events_url: window.jsvars.events_url,
             last_scan: window.jsvars.last_scan,
             scan_interval: window.jsvars.scan_interval,
             scan_ok: window.jsvars.last_scan_begin >= ((new Date()).valueOf() - window.jsvars.scan_interval * 60 * 1000) ||
@@ -21,7 +21,7 @@ function getCookie(name) {
 
 const csrftoken = getCookie('csrftoken');
 
-function post_data(url, data, callback) {
+function post_data(url, data, callback, headers) {
     return $.ajax(url, {
         data: JSON.stringify(data),
         method: 'POST',
@@ -29,9 +29,11 @@ function post_data(url, data, callback) {
         contentType: "application/json",
         headers: {
             "X-CSRFToken": csrftoken,
+            ...headers,
         },
-        success: (data, textStatus, jqXHR) => callback(true, data),
-        error: (jqXHR, textStatus, errorThrown) => callback(false, errorThrown),
+        // data is undefined if the server responds with 304 Not Modified
+        success: (data, textStatus, jqXHR) => callback(true, data, jqXHR),
+        error: (jqXHR, textStatus, errorThrown) => callback(false, errorThrown, jqXHR),
     });
 }
 
@@ -334,6 +336,34 @@ function getWeekName(today, weekStart) {
     }
 }
 
+// tour fields saved by the Tour Schedule Editor, see save_tour_schedule()
+const TOUR_PATCH_FIELDS = ['customer_name', 'customer_contact', 'quantity', 'pickup_location', 'bikes', 'notes', 'riders', 'venues'];
+
+// Get only the changes to the tours & sessions since the base data (a copy of the data as loaded from the server)
+function get_schedule_patch(base, tours, sessions) {
+    const changed = (a, b) => JSON.stringify(a) !== JSON.stringify(b);
+    const patch = {
+        base_version: base.version,
+        tours: {},
+        sessions: {},
+    };
+
+    for (const [tour_id, tour] of Object.entries(tours)) {
+        const baseTour = base.tours[tour_id] || {};
+        const changes = {};
+        for (const field of TOUR_PATCH_FIELDS) {
+            if (changed(tour[field], baseTour[field])) changes[field] = tour[field];
+        }
+        if (Object.keys(changes).length > 0) patch.tours[tour_id] = changes;
+    }
+
+    for (const [sess_id, sess] of Object.entries(sessions)) {
+        const baseSess = base.sessions[sess_id] || {};
+        if (changed(sess.title, baseSess.title)) patch.sessions[sess_id] = { title: sess.title };
+    }
+    return patch;
+}
+
 function today() {
     let now = new Date();
     now.setMilliseconds(0);
@@ -375,5 +405,6 @@ module.exports = {
     formatCSV,
     htmlLines,
     getWeekName,
+    get_schedule_patch,
     today,
 };
\ No newline at end of file
@@ -1,5 +1,5 @@
 /* Unit test code - should not be published to website (but meh, whatever, if it is for some reason) */
-const { format_time_12h, format_num } = require('./utils.js');
+const { format_time_12h, format_num, get_schedule_patch } = require('./utils.js');
 
 const date = new Date(1648261006860); //Sat Mar 26 2022 10:16:46 GMT+0800 (Australian Western Standard Time)
 
@@ -44,4 +44,34 @@ test('format numbers', () => {
     expect(format_num(NaN, 0, 0)).toBe('');
     expect(format_num(Infinity, 0, 0)).toBe('');
     expect(format_num(undefined, 0, 0)).toBe('');
-});
\ No newline at end of file
+});
+
+test('schedule patch', () => {
+    const base = {
+        version: '"abc"',
+        tours: {
+            1: { customer_name: 'A', notes: '', bikes: { bike: 1 }, riders: [{ rider_id: 1, rider_role: '' }], venues: [] },
+            2: { customer_name: 'B', notes: '', bikes: { bike: 2 }, riders: [], venues: [] },
+        },
+        sessions: { 5: { title: 'Session' } },
+    };
+    const edited = JSON.parse(JSON.stringify(base));
+
+    // no changes
+    expect(get_schedule_patch(base, edited.tours, edited.sessions)).toEqual({
+        base_version: '"abc"', tours: {}, sessions: {},
+    });
+
+    // only the changed fields of changed tours
+    edited.tours[1].riders.push({ rider_id: 2, rider_role: 'lead' });
+    edited.tours[2].notes = 'hello';
+    edited.sessions[5].title = 'New title';
+    expect(get_schedule_patch(base, edited.tours, edited.sessions)).toEqual({
+        base_version: '"abc"',
+        tours: {
+            1: { riders: [{ rider_id: 1, rider_role: '' }, { rider_id: 2, rider_role: 'lead' }] },
+            2: { notes: 'hello' },
+        },
+        sessions: { 5: { title: 'New title' } },
+    });
+});